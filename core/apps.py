@@ -6,4 +6,6 @@ class CoreConfig(AppConfig):
     name = "core"
 
     def ready(self):
+        import core.checks  # noqa: F401
+        import core.metrics  # noqa: F401
         import core.signals  # noqa: F401
@@ -0,0 +1,110 @@
+"""
+Hot/cold split of echoes by age.
+
+The archive_echoes command moves echoes older than ARCHIVE["HORIZON"], with
+their comments and likes, into the ArchivedEcho, ArchivedComment and
+ArchivedLike tables, so the feeds, their indexes and the search index only
+cover recent history. Archived echoes keep their ids and are still served
+by id, read-only, from the echo detail and comments endpoints.
+"""
+
+from django.db import connection, transaction
+
+from .counters import counter_totals
+from .feed import COMMENTS_PER_ECHO, comment_preview_limit, serialize_page
+from .feed_cache import bump_feed_version
+from .models import ArchivedComment, ArchivedEcho, ArchivedLike, Comment, Echo
+from .search import unindex_echoes
+
+Like = Echo.likes.through
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Move up to ``batch_size`` of the oldest echoes created before ``cutoff``
+    to the archive in one transaction, and return how many were moved.
+    """
+    with transaction.atomic():
+        # Locked: a like racing the move waits on the echo row, then finds
+        # it gone and gets a 404; comments and batched likes fail their
+        # deferred foreign key checks at commit instead of being lost
+        echoes = list(
+            Echo.objects.select_for_update()
+            .filter(created_at__lt=cutoff)
+            .order_by("created_at", "id")[:batch_size]
+        )
+        if not echoes:
+            return 0
+
+        echo_ids = [echo.id for echo in echoes]
+        totals = counter_totals(echoes)
+        ArchivedEcho.objects.bulk_create(
+            [
+                ArchivedEcho(
+                    id=echo.id,
+                    user_id=echo.user_id,
+                    content=echo.content,
+                    created_at=echo.created_at,
+                    like_count=totals[echo.id][0],
+                    comment_count=totals[echo.id][1],
+                )
+                for echo in echoes
+            ]
+        )
+
+        # Comments and likes can run to thousands per echo; copy them with
+        # set-based INSERT ... SELECTs rather than through Python
+        placeholders = ", ".join(["%s"] * len(echo_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {ArchivedComment._meta.db_table} "
+                "(id, user_id, echo_id, content, created_at) "
+                "SELECT id, user_id, echo_id, content, created_at "
+                f"FROM {Comment._meta.db_table} WHERE echo_id IN ({placeholders})",
+                echo_ids,
+            )
+            cursor.execute(
+                f"INSERT INTO {ArchivedLike._meta.db_table} (echo_id, user_id) "
+                "SELECT echo_id, user_id "
+                f"FROM {Like._meta.db_table} WHERE echo_id IN ({placeholders})",
+                echo_ids,
+            )
+
+        unindex_echoes(echo_ids)
+        # Cascades to the comments, likes, counter shards and timeline entries
+        Echo.objects.filter(id__in=echo_ids).delete()
+        bump_feed_version()
+    return len(echoes)
+
+
+def archived_echo(echo_id, request):
+    """
+    The archived echo ``echo_id`` serialized as the feeds serialize echoes,
+    or None when there is no such archived echo.
+    """
+    echo = (
+        ArchivedEcho.objects.select_related("user__profile").filter(id=echo_id).first()
+    )
+    if echo is None:
+        return None
+
+    liked_ids = set()
+    if request.user.is_authenticated:
+        liked_ids = set(
+            ArchivedLike.objects.filter(
+                echo_id=echo.id, user_id=request.user.id
+            ).values_list("echo_id", flat=True)
+        )
+    previews = comment_preview_limit(request)
+    comments = []
+    if previews != 0:
+        comments = list(
+            echo.comments.select_related("user__profile").order_by("-created_at")[
+                : previews or COMMENTS_PER_ECHO
+            ]
+        )
+    totals = {echo.id: [echo.like_count, echo.comment_count]}
+    page = serialize_page(
+        [echo], request, totals, liked_ids, comments, compact=previews is not None
+    )
+    return page[0]
@@ -0,0 +1,33 @@
+from django.urls import path
+
+from . import async_views, views
+
+# Same routes as core.urls, with the hot endpoints served by async views
+urlpatterns = [
+    path("register/", views.register_user, name="register_user"),
+    path("login/", views.CustomTokenObtainPairSerializer.as_view(), name="login_user"),
+    path("refresh/", views.refresh_token),
+    path("create-echo/", async_views.create_echo, name="create_echo"),
+    path("create-comment/", async_views.create_comment, name="create_comment"),
+    path("like-echo/<int:echo_id>/", async_views.like_echo, name="like_echo"),
+    path("batch/", views.batch_write, name="batch_write"),
+    path("list-echoes/", async_views.list_echoes, name="list_echoes"),
+    path(
+        "list-liked-echoes/",
+        async_views.list_liked_echoes,
+        name="list_liked_echoes",
+    ),
+    path(
+        "list-echoes-no-auth/",
+        async_views.list_echoes_no_auth,
+        name="list_echoes_no_auth",
+    ),
+    path("events/", async_views.stream_events, name="stream_events"),
+    path("echoes/<int:echo_id>/", views.echo_detail, name="echo_detail"),
+    path("echoes/<int:echo_id>/comments/", views.list_comments, name="list_comments"),
+    path("home-timeline/", views.home_timeline, name="home_timeline"),
+    path("search/", views.search_echoes, name="search_echoes"),
+    path("trending/", views.trending_echoes, name="trending_echoes"),
+    path("follow/<int:user_id>/", views.follow_user, name="follow_user"),
+    path("upload-profile-pic/", views.upload_profile_pic, name="upload_profile_pic"),
+]
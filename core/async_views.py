@@ -0,0 +1,264 @@
+"""
+Native async versions of the feed and write endpoints, routed by
+``echo.asgi_urls`` when the project runs under ASGI.
+
+Reads use the async ORM and cache APIs directly. Each write still runs its
+transaction in a single ``sync_to_async`` call, since Django's transactions
+are sync only.
+"""
+
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .authentication import ClaimsJWTAuthentication, aget_active_user
+from .counters import acounter_totals, adjust_counters
+from .feed import (
+    abuild_echo_page,
+    aliked_echo_ids,
+    apply_viewer_likes,
+    profile_picture_url,
+)
+from .events import apublish, event_stream
+from .feed_cache import (
+    abump_feed_version,
+    afeed_validators,
+    aget_or_build_page,
+    bump_feed_version,
+)
+from .likes import toggle_like
+from .models import Comment, Echo
+from .pagination import apaginate_echoes
+from .renderers import render_json
+from .routers import areading_replica
+from .search import index_comments, index_echoes
+from .timeline import fan_out
+from .trending import update_scores
+from .views import publish_comment, set_feed_validators
+
+
+def jwt_required(view):
+    # Async replacement for ClaimsJWTAuthentication + IsAuthenticated
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticator = ClaimsJWTAuthentication()
+        try:
+            user = await authenticator.aauthenticate(request)
+        except (AuthenticationFailed, InvalidToken) as e:
+            detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+            user, error = None, detail
+        else:
+            error = {"detail": "Authentication credentials were not provided."}
+
+        if user is None:
+            response = JsonResponse(error, status=401)
+            response["WWW-Authenticate"] = authenticator.authenticate_header(request)
+            return response
+
+        request.user = user
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def get_echo_or_404(echo_id):
+    try:
+        return await Echo.objects.select_related("user__profile").aget(id=echo_id)
+    except Echo.DoesNotExist:
+        raise Http404
+
+
+async def build_echo_response(echo, request):
+    return (await abuild_echo_page([echo], request, user=request.user))[0]
+
+
+@sync_to_async
+def add_echo(user, content):
+    with transaction.atomic():
+        echo = Echo.objects.create(user=user, content=content)
+        fan_out([echo])
+        index_echoes([echo])
+        bump_feed_version()
+    return echo
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def create_echo(request):
+    # Ensure to receive valid JSON data
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"errors": "Invalid JSON data"}, status=400)
+
+    # Check content
+    content = data.get("content")
+    if not content:
+        return JsonResponse({"errors": "Content cannot be empty"}, status=400)
+
+    # Create Echo
+    user = await aget_active_user(request.user.id)
+    echo = await add_echo(user, content)
+
+    echo_data = {
+        "id": echo.id,
+        "user": echo.user.username,
+        "user_profile_picture": profile_picture_url(echo.user, request),
+        "content": echo.content,
+        "created_at": echo.created_at,
+    }
+    await apublish("echo", echo_data)
+
+    return render_json({**echo_data, "likes": 0, "comments": []}, status=201)
+
+
+@sync_to_async
+def add_comment(echo, user_id, content):
+    with transaction.atomic():
+        comment = Comment.objects.create(user_id=user_id, echo=echo, content=content)
+        adjust_counters(echo, comments=1)
+        update_scores([echo])
+        index_comments([comment])
+        bump_feed_version()
+    return comment
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def create_comment(request):
+    # Ensure to receive valid JSON data
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"errors": "Invalid JSON data"}, status=400)
+
+    # Check for empty fields
+    echo_id = data.get("echo_id")
+    content = data.get("content")
+    if not echo_id or not content:
+        return JsonResponse({"errors": "Echo ID and content are required"}, status=400)
+
+    # Create Comment
+    echo = await get_echo_or_404(echo_id)
+    comment = await add_comment(echo, request.user.id, content)
+    await echo.arefresh_from_db(fields=["like_count", "comment_count"])
+
+    response_data = await build_echo_response(echo, request)
+    await sync_to_async(publish_comment)(echo, comment, response_data)
+    return render_json(response_data, status=201)
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def like_echo(request, echo_id):
+    echo = await get_echo_or_404(echo_id)
+
+    # Like/UnLike the echo, unless it was archived since
+    try:
+        is_liked = await sync_to_async(toggle_like)(echo, request.user)
+    except Echo.DoesNotExist:
+        raise Http404
+    await abump_feed_version()
+    await echo.arefresh_from_db(fields=["like_count", "comment_count"])
+    likes = (await acounter_totals([echo]))[echo.id][0]
+    await apublish("like", {"id": echo.id, "likes": likes})
+
+    if request.GET.get("compact") in ("1", "true"):
+        return JsonResponse({"id": echo.id, "likes": likes, "is_liked": is_liked})
+
+    return render_json(await build_echo_response(echo, request))
+
+
+# Helper function to build a paginated feed response
+async def build_feed_response(echoes, request, user, shared=False):
+    async def build():
+        page, next_cursor = await apaginate_echoes(echoes, request.GET)
+        viewer = None if shared else user
+        return await abuild_echo_page(page, request, user=viewer), next_cursor
+
+    validators = None
+    # Replica reads may lag the feed version, so their pages carry no validators
+    if shared and await areading_replica() is None:
+        validators = await afeed_validators(user)
+    if validators is not None:
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return set_feed_validators(response, etag, last_modified)
+
+    try:
+        if shared:
+            # Serve the cached public page and add the viewer's likes on top
+            echo_list, next_cursor = await aget_or_build_page(request, build)
+            echo_ids = [echo["id"] for echo in echo_list]
+            liked_ids = await aliked_echo_ids(echo_ids, user)
+            echo_list = apply_viewer_likes(echo_list, liked_ids)
+        else:
+            echo_list, next_cursor = await build()
+    except ValueError as e:
+        return JsonResponse({"errors": str(e)}, status=400)
+
+    response = render_json(echo_list)
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    if validators is not None:
+        set_feed_validators(response, etag, last_modified)
+    return response
+
+
+@require_GET
+@jwt_required
+async def list_echoes(request):
+    echoes = Echo.objects.select_related("user__profile")
+    return await build_feed_response(echoes, request, request.user, shared=True)
+
+
+@require_GET
+@jwt_required
+async def list_liked_echoes(request):
+    user = request.user
+    liked_echoes = Echo.objects.filter(likes=user.id).select_related("user__profile")
+    return await build_feed_response(liked_echoes, request, user)
+
+
+async def list_echoes_no_auth(request):
+    echoes = Echo.objects.select_related("user__profile")
+    user = await request.auser()
+    return await build_feed_response(echoes, request, user, shared=True)
+
+
+@require_GET
+async def stream_events(request):
+    """
+    Server-Sent Events stream of new echoes, comments and like counts.
+
+    Reconnecting clients send Last-Event-ID to resume where they left off.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get(
+        "last_event_id"
+    )
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({"errors": "Invalid Last-Event-ID"}, status=400)
+
+    response = StreamingHttpResponse(
+        event_stream(last_event_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stop reverse proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .caching import is_shared_cache
+from .metrics import record_cache
+from .passwords import verify_password
+
+
+class ActiveUserCache:
+    """
+    Bounded, thread-safe LRU of User instances that expire after a TTL.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user):
+        with self.lock:
+            self.entries[user_id] = (user, time.monotonic() + self.timeout)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+active_users = ActiveUserCache(
+    settings.AUTH_USER_CACHE["MAX_SIZE"], settings.AUTH_USER_CACHE["TIMEOUT"]
+)
+
+
+def inactive_key(user_id):
+    return f"auth:inactive:{user_id}"
+
+
+def get_active_user(user_id):
+    """
+    Return the real, active User for an id, with its profile, from the
+    in-process cache when possible.
+    """
+    user_id = int(user_id)
+    user = active_users.get(user_id)
+    record_cache("auth_user", user is not None)
+    if user is None:
+        try:
+            user = User.objects.select_related("profile").get(
+                id=user_id, is_active=True
+            )
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        active_users.set(user_id, user)
+    return user
+
+
+async def aget_active_user(user_id):
+    user_id = int(user_id)
+    user = active_users.get(user_id)
+    record_cache("auth_user", user is not None)
+    if user is None:
+        try:
+            user = await User.objects.select_related("profile").aget(
+                id=user_id, is_active=True
+            )
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        active_users.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id, is_active=True):
+    # Drop the cached user; remember deactivations for the fast path
+    active_users.invalidate(user_id)
+    if is_active:
+        cache.delete(inactive_key(user_id))
+    else:
+        # Access tokens already issued stay valid for at most this long
+        cache.set(
+            inactive_key(user_id),
+            True,
+            timeout=settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds(),
+        )
+
+
+class ClaimsUser(TokenUser):
+    """
+    Lightweight user built from verified token claims.
+
+    Views that need the User model instance call ``get_active_user``.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the signed claims instead of loading the
+    User on every request.
+
+    The only per-request lookup is for users deactivated after their token
+    was issued: a marker in the default cache when it is shared, else the
+    user from the in-process cache of active users, so a deactivation
+    handled by another worker takes effect within AUTH_USER_CACHE TIMEOUT.
+    """
+
+    def claims_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return ClaimsUser(validated_token)
+
+    def get_user(self, validated_token):
+        user = self.claims_user(validated_token)
+        if not is_shared_cache(DEFAULT_CACHE_ALIAS):
+            # Other workers' deactivation markers are invisible here; check
+            # the user itself, cached in-process for AUTH_USER_CACHE TIMEOUT
+            get_active_user(user.id)
+        elif cache.get(inactive_key(user.id)):
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+    async def aauthenticate(self, request):
+        """
+        Async counterpart of ``authenticate`` for the native async views.
+
+        Token verification is CPU only; the inactive check uses the async
+        cache API. Returns None when the request carries no token.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        user = self.claims_user(validated_token)
+        if not is_shared_cache(DEFAULT_CACHE_ALIAS):
+            await aget_active_user(user.id)
+        elif await cache.aget(inactive_key(user.id)):
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that checks passwords on the pool and stores the rehash
+    when the hasher settings have changed.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            verify_password(password, None)
+            return None
+
+        valid, new_encoded = verify_password(password, user.password)
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if new_encoded:
+            user.password = new_encoded
+            user.save(update_fields=["password"])
+        return user
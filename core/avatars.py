@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .authentication import active_users
+from .feed_cache import bump_feed_version
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def avatar_storage():
+    return Profile._meta.get_field("profile_picture").storage
+
+
+def avatar_url(profile, size=None):
+    """
+    URL of the smallest rendition at least as large as the requested size,
+    falling back to the original picture until the renditions have been
+    generated, or when they are all smaller.
+    """
+    options = settings.AVATAR_RENDITIONS
+    size = size or options["DEFAULT_SIZE"]
+    fitting = [int(key) for key in profile.renditions if int(key) >= size]
+    if fitting:
+        return avatar_storage().url(profile.renditions[str(min(fitting))])
+    return profile.profile_picture.url
+
+
+def rendition_name(name, size):
+    root, _ = os.path.splitext(os.path.basename(name))
+    extension = settings.AVATAR_RENDITIONS["FORMAT"].lower()
+    return f"profile_pics/renditions/{root}_{size}.{extension}"
+
+
+def release_picture(profile):
+    """
+    Delete a profile's picture and its renditions unless another profile
+    uses the same content-addressed file.
+    """
+    name = profile.profile_picture.name
+    if Profile.objects.filter(profile_picture=name).exclude(id=profile.id).exists():
+        return
+    storage = avatar_storage()
+    for rendition in profile.renditions.values():
+        storage.delete(rendition)
+    profile.profile_picture.delete(save=False)
+
+
+def generate_renditions(profile_id, user_id, name):
+    """
+    Render square thumbnails of a profile picture in every configured size.
+
+    The profile is only updated if it still points at the same picture, so
+    a slow job never overwrites the renditions of a newer upload.
+    """
+    options = settings.AVATAR_RENDITIONS
+    storage = avatar_storage()
+    renditions = {}
+
+    with storage.open(name) as original, Image.open(original) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        for size in options["SIZES"]:
+            thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            thumbnail.save(buffer, format=options["FORMAT"], quality=options["QUALITY"])
+            renditions[str(size)] = storage.save(
+                rendition_name(name, size), ContentFile(buffer.getvalue())
+            )
+
+    profile = Profile.objects.filter(id=profile_id, profile_picture=name)
+    if not profile.update(renditions=renditions):
+        # The picture was replaced while rendering
+        for rendition in renditions.values():
+            storage.delete(rendition)
+        return
+
+    # update() skips the signals that normally invalidate these
+    active_users.invalidate(user_id)
+    bump_feed_version()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.AVATAR_RENDITIONS["WORKERS"],
+                thread_name_prefix="avatars",
+            )
+        return _executor
+
+
+def run_rendition_job(*args):
+    try:
+        generate_renditions(*args)
+    except Exception:
+        logger.exception("Failed to render avatar %s", args[-1])
+    finally:
+        # Worker threads open their own connection; don't leak it
+        connection.close()
+
+
+def schedule_renditions(profile):
+    """
+    Generate the renditions of a profile picture once the upload commits.
+
+    Runs on a background thread pool, or inline when WORKERS is 0.
+    """
+    args = (profile.id, profile.user_id, profile.profile_picture.name)
+
+    def submit():
+        if settings.AVATAR_RENDITIONS["WORKERS"]:
+            get_executor().submit(run_rendition_job, *args)
+        else:
+            generate_renditions(*args)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,299 @@
+"""
+Batched writes, for clients that replay actions queued while offline.
+
+A batch is an ordered list of operations:
+
+    {"op": "echo", "content": "..."}
+    {"op": "comment", "echo_id": 1, "content": "..."}
+    {"op": "like", "echo_id": 1} / {"op": "unlike", "echo_id": 1}
+
+Comments and likes may target an echo created earlier in the same batch
+with ``"echo_ref": <index of that operation>`` instead of ``echo_id``. Any
+operation may carry a ``key``; replaying a key returns the stored result
+instead of applying the operation again.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .counters import adjust_counters_many, counter_totals
+from .events import publish_on_commit
+from .feed import profile_picture_url
+from .feed_cache import bump_feed_version, bump_like_state
+from .models import Comment, Echo, IdempotencyKey
+from .search import index_comments, index_echoes
+from .timeline import fan_out
+from .trending import update_scores
+
+OPERATIONS = ("echo", "comment", "like", "unlike")
+Like = Echo.likes.through
+
+
+class BatchError(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def validate_operation(index, operation, seen_keys, echo_indexes):
+    if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+        return f"op must be one of {', '.join(OPERATIONS)}"
+
+    key = operation.get("key")
+    if key is not None:
+        if not isinstance(key, str) or not 0 < len(key) <= 64:
+            return "key must be a string of 1 to 64 characters"
+        if key in seen_keys:
+            return "key is repeated in this batch"
+        seen_keys.add(key)
+
+    if operation["op"] in ("echo", "comment"):
+        content = operation.get("content")
+        if not isinstance(content, str) or not content:
+            return "Content cannot be empty"
+    if operation["op"] == "echo":
+        echo_indexes.add(index)
+        return None
+
+    echo_id = operation.get("echo_id")
+    echo_ref = operation.get("echo_ref")
+    if (echo_id is None) == (echo_ref is None):
+        return "Exactly one of echo_id and echo_ref is required"
+    if echo_id is not None and (type(echo_id) is not int or echo_id < 1):
+        return "echo_id must be a positive integer"
+    if echo_ref is not None and echo_ref not in echo_indexes:
+        return "echo_ref must be the index of an earlier echo operation"
+    return None
+
+
+def parse_operations(data):
+    """
+    Validate a batch as a whole; raises BatchError listing every invalid
+    operation, so nothing is applied unless all of them are well formed.
+    """
+    operations = data.get("operations") if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise BatchError("operations must be a non-empty list")
+    max_operations = settings.BATCH_WRITES["MAX_OPERATIONS"]
+    if len(operations) > max_operations:
+        raise BatchError(f"A batch may contain at most {max_operations} operations")
+
+    seen_keys, echo_indexes = set(), set()
+    errors = []
+    for index, operation in enumerate(operations):
+        error = validate_operation(index, operation, seen_keys, echo_indexes)
+        if error:
+            errors.append({"index": index, "errors": error})
+    if errors:
+        raise BatchError(errors)
+    return operations
+
+
+def set_likes(user_id, liked, unliked):
+    # Returns the echo ids whose like row was actually inserted or deleted,
+    # so concurrent writers never make the counters drift
+    table = Like._meta.db_table
+    inserted, deleted = [], []
+    with connection.cursor() as cursor:
+        if liked:
+            values = ", ".join(["(%s, %s)"] * len(liked))
+            cursor.execute(
+                f"INSERT INTO {table} (echo_id, user_id) VALUES {values} "
+                "ON CONFLICT DO NOTHING RETURNING echo_id",
+                [value for echo_id in liked for value in (echo_id, user_id)],
+            )
+            inserted = [row[0] for row in cursor.fetchall()]
+        if unliked:
+            placeholders = ", ".join(["%s"] * len(unliked))
+            cursor.execute(
+                f"DELETE FROM {table} WHERE user_id = %s "
+                f"AND echo_id IN ({placeholders}) RETURNING echo_id",
+                [user_id, *unliked],
+            )
+            deleted = [row[0] for row in cursor.fetchall()]
+    return inserted, deleted
+
+
+def apply_batch(request, user, operations):
+    """
+    Apply validated operations in one transaction and return one result
+    per operation, in order.
+
+    Each kind of write is a single statement for the whole batch: echoes
+    and comments are bulk-created, and likes are one INSERT and one DELETE
+    of the net like state per echo.
+    """
+    results = [None] * len(operations)
+
+    def target(operation):
+        if operation.get("echo_ref") is None:
+            return operation["echo_id"]
+        return results[operation["echo_ref"]].get("id")
+
+    # Keys older than KEY_TTL are forgotten, even before they are purged
+    expiry = timezone.now() - timedelta(seconds=settings.BATCH_WRITES["KEY_TTL"])
+    with transaction.atomic():
+        keys = [operation["key"] for operation in operations if operation.get("key")]
+        if keys:
+            stored = dict(
+                IdempotencyKey.objects.filter(
+                    user_id=user.id, key__in=keys, created_at__gte=expiry
+                ).values_list("key", "result")
+            )
+            for index, operation in enumerate(operations):
+                if operation.get("key") in stored:
+                    results[index] = {**stored[operation["key"]], "replayed": True}
+        pending = [index for index, result in enumerate(results) if result is None]
+
+        # Echoes
+        echo_indexes = [i for i in pending if operations[i]["op"] == "echo"]
+        new_echoes = Echo.objects.bulk_create(
+            [
+                Echo(user_id=user.id, content=operations[i]["content"])
+                for i in echo_indexes
+            ]
+        )
+        for index, echo in zip(echo_indexes, new_echoes):
+            results[index] = {
+                "status": 201,
+                "id": echo.id,
+                "created_at": echo.created_at,
+            }
+
+        # The existing echoes that comments and likes point at
+        target_ids = {target(operations[i]) for i in pending if results[i] is None}
+        echoes = {echo.id: echo for echo in new_echoes}
+        echoes.update(
+            Echo.objects.filter(id__in=target_ids - echoes.keys())
+            .only("id", "created_at", "counter_shards")
+            .in_bulk()
+        )
+
+        new_comments, net_likes = [], {}
+        for index in pending:
+            operation = operations[index]
+            if results[index] is not None:
+                continue
+            echo_id = target(operation)
+            if echo_id not in echoes:
+                results[index] = {"status": 404, "errors": "Echo not found"}
+            elif operation["op"] == "comment":
+                new_comments.append(
+                    (
+                        index,
+                        Comment(
+                            user_id=user.id,
+                            echo_id=echo_id,
+                            content=operation["content"],
+                        ),
+                    )
+                )
+            else:
+                # Only the last like or unlike of an echo is applied
+                is_liked = operation["op"] == "like"
+                net_likes[echo_id] = is_liked
+                results[index] = {"status": 200, "id": echo_id, "is_liked": is_liked}
+
+        # Comments
+        Comment.objects.bulk_create([comment for _, comment in new_comments])
+        for index, comment in new_comments:
+            results[index] = {
+                "status": 201,
+                "id": comment.id,
+                "echo_id": comment.echo_id,
+                "created_at": comment.created_at,
+            }
+
+        # Likes
+        inserted, deleted = set_likes(
+            user.id,
+            [echo_id for echo_id, is_liked in net_likes.items() if is_liked],
+            [echo_id for echo_id, is_liked in net_likes.items() if not is_liked],
+        )
+
+        deltas = {}
+        changes = [(echo_id, 1, 0) for echo_id in inserted]
+        changes += [(echo_id, -1, 0) for echo_id in deleted]
+        changes += [(comment.echo_id, 0, 1) for _, comment in new_comments]
+        for echo_id, likes, comments in changes:
+            echo = echoes[echo_id]
+            total_likes, total_comments = deltas.get(echo, (0, 0))
+            deltas[echo] = (total_likes + likes, total_comments + comments)
+        adjust_counters_many(deltas)
+        update_scores(deltas)
+
+        if new_echoes:
+            fan_out(new_echoes)
+            index_echoes(new_echoes)
+        if new_comments:
+            index_comments([comment for _, comment in new_comments])
+        if new_echoes or new_comments or inserted or deleted:
+            bump_feed_version()
+        if inserted or deleted:
+            bump_like_state(user.id)
+
+        publish_batch_events(request, user, new_echoes, new_comments, net_likes)
+
+        # A concurrent replay of the same keys fails here with IntegrityError
+        if keys:
+            IdempotencyKey.objects.filter(
+                user_id=user.id, created_at__lt=expiry
+            ).delete()
+            IdempotencyKey.objects.bulk_create(
+                [
+                    IdempotencyKey(
+                        user_id=user.id, key=operations[i]["key"], result=results[i]
+                    )
+                    for i in pending
+                    if operations[i].get("key")
+                ]
+            )
+    return results
+
+
+def publish_batch_events(request, user, new_echoes, new_comments, net_likes):
+    # The same live events as the single-write endpoints, with the touched
+    # echoes' counters read back in one query
+    picture = profile_picture_url(user, request)
+    for echo in new_echoes:
+        publish_on_commit(
+            "echo",
+            {
+                "id": echo.id,
+                "user": user.username,
+                "user_profile_picture": picture,
+                "content": echo.content,
+                "created_at": echo.created_at,
+            },
+        )
+
+    touched_ids = {comment.echo_id for _, comment in new_comments} | net_likes.keys()
+    if not touched_ids:
+        return
+    totals = counter_totals(
+        list(
+            Echo.objects.filter(id__in=touched_ids).only(
+                "id", "like_count", "comment_count", "counter_shards"
+            )
+        )
+    )
+    for _, comment in new_comments:
+        publish_on_commit(
+            "comment",
+            {
+                "echo_id": comment.echo_id,
+                "comments": totals[comment.echo_id][1],
+                "comment": {
+                    "id": comment.id,
+                    "user": user.username,
+                    "user_profile_picture": picture,
+                    "content": comment.content,
+                    "created_at": comment.created_at,
+                },
+            },
+        )
+    for echo_id in net_likes:
+        publish_on_commit("like", {"id": echo_id, "likes": totals[echo_id][0]})
@@ -0,0 +1,12 @@
+from django.conf import settings
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_BACKENDS = {
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+}
+
+
+def is_shared_cache(alias):
+    # Whether every worker process reads what any of them wrote
+    return settings.CACHES[alias]["BACKEND"] not in PROCESS_LOCAL_BACKENDS
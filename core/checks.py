@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+from .caching import is_shared_cache
+
+
+@register(deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    warnings = []
+    if not is_shared_cache(settings.FEED_CACHE["ALIAS"]):
+        warnings.append(
+            Warning(
+                "FEED_CACHE uses a per-process cache, so writes only invalidate "
+                "the feed pages of the worker that handled them and the feeds "
+                "send no validators.",
+                hint="Set REDIS_URL, or CACHE_BACKEND to a shared backend.",
+                id="core.W001",
+            )
+        )
+    limits = settings.RATE_LIMITS
+    if limits["ENABLED"] and (
+        limits["BACKEND"] == "local" or not is_shared_cache(limits["CACHE_ALIAS"])
+    ):
+        warnings.append(
+            Warning(
+                "RATE_LIMITS keeps its buckets per process, so every worker "
+                "allows the full rate and N workers allow N times it.",
+                hint=(
+                    'Use the "cache" backend with CACHE_ALIAS on a shared '
+                    "cache, e.g. REDIS_URL."
+                ),
+                id="core.W002",
+            )
+        )
+    return warnings
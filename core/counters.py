@@ -0,0 +1,98 @@
+import random
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from .models import CounterShard, Echo
+
+
+def adjust_counters(echo, likes=0, comments=0):
+    """
+    Apply like and comment deltas to an echo's denormalized counters.
+
+    Updates are single ``F()`` expressions, so concurrent writers never lose
+    increments. Echoes with ``counter_shards`` set write to a random shard
+    row instead, so concurrent likers of a hot echo don't all queue on the
+    echo row's lock.
+    """
+    deltas = {
+        field: F(field) + delta
+        for field, delta in (("like_count", likes), ("comment_count", comments))
+        if delta
+    }
+    if not deltas:
+        return
+
+    if not echo.counter_shards:
+        Echo.objects.filter(id=echo.id).update(**deltas)
+        return
+
+    shard = random.randrange(echo.counter_shards)
+    shard_rows = CounterShard.objects.filter(echo_id=echo.id, shard=shard)
+    if shard_rows.update(**deltas):
+        return
+    try:
+        with transaction.atomic():
+            CounterShard.objects.create(
+                echo_id=echo.id,
+                shard=shard,
+                like_count=likes,
+                comment_count=comments,
+            )
+    except IntegrityError:
+        # Another request created the shard row first
+        shard_rows.update(**deltas)
+
+
+def adjust_counters_many(deltas):
+    """
+    Apply ``{echo: (likes, comments)}`` deltas to many echoes at once.
+
+    Unsharded echoes that share the same deltas are updated by a single
+    statement; sharded echoes go through ``adjust_counters`` one by one.
+    """
+    groups = {}
+    for echo, (likes, comments) in deltas.items():
+        if echo.counter_shards:
+            adjust_counters(echo, likes=likes, comments=comments)
+        elif likes or comments:
+            groups.setdefault((likes, comments), []).append(echo.id)
+
+    for (likes, comments), echo_ids in groups.items():
+        Echo.objects.filter(id__in=echo_ids).update(
+            like_count=F("like_count") + likes,
+            comment_count=F("comment_count") + comments,
+        )
+
+
+def shard_sums_queryset(echo_ids):
+    return (
+        CounterShard.objects.filter(echo_id__in=echo_ids)
+        .values("echo_id")
+        .annotate(likes=Sum("like_count"), comments=Sum("comment_count"))
+    )
+
+
+def add_shard_sums(totals, shard_sums):
+    for row in shard_sums:
+        totals[row["echo_id"]][0] += row["likes"]
+        totals[row["echo_id"]][1] += row["comments"]
+    return totals
+
+
+def counter_totals(echoes):
+    # Map echo id -> [likes, comments], folding in any sharded deltas
+    totals = {echo.id: [echo.like_count, echo.comment_count] for echo in echoes}
+    sharded_ids = [echo.id for echo in echoes if echo.counter_shards]
+    if sharded_ids:
+        add_shard_sums(totals, shard_sums_queryset(sharded_ids))
+    return totals
+
+
+async def acounter_totals(echoes):
+    totals = {echo.id: [echo.like_count, echo.comment_count] for echo in echoes}
+    sharded_ids = [echo.id for echo in echoes if echo.counter_shards]
+    if sharded_ids:
+        shard_sums = [row async for row in shard_sums_queryset(sharded_ids)]
+        add_shard_sums(totals, shard_sums)
+    return totals
@@ -0,0 +1,328 @@
+import asyncio
+import heapq
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Queued in place of events when a subscriber falls too far behind
+OVERFLOW = object()
+
+
+class Subscription:
+    """
+    A bounded queue of events for one streaming connection.
+
+    Events may be offered from any thread; they are queued on the event loop
+    the subscriber lives on. A subscriber that stops reading doesn't grow
+    without bound: once its queue is full it is flagged as overflowed and
+    later catches up from the replay buffer instead.
+    """
+
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def offer(self, event):
+        self.loop.call_soon_threadsafe(self.put, event)
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class EventBus:
+    """
+    In-process pub/sub of feed events with a bounded replay buffer.
+
+    Publishing goes through the configured backend, which delivers events
+    to the buses of every process that serves streams.
+    """
+
+    def __init__(self, replay_size, queue_size):
+        self.backend = None
+        self.queue_size = queue_size
+        self.replay = deque(maxlen=replay_size)
+        self.evicted_id = 0
+        self.last_id = 0
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        # Clock-based, so ids keep increasing across restarts
+        with self.lock:
+            self.last_id = max(time.time_ns(), self.last_id + 1)
+            return self.last_id
+
+    def publish(self, event_type, data):
+        # The backend numbers the event: streams skip any event that arrives
+        # after one with a higher id, so ids must follow delivery order
+        self.backend.publish({"type": event_type, "data": data})
+
+    def deliver(self, event):
+        with self.lock:
+            if len(self.replay) == self.replay.maxlen:
+                self.evicted_id = self.replay[0]["id"]
+            self.replay.append(event)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(event)
+
+    def subscribe(self):
+        self.backend.listen()
+        subscriber = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def newest_id(self):
+        with self.lock:
+            return self.replay[-1]["id"] if self.replay else 0
+
+    def replay_since(self, last_id):
+        # Events after last_id, or None if some were already evicted
+        with self.lock:
+            if last_id < self.evicted_id:
+                return None
+            return [event for event in self.replay if event["id"] > last_id]
+
+
+class LocalBackend:
+    """
+    Delivers events to this process only, e.g. a single uvicorn worker.
+    """
+
+    # publish() never touches the database, so async views may call it
+    async_safe = True
+
+    def __init__(self, bus, **options):
+        self.bus = bus
+        self.lock = threading.Lock()
+
+    def listen(self):
+        pass
+
+    def publish(self, event):
+        # Numbered and delivered under one lock, so threads publishing at
+        # once can't deliver their events out of id order
+        with self.lock:
+            self.bus.deliver({"id": self.bus.next_id(), **event})
+
+
+class IdOrder:
+    """
+    Puts numbered events back in id order.
+
+    Publishers commit independently, so an event can reach a listener
+    before one with a lower id. Events are held until every lower id has
+    arrived; an id still missing after ``window`` seconds (its NOTIFY
+    failed, or came before the listener connected) is skipped.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.next_id = None
+        self.pending = []
+        self.gap_since = None
+
+    def push(self, event, now):
+        if self.next_id is not None and event["id"] < self.next_id:
+            # Its place was already given up; delivering it now would
+            # put it behind events streams have sent
+            logger.warning("Dropped event %s, which arrived too late", event["id"])
+        else:
+            heapq.heappush(self.pending, (event["id"], event))
+        return self.release(now)
+
+    def release(self, now):
+        ready = []
+        while self.pending:
+            event_id = self.pending[0][0]
+            if event_id != self.next_id:
+                if self.gap_since is None:
+                    self.gap_since = now
+                if now - self.gap_since < self.window:
+                    break
+            ready.append(heapq.heappop(self.pending)[1])
+            self.next_id = event_id + 1
+            self.gap_since = None
+        return ready
+
+    def timeout(self, now, idle):
+        # Seconds to wait for the next event before releasing held ones
+        if self.gap_since is None:
+            return idle
+        return max(self.gap_since + self.window - now, 0.01)
+
+
+class PostgresNotifyBackend:
+    """
+    Fans events out to every process through PostgreSQL LISTEN/NOTIFY.
+
+    Each process serving streams keeps one extra connection listening on
+    the channel; publishers only send a NOTIFY numbered from one database
+    sequence, without any lock. Listeners restore id order themselves
+    (see IdOrder), at the cost of holding events for up to
+    ``reorder_window`` seconds while a lower id is still in flight.
+    """
+
+    # NOTIFY payloads are limited to 8000 bytes
+    MAX_PAYLOAD = 7900
+    async_safe = False
+
+    def __init__(self, bus, channel="echo_events", reorder_window=1.0, **options):
+        self.bus = bus
+        self.channel = channel
+        self.reorder_window = reorder_window
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        payload = json.dumps(event, cls=DjangoJSONEncoder)
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            # Clients refetch the echo when the content didn't fit
+            event["data"] = {**event["data"], "content": None, "truncated": True}
+            payload = json.dumps(event, cls=DjangoJSONEncoder)
+        # Sent as "<id> <event JSON>"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, nextval('core_event_id_seq') || ' ' || %s)",
+                [self.channel, payload],
+            )
+
+    def parse(self, payload):
+        event_id, _, event = payload.partition(" ")
+        return {"id": int(event_id), **json.loads(event)}
+
+    def listen(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.run_listener, daemon=True)
+                self.listener.start()
+
+    def run_listener(self):
+        import psycopg
+
+        order = IdOrder(self.reorder_window)
+        while True:
+            conn = None
+            try:
+                conn = psycopg.connect(
+                    **connection.get_connection_params(), autocommit=True
+                )
+                conn.execute(f'LISTEN "{self.channel}"')
+                while True:
+                    timeout = order.timeout(time.monotonic(), idle=30)
+                    for notify in conn.notifies(timeout=timeout):
+                        event = self.parse(notify.payload)
+                        for ready in order.push(event, time.monotonic()):
+                            self.bus.deliver(ready)
+                    for ready in order.release(time.monotonic()):
+                        self.bus.deliver(ready)
+            except Exception:
+                logger.exception("Event listener failed; reconnecting")
+                time.sleep(1)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            options = settings.EVENT_BUS
+            _bus = EventBus(options["REPLAY_SIZE"], options["QUEUE_SIZE"])
+            backend = import_string(options["BACKEND"])
+            _bus.backend = backend(_bus, **options.get("OPTIONS", {}))
+        return _bus
+
+
+def publish_on_commit(event_type, data):
+    # Only tell subscribers about writes that actually committed; a failed
+    # publish is logged rather than failing a request whose write stuck
+    transaction.on_commit(lambda: get_bus().publish(event_type, data), robust=True)
+
+
+async def apublish(event_type, data):
+    # For async views, which always run outside a transaction
+    bus = get_bus()
+    if bus.backend.async_safe:
+        bus.publish(event_type, data)
+    else:
+        await sync_to_async(bus.publish)(event_type, data)
+
+
+def format_event(event):
+    data = json.dumps(event["data"], cls=DjangoJSONEncoder)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def event_stream(last_event_id=None):
+    """
+    Yield Server-Sent Events for one connection, resuming after
+    ``last_event_id`` when the replay buffer still covers it.
+    """
+    bus = get_bus()
+    subscriber = bus.subscribe()
+    heartbeat = settings.EVENT_BUS["HEARTBEAT"]
+    last_sent = last_event_id or 0
+
+    def catch_up():
+        nonlocal last_sent
+        events = bus.replay_since(last_sent)
+        if events is None:
+            # Too far behind to replay; the client must refetch the feed
+            last_sent = bus.newest_id()
+            return ["event: reset\ndata: {}\n\n"]
+        if events:
+            last_sent = events[-1]["id"]
+        return [format_event(event) for event in events]
+
+    try:
+        yield f"retry: {settings.EVENT_BUS['RETRY']}\n\n"
+        if last_event_id is not None:
+            for message in catch_up():
+                yield message
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+
+            if event is OVERFLOW:
+                subscriber.overflowed = False
+                for message in catch_up():
+                    yield message
+            elif event["id"] > last_sent:
+                last_sent = event["id"]
+                yield format_event(event)
+    finally:
+        bus.unsubscribe(subscriber)
@@ -0,0 +1,185 @@
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .avatars import avatar_url
+from .counters import acounter_totals, counter_totals
+from .models import Comment, Echo
+from .renderers import format_datetime
+
+COMMENTS_PER_ECHO = 20
+
+
+def profile_picture_url(user, request):
+    # Absolute avatar thumbnail URL, or None when the user has no picture
+    if hasattr(user, "profile") and user.profile.profile_picture:
+        return request.build_absolute_uri(avatar_url(user.profile))
+    return None
+
+
+def picture_url_builder(request):
+    """
+    Return a memoized ``user -> absolute avatar URL`` function for one page.
+
+    The scheme and host are resolved once per page rather than once per
+    echo and comment.
+    """
+    base = request.build_absolute_uri("/")[:-1]
+    urls = {}
+
+    def build(user):
+        if user.id not in urls:
+            url = None
+            if hasattr(user, "profile") and user.profile.profile_picture:
+                url = avatar_url(user.profile)
+                if url.startswith("/"):
+                    url = base + url
+            urls[user.id] = url
+        return urls[user.id]
+
+    return build
+
+
+def liked_queryset(echo_ids, user):
+    return Echo.likes.through.objects.filter(
+        echo_id__in=echo_ids, user_id=user.id
+    ).values_list("echo_id", flat=True)
+
+
+def liked_echo_ids(echo_ids, user):
+    # Ids among echo_ids that the user has liked
+    if not user.is_authenticated:
+        return set()
+    return set(liked_queryset(echo_ids, user))
+
+
+async def aliked_echo_ids(echo_ids, user):
+    if not user.is_authenticated:
+        return set()
+    return {echo_id async for echo_id in liked_queryset(echo_ids, user)}
+
+
+def apply_viewer_likes(echo_list, liked_ids):
+    # Overlay the viewer's is_liked flags on a viewer-independent page
+    return [{**echo, "is_liked": echo["id"] in liked_ids} for echo in echo_list]
+
+
+def comment_preview_limit(request):
+    # Compact feeds (?compact=1) carry a few previews and the comment count;
+    # clients load the rest from the echo's comments endpoint
+    if request.GET.get("compact") in ("1", "true"):
+        return settings.FEED_COMMENTS["PREVIEWS"]
+    return None
+
+
+def comment_preview_queryset(echo_ids, limit=COMMENTS_PER_ECHO):
+    # Latest comments of every echo on the page, in one windowed query
+    return (
+        Comment.objects.filter(echo_id__in=echo_ids)
+        .select_related("user__profile")
+        .annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=F("echo_id"),
+                order_by=F("created_at").desc(),
+            )
+        )
+        .filter(row_number__lte=limit)
+        .order_by("echo_id", "-created_at")
+    )
+
+
+def serialize_comment(comment, picture_url):
+    return {
+        "id": comment.id,
+        "user": comment.user.username,
+        "user_profile_picture": picture_url(comment.user),
+        "content": comment.content,
+        "created_at": format_datetime(comment.created_at),
+    }
+
+
+def serialize_comments(comments, request):
+    picture_url = picture_url_builder(request)
+    return [serialize_comment(comment, picture_url) for comment in comments]
+
+
+def serialize_page(echoes, request, totals, liked_ids, comments, compact=False):
+    # Datetimes and URLs are formatted here, once, so the page is plain
+    # JSON types by the time it is cached and rendered
+    picture_url = picture_url_builder(request)
+    comments_by_echo = {}
+    for comment in comments:
+        comments_by_echo.setdefault(comment.echo_id, []).append(
+            serialize_comment(comment, picture_url)
+        )
+
+    page = []
+    for echo in echoes:
+        data = {
+            "id": echo.id,
+            "user": echo.user.username,
+            "user_profile_picture": picture_url(echo.user),
+            "content": echo.content,
+            "created_at": format_datetime(echo.created_at),
+            "likes": totals[echo.id][0],
+            "is_liked": echo.id in liked_ids,
+        }
+        if compact:
+            data["comment_count"] = totals[echo.id][1]
+        data["comments"] = comments_by_echo.get(echo.id, [])
+        page.append(data)
+    return page
+
+
+def build_echo_page(echoes, request, with_viewer=True):
+    """
+    Serialize a page of echoes in a fixed number of queries.
+
+    The viewer's like flags and comment previews are each fetched once for
+    the whole page instead of once per echo; like counts come from the
+    denormalized counters on the echoes themselves. With ``with_viewer``
+    off every echo is reported as not liked, so the page can be shared.
+    """
+    echoes = list(echoes)
+    if not echoes:
+        return []
+
+    echo_ids = [echo.id for echo in echoes]
+    totals = counter_totals(echoes)
+    liked_ids = liked_echo_ids(echo_ids, request.user) if with_viewer else set()
+    previews = comment_preview_limit(request)
+    comments = []
+    if previews != 0:
+        comments = list(
+            comment_preview_queryset(echo_ids, previews or COMMENTS_PER_ECHO)
+        )
+    return serialize_page(
+        echoes, request, totals, liked_ids, comments, compact=previews is not None
+    )
+
+
+async def abuild_echo_page(echoes, request, user=None):
+    """
+    Async counterpart of ``build_echo_page`` using the async ORM.
+
+    Pass the viewer as ``user`` to include their like flags.
+    """
+    if not echoes:
+        return []
+
+    echo_ids = [echo.id for echo in echoes]
+    totals = await acounter_totals(echoes)
+    liked_ids = await aliked_echo_ids(echo_ids, user) if user else set()
+    previews = comment_preview_limit(request)
+    comments = []
+    if previews != 0:
+        comments = [
+            comment
+            async for comment in comment_preview_queryset(
+                echo_ids, previews or COMMENTS_PER_ECHO
+            )
+        ]
+    return serialize_page(
+        echoes, request, totals, liked_ids, comments, compact=previews is not None
+    )
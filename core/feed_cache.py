@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .caching import is_shared_cache
+from .metrics import record_cache
+from .routers import areading_replica, reading_replica
+
+VERSION_KEY = "feed:version"
+MODIFIED_KEY = "feed:modified"
+
+
+def feed_cache():
+    return caches[settings.FEED_CACHE["ALIAS"]]
+
+
+def feed_version():
+    cache = feed_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses old pages
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def afeed_version():
+    cache = feed_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_feed_version():
+    """
+    Invalidate every cached feed page once the current transaction commits.
+    """
+
+    def bump():
+        cache = feed_cache()
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+        cache.set(MODIFIED_KEY, time.time_ns(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+async def abump_feed_version():
+    # For async views, which always run outside a transaction
+    cache = feed_cache()
+    try:
+        await cache.aincr(VERSION_KEY)
+    except ValueError:
+        await cache.aset(VERSION_KEY, time.time_ns(), timeout=None)
+    await cache.aset(MODIFIED_KEY, time.time_ns(), timeout=None)
+
+
+def likes_key(user_id):
+    return f"feed:likes:{user_id}"
+
+
+def bump_like_state(user_id):
+    # Change the validators of the feeds as this user sees them
+    transaction.on_commit(
+        lambda: feed_cache().set(likes_key(user_id), time.time_ns(), timeout=None)
+    )
+
+
+def validator_keys(user):
+    keys = [VERSION_KEY, MODIFIED_KEY]
+    if user.is_authenticated:
+        keys.append(likes_key(user.id))
+    return keys
+
+
+def make_validators(values, keys):
+    # Users who never liked anything have no like-state key
+    liked = values.get(keys[2], 0) if len(keys) > 2 else 0
+    etag = f'"{values[VERSION_KEY]}-{liked}"'
+    return etag, max(values[MODIFIED_KEY], liked) // 10**9
+
+
+def feed_validators(user):
+    """
+    Return ``(etag, last_modified)`` for the shared feed as ``user`` sees
+    it, without building the page: the feed version and the time of the
+    last write, combined with when the user last liked or unliked anything.
+
+    Return None when the feed cache is per process: a worker would never see
+    the versions the others bump, and answer 304 to stale copies for good.
+    """
+    if not is_shared_cache(settings.FEED_CACHE["ALIAS"]):
+        return None
+    cache = feed_cache()
+    keys = validator_keys(user)
+    values = cache.get_many(keys)
+    for key in keys[:2]:
+        if key not in values:
+            # Seed from the clock, as feed_version does
+            cache.add(key, time.time_ns(), timeout=None)
+            values[key] = cache.get(key)
+    return make_validators(values, keys)
+
+
+async def afeed_validators(user):
+    if not is_shared_cache(settings.FEED_CACHE["ALIAS"]):
+        return None
+    cache = feed_cache()
+    keys = validator_keys(user)
+    values = await cache.aget_many(keys)
+    for key in keys[:2]:
+        if key not in values:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            values[key] = await cache.aget(key)
+    return make_validators(values, keys)
+
+
+def page_key(request, version):
+    # Pages differ by query string and, through absolute avatar URLs, by host
+    raw = f"{request.scheme}://{request.get_host()}?{request.GET.urlencode()}"
+    return f"feed:page:{version}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def page_timeout(replica):
+    # Pages read from a replica may miss writes it has yet to replay; they
+    # live no longer than the writers stay pinned to the primary
+    options = settings.FEED_CACHE
+    if replica is None:
+        return options["TIMEOUT"]
+    return min(options["TIMEOUT"], settings.DATABASE_REPLICAS["STICKY_SECONDS"])
+
+
+def usable_page(entry, replica):
+    # Requests reading from the primary, e.g. of users who just wrote, skip
+    # pages built from a replica, so they always see their own writes
+    if entry is None or (replica is None and entry[1]):
+        return None
+    return entry[0]
+
+
+def get_or_build_page(request, build):
+    """
+    Return the shared, viewer-independent page for this request.
+
+    The page is built from wherever the request reads: a replica for the
+    feed views, unless its user is pinned to the primary. On a miss only the
+    request that wins the rebuild lock calls ``build``; the others wait for
+    its result instead of hitting the database too.
+    """
+    cache = feed_cache()
+    options = settings.FEED_CACHE
+    key = page_key(request, feed_version())
+    replica = reading_replica()
+
+    page = usable_page(cache.get(key), replica)
+    record_cache("feed", page is not None)
+    if page is not None:
+        return page
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=options["LOCK_TIMEOUT"]):
+        try:
+            page = build()
+            # Replaces any replica-built page when built from the primary
+            cache.set(key, (page, replica is not None), timeout=page_timeout(replica))
+            return page
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + options["LOCK_WAIT"]
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        page = usable_page(cache.get(key), replica)
+        if page is not None:
+            return page
+
+    # The rebuild is taking too long; serve this request directly
+    return build()
+
+
+async def aget_or_build_page(request, build):
+    # Async counterpart of get_or_build_page; build is a coroutine function
+    cache = feed_cache()
+    options = settings.FEED_CACHE
+    key = page_key(request, await afeed_version())
+    # Checking the pin may read the cache synchronously
+    replica = await areading_replica()
+
+    page = usable_page(await cache.aget(key), replica)
+    record_cache("feed", page is not None)
+    if page is not None:
+        return page
+
+    lock_key = f"{key}:lock"
+    if await cache.aadd(lock_key, 1, timeout=options["LOCK_TIMEOUT"]):
+        try:
+            page = await build()
+            await cache.aset(
+                key, (page, replica is not None), timeout=page_timeout(replica)
+            )
+            return page
+        finally:
+            await cache.adelete(lock_key)
+
+    deadline = time.monotonic() + options["LOCK_WAIT"]
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        page = usable_page(await cache.aget(key), replica)
+        if page is not None:
+            return page
+
+    return await build()
@@ -0,0 +1,90 @@
+"""
+Write-behind buffer for ``User.last_login``.
+
+Logins record the time in a per-process buffer instead of saving the user.
+The buffer keeps only the latest login of each user and is written in one
+UPDATE once LAST_LOGIN["FLUSH_INTERVAL"] seconds have passed since the last
+write, or once it holds MAX_PENDING users, so a burst of sign-ins costs a
+single statement rather than a row lock and the User signals per login.
+Queryset updates send no post_save, so the profile is never touched.
+
+Besides logins, every request checks whether the buffer is due, and the
+process writes what is left when it exits, so a lone login is saved within
+an interval of the next request to its worker. A failed write puts the
+logins back for the next flush.
+"""
+
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+
+class LastLoginBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        # The database the pending logins belong to
+        self.database = None
+
+    def record(self, user_id, when=None):
+        options = settings.LAST_LOGIN
+        with self.lock:
+            self.pending[user_id] = when or timezone.now()
+            self.database = connection.settings_dict["NAME"]
+            due = len(self.pending) >= options["MAX_PENDING"]
+        if due:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        # Cheap enough for every request: no lock unless there is work
+        interval = settings.LAST_LOGIN["FLUSH_INTERVAL"]
+        if self.pending and time.monotonic() - self.last_flush >= interval:
+            self.flush()
+
+    def flush_at_exit(self):
+        # Unless the database changed under the buffer, e.g. a test database
+        # destroyed before the interpreter exits
+        if self.pending and connection.settings_dict["NAME"] == self.database:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            # Never move a login time back past one another worker wrote
+            return User.objects.filter(id__in=pending).update(
+                last_login=Case(
+                    *[
+                        When(
+                            Q(id=user_id)
+                            & (Q(last_login__isnull=True) | Q(last_login__lt=when)),
+                            then=Value(when),
+                        )
+                        for user_id, when in pending.items()
+                    ],
+                    default=F("last_login"),
+                )
+            )
+        except Exception:
+            # Keep them for the next flush, behind any newer login since
+            with self.lock:
+                for user_id, when in pending.items():
+                    if self.pending.get(user_id, when) <= when:
+                        self.pending[user_id] = when
+            raise
+
+
+last_logins = LastLoginBuffer()
+atexit.register(last_logins.flush_at_exit)
@@ -0,0 +1,56 @@
+from django.db import connection, transaction
+
+from .counters import adjust_counters
+from .feed_cache import bump_like_state
+from .models import Echo
+from .trending import update_scores
+
+Like = Echo.likes.through
+
+
+def insert_like(echo, user):
+    """
+    Add the like row unless it exists, and return whether it was added.
+
+    The row is selected from the echo's, so an echo deleted or archived in
+    the meantime gets no like; on PostgreSQL the select also locks the echo
+    against the archiver's FOR UPDATE, as the foreign key check would.
+    """
+    lock = " FOR KEY SHARE" if connection.vendor == "postgresql" else ""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Like._meta.db_table} (echo_id, user_id) "
+            f"SELECT id, %s FROM {Echo._meta.db_table} WHERE id = %s{lock} "
+            "ON CONFLICT DO NOTHING",
+            [user.id, echo.id],
+        )
+        return cursor.rowcount == 1
+
+
+def toggle_like(echo, user):
+    """
+    Flip a user's like on an echo and return whether it is now liked.
+
+    Uses one indexed DELETE, falling back to one INSERT, on the likes
+    through table instead of loading every liker. The table's unique
+    (echo, user) constraint settles concurrent double-taps: only the
+    request whose statement actually changed a row adjusts the counter.
+    Raises Echo.DoesNotExist when the echo is gone, e.g. archived.
+    """
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(echo_id=echo.id, user_id=user.id).delete()
+        if deleted:
+            adjust_counters(echo, likes=-1)
+            update_scores([echo])
+            bump_like_state(user.id)
+            return False
+
+        if not insert_like(echo, user):
+            if not Echo.objects.filter(id=echo.id).exists():
+                raise Echo.DoesNotExist
+            # A concurrent request liked it first and already counted it
+            return True
+        adjust_counters(echo, likes=1)
+        update_scores([echo])
+        bump_like_state(user.id)
+        return True
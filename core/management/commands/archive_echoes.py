@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.archive import archive_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Move echoes older than ARCHIVE['HORIZON'], with their comments and "
+        "likes, from the hot tables to the archive tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            help="Archive echoes older than this many days instead.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.ARCHIVE["BATCH_SIZE"],
+            help="Number of echoes moved per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        horizon = settings.ARCHIVE["HORIZON"]
+        if options["older_than_days"] is not None:
+            horizon = timedelta(days=options["older_than_days"])
+        # Fixed up front, so echoes crossing the horizon while the command
+        # runs are left for the next run
+        cutoff = timezone.now() - horizon
+
+        archived = 0
+        while True:
+            moved = archive_batch(cutoff, options["batch_size"])
+            if not moved:
+                break
+            archived += moved
+            self.stdout.write(f"{archived} echoes archived")
+        self.stdout.write(f"Archived {archived} echoes created before {cutoff}.")
@@ -0,0 +1,333 @@
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from io import BytesIO, StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from PIL import Image
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core import urls
+from core.models import Echo
+from core.timeline import toggle_follow
+
+BASELINE = Path(__file__).resolve().parents[2] / "bench_baseline.json"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every route in core.urls in-process against a seeded "
+        "throwaway database, and fail when a route makes more queries than "
+        "the stored baseline allows. Latency is only checked against timings "
+        "saved on the same machine with --save-timings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=30)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--echoes", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--baseline", default=str(BASELINE))
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Store these query counts as the new baseline instead of comparing.",
+        )
+        parser.add_argument(
+            "--save-timings",
+            metavar="PATH",
+            help="Also write this run's timings to PATH, to calibrate later runs.",
+        )
+        parser.add_argument(
+            "--compare-timings",
+            metavar="PATH",
+            help="Also fail on p95 regressions from timings saved on this machine.",
+        )
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=2.0,
+            help="Fail when p95 exceeds the baseline's by this factor...",
+        )
+        parser.add_argument(
+            "--latency-floor",
+            type=float,
+            default=5.0,
+            help="...and by at least this many milliseconds.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The benchmark suite runs against SQLite only")
+
+        media_root = tempfile.mkdtemp()
+        cache_dir = tempfile.mkdtemp()
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Hash cheaply and inline, and don't throttle the repeated
+            # writes: the suite measures the app, not PBKDF2 or the limits.
+            # The cache is shared between processes, as in production.
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                CACHES={
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                        "LOCATION": cache_dir,
+                    }
+                },
+                AVATAR_RENDITIONS={**settings.AVATAR_RENDITIONS, "WORKERS": 0},
+                PASSWORD_HASHING={
+                    **settings.PASSWORD_HASHING,
+                    "WORKERS": 0,
+                    "PBKDF2_ITERATIONS": 1000,
+                },
+                RATE_LIMITS={**settings.RATE_LIMITS, "ENABLED": False},
+            ):
+                results = self.run_suite(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        self.report(results)
+        if options["save_timings"]:
+            self.write_json(options["save_timings"], results)
+            self.stdout.write(f"Timings written to {options['save_timings']}")
+        if options["update_baseline"]:
+            # Timings depend on the machine; only the query budgets are shared
+            budgets = {
+                name: {"queries": result["queries"]} for name, result in results.items()
+            }
+            self.write_json(options["baseline"], budgets)
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+
+        if not os.path.exists(options["baseline"]):
+            raise CommandError("No baseline; run with --update-baseline first")
+        baseline = self.read_json(options["baseline"])
+        timings = None
+        if options["compare_timings"]:
+            timings = self.read_json(options["compare_timings"])
+        failures = self.compare(results, baseline, options, timings)
+        if failures:
+            raise CommandError("\n".join(["Benchmark regressions:", *failures]))
+        self.stdout.write(self.style.SUCCESS("Within budget of the baseline."))
+
+    def read_json(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def write_json(self, path, data):
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    def seed(self, options):
+        call_command(
+            "generate_dataset",
+            users=options["users"],
+            echoes=options["echoes"],
+            seed=options["seed"],
+            stdout=StringIO(),
+        )
+        call_command("rebuild_search_index", stdout=StringIO())
+        caches[settings.FEED_CACHE["ALIAS"]].clear()
+
+        # A viewer who follows a few people, and the most prolific author
+        viewer = User.objects.order_by("id").first()
+        author = (
+            Echo.objects.exclude(user=viewer)
+            .values("user_id")
+            .annotate(echoes=Count("id"))
+            .order_by("-echoes")[0]["user_id"]
+        )
+        for followee in User.objects.exclude(id=viewer.id).order_by("id")[:10]:
+            toggle_follow(viewer, followee.id)
+        viewer.set_password("benchpass1")
+        viewer.save(update_fields=["password"])
+        return viewer, author
+
+    def scenarios(self, viewer, author):
+        """
+        One request per route in core.urls, keyed by route name, as
+        ``(method, path, data)``; ``data`` may be a callable of the
+        iteration number.
+        """
+        # The most discussed echo
+        echo_id = Echo.objects.order_by("-comment_count").first().id
+        refresh = str(RefreshToken.for_user(viewer))
+
+        def picture(i):
+            buffer = BytesIO()
+            Image.new("RGB", (320, 240), (i % 256, 0, 0)).save(buffer, format="PNG")
+            return {
+                "profile_picture": SimpleUploadedFile(
+                    "me.png", buffer.getvalue(), "image/png"
+                )
+            }
+
+        return {
+            "list_echoes": ("get", "/api/list-echoes/", None),
+            "list_echoes_no_auth": ("get", "/api/list-echoes-no-auth/", None),
+            "list_liked_echoes": ("get", "/api/list-liked-echoes/", None),
+            "echo_detail": ("get", f"/api/echoes/{echo_id}/", None),
+            "list_comments": ("get", f"/api/echoes/{echo_id}/comments/", None),
+            "home_timeline": ("get", "/api/home-timeline/", None),
+            "search_echoes": ("get", "/api/search/?q=coffee+rain", None),
+            "trending_echoes": ("get", "/api/trending/", None),
+            "register_user": (
+                "post",
+                "/api/register/",
+                lambda i: {
+                    "username": f"bench{i}",
+                    "email": f"bench{i}@example.com",
+                    "password": "benchpass1",
+                },
+            ),
+            "login_user": (
+                "post",
+                "/api/login/",
+                {"username": viewer.username, "password": "benchpass1"},
+            ),
+            "refresh_token": ("post", "/api/refresh/", {"refresh": refresh}),
+            "create_echo": (
+                "post",
+                "/api/create-echo/",
+                lambda i: {"content": f"benchmark echo {i}"},
+            ),
+            "create_comment": (
+                "post",
+                "/api/create-comment/",
+                lambda i: {"echo_id": echo_id, "content": f"benchmark comment {i}"},
+            ),
+            "like_echo": ("post", f"/api/like-echo/{echo_id}/", None),
+            "batch_write": (
+                "post",
+                "/api/batch/",
+                lambda i: {
+                    "operations": [
+                        {"op": "echo", "content": f"batched {i}"},
+                        {"op": "comment", "echo_ref": 0, "content": "first"},
+                        {"op": "like", "echo_id": echo_id},
+                    ]
+                },
+            ),
+            "follow_user": ("post", f"/api/follow/{author}/", None),
+            "upload_profile_pic": ("multipart", "/api/upload-profile-pic/", picture),
+        }
+
+    def route_name(self, pattern):
+        return pattern.name or pattern.callback.__name__
+
+    def run_suite(self, options):
+        viewer, author = self.seed(options)
+        scenarios = self.scenarios(viewer, author)
+        missing = {self.route_name(p) for p in urls.urlpatterns} - scenarios.keys()
+        if missing:
+            raise CommandError(f"No benchmark scenario for: {', '.join(missing)}")
+
+        client = Client(
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(viewer).access_token}"
+        )
+        results = {}
+        for name, (method, path, data) in scenarios.items():
+            timings, queries, sizes = [], [], []
+            # One warm-up request, then the measured ones
+            for i in range(options["iterations"] + 1):
+                payload = data(i) if callable(data) else data
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = self.request(client, method, path, payload)
+                    body = (
+                        b"".join(response.streaming_content)
+                        if response.streaming
+                        else response.content
+                    )
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f"{name} returned {response.status_code}: {body[:200]!r}"
+                    )
+                if i:
+                    timings.append(elapsed * 1000)
+                    queries.append(len(captured))
+                    sizes.append(len(body))
+            results[name] = self.summarize(timings, queries, sizes)
+        return results
+
+    def request(self, client, method, path, payload):
+        if method == "get":
+            return client.get(path)
+        if method == "multipart":
+            return client.post(path, payload)
+        return client.post(
+            path, json.dumps(payload or {}), content_type="application/json"
+        )
+
+    def summarize(self, timings, queries, sizes):
+        cuts = statistics.quantiles(timings, n=100, method="inclusive")
+        return {
+            "p50_ms": round(cuts[49], 2),
+            "p95_ms": round(cuts[94], 2),
+            "p99_ms": round(cuts[98], 2),
+            "queries": max(queries),
+            "bytes": round(statistics.mean(sizes)),
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'queries':>9}{'bytes':>9}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<22}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                f"{result['p99_ms']:>9.2f}{result['queries']:>9}{result['bytes']:>9}"
+            )
+
+    def compare(self, results, baseline, options, timings=None):
+        # Query counts are a hard budget; latency is compared only against
+        # timings from the same machine, and only fails on a clear slowdown
+        failures = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                failures.append(f"{name}: not in the baseline")
+                continue
+            if result["queries"] > expected["queries"]:
+                failures.append(
+                    f"{name}: {result['queries']} queries per request, "
+                    f"budget {expected['queries']}"
+                )
+            calibrated = (timings or {}).get(name)
+            if calibrated is None:
+                continue
+            limit = max(
+                calibrated["p95_ms"] * options["latency_tolerance"],
+                calibrated["p95_ms"] + options["latency_floor"],
+            )
+            if result["p95_ms"] > limit:
+                failures.append(
+                    f"{name}: p95 {result['p95_ms']:.2f} ms, "
+                    f"calibrated {calibrated['p95_ms']:.2f} ms"
+                )
+        return failures
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import subprocess
+
+from django.core.management.base import CommandError
+
+from .bench_servers import Command as BenchServersCommand
+
+SERVER = [
+    "gunicorn",
+    "echo.wsgi:application",
+    "--workers",
+    "{workers}",
+    "--worker-class",
+    "gthread",
+    "--threads",
+    "{threads}",
+    "--bind",
+    "127.0.0.1:{port}",
+]
+
+MODES = {
+    "hashing on request threads": "0",
+    "hashing on process pool": None,
+}
+
+
+class Command(BenchServersCommand):
+    help = (
+        "Measure feed latency under gunicorn while a storm of logins runs, "
+        "with password hashing inline and on the process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/api/list-echoes-no-auth/")
+        parser.add_argument("--username", required=True)
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--login-concurrency", type=int, default=20)
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args, **options):
+        feed_request = (
+            f"GET {options['path']} HTTP/1.1\r\n"
+            "Host: localhost\r\nConnection: close\r\n\r\n"
+        ).encode()
+        body = json.dumps(
+            {"username": options["username"], "password": options["password"]}
+        )
+        login_request = (
+            "POST /api/login/ HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+            f"{body}"
+        ).encode()
+
+        command = [
+            part.format(
+                workers=options["workers"],
+                threads=options["threads"],
+                port=options["port"],
+            )
+            for part in SERVER
+        ]
+        for name, hash_workers in MODES.items():
+            # The storm comes from one address; measure the pool, not the limits
+            env = {**os.environ, "RATE_LIMITS": "off"}
+            if hash_workers is not None:
+                env["PASSWORD_HASH_WORKERS"] = hash_workers
+            try:
+                server = subprocess.Popen(
+                    command,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                raise CommandError("gunicorn is not installed")
+
+            try:
+                self.wait_for_port(options["port"])
+                quiet = asyncio.run(
+                    self.run_load(
+                        options["port"],
+                        feed_request,
+                        options["concurrency"],
+                        options["requests"],
+                    )
+                )
+                storm, logins = asyncio.run(
+                    self.run_storm(options, feed_request, login_request)
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+            self.stdout.write(f"{name}:")
+            self.stdout.write(f"  feed alone:        {self.format_result(quiet)}")
+            self.stdout.write(f"  feed during storm: {self.format_result(storm)}")
+            self.stdout.write(f"  logins:            {self.format_logins(logins)}")
+
+    async def run_storm(self, options, feed_request, login_request):
+        done = asyncio.Event()
+        statuses = {}
+
+        async def login_client():
+            while not done.is_set():
+                try:
+                    reader, writer = await asyncio.open_connection(
+                        "127.0.0.1", options["port"]
+                    )
+                    writer.write(login_request)
+                    await writer.drain()
+                    response = await reader.read()
+                    writer.close()
+                except OSError:
+                    status = "error"
+                else:
+                    status = response[9:12].decode() or "error"
+                statuses[status] = statuses.get(status, 0) + 1
+
+        logins = [
+            asyncio.create_task(login_client())
+            for _ in range(options["login_concurrency"])
+        ]
+        # Let the storm build up before measuring the feed
+        await asyncio.sleep(1)
+        try:
+            result = await self.run_load(
+                options["port"],
+                feed_request,
+                options["concurrency"],
+                options["requests"],
+            )
+        finally:
+            done.set()
+            await asyncio.gather(*logins)
+        return result, statuses
+
+    def format_logins(self, statuses):
+        return ", ".join(
+            f"{count} x {status}" for status, count in sorted(statuses.items())
+        )
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+SERVERS = {
+    "gunicorn (sync views)": [
+        "gunicorn",
+        "echo.wsgi:application",
+        "--workers",
+        "{workers}",
+        "--bind",
+        "127.0.0.1:{port}",
+    ],
+    "uvicorn (async views)": [
+        "uvicorn",
+        "echo.asgi:application",
+        "--workers",
+        "{workers}",
+        "--port",
+        "{port}",
+        "--no-access-log",
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent-connection throughput of the sync views under "
+        "gunicorn with the async views under uvicorn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/api/list-echoes-no-auth/")
+        parser.add_argument("--token", help="JWT access token to send.")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args, **options):
+        headers = "Host: localhost\r\nConnection: close\r\n"
+        if options["token"]:
+            headers += f"Authorization: Bearer {options['token']}\r\n"
+        request = f"GET {options['path']} HTTP/1.1\r\n{headers}\r\n".encode()
+
+        for name, command in SERVERS.items():
+            command = [
+                part.format(workers=options["workers"], port=options["port"])
+                for part in command
+            ]
+            try:
+                server = subprocess.Popen(
+                    command,
+                    env=os.environ.copy(),
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                raise CommandError(f"{command[0]} is not installed")
+
+            try:
+                self.wait_for_port(options["port"])
+                result = asyncio.run(
+                    self.run_load(
+                        options["port"],
+                        request,
+                        options["concurrency"],
+                        options["requests"],
+                    )
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+            self.stdout.write(f"{name}: {self.format_result(result)}")
+
+    def wait_for_port(self, port, timeout=15):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with socket.socket() as sock:
+                if sock.connect_ex(("127.0.0.1", port)) == 0:
+                    return
+            time.sleep(0.1)
+        raise CommandError(f"Server did not start on port {port}")
+
+    async def run_load(self, port, request, concurrency, total):
+        latencies, errors = [], 0
+        remaining = total
+
+        async def client():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                    writer.write(request)
+                    await writer.drain()
+                    response = await reader.read()
+                    writer.close()
+                except OSError:
+                    errors += 1
+                    continue
+                if not response.startswith((b"HTTP/1.1 200", b"HTTP/1.0 200")):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    def format_result(self, result):
+        latencies, errors, elapsed = result
+        if not latencies:
+            return f"no successful requests, {errors} errors"
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return (
+            f"{len(latencies) / elapsed:.0f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p99 {p99 * 1000:.1f} ms, {errors} errors"
+        )
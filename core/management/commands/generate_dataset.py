@@ -0,0 +1,300 @@
+import bisect
+import csv
+import io
+import itertools
+import json
+import math
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.feed_cache import bump_feed_version
+from core.models import Comment, Echo, Profile
+from core.trending import recency
+
+Like = Echo.likes.through
+
+WORDS = (
+    "echo sound loud quiet morning night coffee rain sun city road music "
+    "game team win lose build ship code bug fix deploy friday weekend news "
+    "today tomorrow really maybe great terrible love hate new old again why "
+    "how what when look listen think feel happy tired ready late early"
+).split()
+
+
+def trending_score(created_at, likes, comments):
+    # As core.trending computes it in SQL
+    options = settings.TRENDING
+    engagement = options["LIKE_WEIGHT"] * likes + options["COMMENT_WEIGHT"] * comments
+    return math.log(1 + engagement) + recency(created_at)
+
+
+class RowWriter:
+    """
+    Writes rows with explicit ids and timestamps: COPY on PostgreSQL,
+    batched INSERTs elsewhere.
+
+    Neither goes through the models, so auto_now_add fields keep the given
+    times and the per-row signal handlers never run.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.copy = connection.vendor == "postgresql"
+
+    def write(self, model, rows):
+        if not rows:
+            return
+        columns = list(rows[0])
+        if not self.copy:
+            self.insert(model, columns, rows)
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(self.copy_value(row[column]) for column in columns)
+        with connection.cursor() as cursor:
+            with cursor.cursor.copy(
+                f"COPY {model._meta.db_table} ({', '.join(columns)}) "
+                "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+            ) as copy:
+                copy.write(buffer.getvalue())
+
+    def insert(self, model, columns, rows):
+        fields = [model._meta.get_field(column) for column in columns]
+        quote = connection.ops.quote_name
+        sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} "
+            f"({', '.join(quote(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))})"
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), self.batch_size):
+                cursor.executemany(
+                    sql,
+                    [
+                        [
+                            field.get_db_prep_save(row[column], connection)
+                            for field, column in zip(fields, columns)
+                        ]
+                        for row in rows[start : start + self.batch_size]
+                    ],
+                )
+
+    def copy_value(self, value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, dict):
+            return json.dumps(value)
+        return value
+
+    def reset_sequences(self, models):
+        # Explicit ids don't advance PostgreSQL's sequences
+        if connection.vendor != "postgresql":
+            return
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic dataset of users, echoes, comments "
+        "and likes with skewed distributions and realistic timestamps."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--echoes", type=int, default=100000)
+        parser.add_argument(
+            "--likes-mean", type=float, default=5, help="Mean likes per echo."
+        )
+        parser.add_argument(
+            "--comments-mean", type=float, default=2, help="Mean comments per echo."
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Days of history to spread over."
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.1,
+            help="Zipf exponent of how echoes are spread over authors.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Users or echoes written per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.writer = RowWriter(options["batch_size"])
+        self.now = timezone.now().replace(microsecond=0)
+        self.start = self.now - timedelta(days=options["days"])
+
+        user_ids = self.create_users(options)
+        counts = self.create_echoes(user_ids, options)
+
+        self.writer.reset_sequences([User, Profile, Echo, Comment, Like])
+        bump_feed_version()
+        self.stdout.write(
+            f"Created {len(user_ids)} users, {counts[0]} echoes, {counts[1]} "
+            f"comments and {counts[2]} likes. Run rebuild_search_index to make "
+            "them searchable."
+        )
+
+    def chunks(self, total, size):
+        for start in range(0, total, size):
+            yield range(start, min(start + size, total))
+
+    def next_id(self, model):
+        return (model.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+
+    def create_users(self, options):
+        # One hash for every user; hashing millions of passwords would take
+        # hours. Everyone's password is "password".
+        password = make_password("password")
+        first_user = self.next_id(User)
+        first_profile = self.next_id(Profile)
+        user_ids = range(first_user, first_user + options["users"])
+
+        for chunk in self.chunks(options["users"], options["batch_size"]):
+            users, profiles = [], []
+            for n in chunk:
+                joined = self.start - timedelta(
+                    seconds=self.random.uniform(0, 30 * 86400)
+                )
+                users.append(
+                    {
+                        "id": first_user + n,
+                        "password": password,
+                        "last_login": None,
+                        "is_superuser": False,
+                        "username": f"user{first_user + n}",
+                        "first_name": "",
+                        "last_name": "",
+                        "email": f"user{first_user + n}@example.com",
+                        "is_staff": False,
+                        "is_active": True,
+                        "date_joined": joined,
+                    }
+                )
+                profiles.append(
+                    {
+                        "id": first_profile + n,
+                        "user_id": first_user + n,
+                        "profile_picture": "",
+                        "renditions": {},
+                        "follower_count": 0,
+                    }
+                )
+            with transaction.atomic():
+                self.writer.write(User, users)
+                self.writer.write(Profile, profiles)
+        return user_ids
+
+    def create_echoes(self, user_ids, options):
+        # Authors are Zipf-distributed over a shuffled order of the users, so
+        # a few prolific users write most echoes
+        authors = list(user_ids)
+        self.random.shuffle(authors)
+        cumulative = list(
+            itertools.accumulate(
+                1 / (rank + 1) ** options["skew"] for rank in range(len(authors))
+            )
+        )
+
+        first_echo = self.next_id(Echo)
+        next_comment = self.next_id(Comment)
+        next_like = self.next_id(Like)
+        moment = self.start
+        span = (self.now - self.start).total_seconds()
+        mean_gap = span / max(options["echoes"], 1)
+        totals = [0, 0, 0]
+
+        for chunk in self.chunks(options["echoes"], options["batch_size"]):
+            echoes, comments, likes = [], [], []
+            for n in chunk:
+                echo_id = first_echo + n
+                moment = min(moment + self.gap(moment, mean_gap), self.now)
+                author = authors[
+                    bisect.bisect(cumulative, self.random.random() * cumulative[-1])
+                ]
+                likers = self.sample_users(
+                    user_ids, self.heavy_tailed(options["likes_mean"])
+                )
+                comment_count = self.heavy_tailed(options["comments_mean"])
+
+                echoes.append(
+                    {
+                        "id": echo_id,
+                        "user_id": author,
+                        "content": self.sentence(),
+                        "created_at": moment,
+                        "like_count": len(likers),
+                        "comment_count": comment_count,
+                        "counter_shards": 0,
+                        "trending_score": trending_score(
+                            moment, len(likers), comment_count
+                        ),
+                    }
+                )
+                for _ in range(comment_count):
+                    # Replies cluster in the first hours after an echo
+                    replied = moment + timedelta(
+                        seconds=self.random.expovariate(1 / 7200)
+                    )
+                    comments.append(
+                        {
+                            "id": next_comment,
+                            "user_id": self.random.choice(user_ids),
+                            "echo_id": echo_id,
+                            "content": self.sentence(),
+                            "created_at": min(replied, self.now),
+                        }
+                    )
+                    next_comment += 1
+                for liker in likers:
+                    likes.append(
+                        {"id": next_like, "echo_id": echo_id, "user_id": liker}
+                    )
+                    next_like += 1
+
+            with transaction.atomic():
+                self.writer.write(Echo, echoes)
+                self.writer.write(Comment, comments)
+                self.writer.write(Like, likes)
+            totals[0] += len(echoes)
+            totals[1] += len(comments)
+            totals[2] += len(likes)
+            self.stdout.write(f"{totals[0]} echoes written")
+        return totals
+
+    def gap(self, moment, mean_gap):
+        # Posting follows the day: three times busier at 8pm than at 8am
+        activity = 1 + math.sin((moment.hour - 14) / 24 * 2 * math.pi) * 0.5
+        return timedelta(seconds=self.random.expovariate(activity / mean_gap))
+
+    def heavy_tailed(self, mean):
+        # Pareto(1.5) minus one has mean 2, so most echoes get a few and a
+        # handful get thousands
+        return int((self.random.paretovariate(1.5) - 1) * mean / 2)
+
+    def sample_users(self, user_ids, count):
+        return self.random.sample(user_ids, min(count, len(user_ids)))
+
+    def sentence(self):
+        words = self.random.choices(WORDS, k=self.random.randint(3, 30))
+        return " ".join(words).capitalize() + "."
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Comment, Echo
+from core.search import index_comments, index_echoes
+
+
+class Command(BaseCommand):
+    help = "Index all existing echoes and comments for full-text search."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows indexed per query.",
+        )
+
+    def handle(self, *args, **options):
+        for model, index in ((Echo, index_echoes), (Comment, index_comments)):
+            indexed = self.index_all(model, index, options["batch_size"])
+            self.stdout.write(f"Indexed {indexed} {model._meta.verbose_name_plural}.")
+
+    def index_all(self, model, index, batch_size):
+        rows = model.objects.only("id", "content").order_by("id")
+        if model is Comment:
+            rows = rows.only("id", "echo_id", "content")
+
+        last_id = 0
+        indexed = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return indexed
+            index(batch)
+            last_id = batch[-1].id
+            indexed += len(batch)
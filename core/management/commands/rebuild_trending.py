@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Echo
+from core.trending import update_scores
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every echo's trending score, e.g. after changing the "
+        "TRENDING settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of echoes rescored per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        rows = Echo.objects.only("id", "created_at").order_by("id")
+        last_id = 0
+        rescored = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[: options["batch_size"]])
+            if not batch:
+                break
+            with transaction.atomic():
+                update_scores(batch, sample_sharded=False)
+            last_id = batch[-1].id
+            rescored += len(batch)
+        self.stdout.write(f"Rescored {rescored} echoes.")
@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from core.counters import counter_totals
+from core.models import Comment, CounterShard, Echo
+
+
+class Command(BaseCommand):
+    help = "Recompute echo like and comment counters and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of echoes locked and repaired per transaction.",
+        )
+        parser.add_argument(
+            "--hot-threshold",
+            type=int,
+            help="Shard the counters of echoes with at least this many likes "
+            "and unshard all others.",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=8,
+            help="Number of counter shards for hot echoes.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        checked = repaired = 0
+
+        while True:
+            with transaction.atomic():
+                echoes = list(
+                    Echo.objects.select_for_update()
+                    .filter(id__gt=last_id)
+                    .order_by("id")[:batch_size]
+                )
+                if not echoes:
+                    break
+                last_id = echoes[-1].id
+                checked += len(echoes)
+                repaired += self.reconcile(echoes, options)
+
+        self.stdout.write(f"Checked {checked} echoes, repaired {repaired}.")
+
+    def reconcile(self, echoes, options):
+        echo_ids = [echo.id for echo in echoes]
+        list(CounterShard.objects.select_for_update().filter(echo_id__in=echo_ids))
+
+        like_counts = self.count_by_echo(Echo.likes.through, echo_ids)
+        comment_counts = self.count_by_echo(Comment, echo_ids)
+        totals = counter_totals(echoes)
+
+        repaired = 0
+        changed = []
+        for echo in echoes:
+            actual = [like_counts.get(echo.id, 0), comment_counts.get(echo.id, 0)]
+            if totals[echo.id] != actual:
+                repaired += 1
+
+            counter_shards = echo.counter_shards
+            if options["hot_threshold"] is not None:
+                is_hot = actual[0] >= options["hot_threshold"]
+                counter_shards = options["shards"] if is_hot else 0
+
+            if [echo.like_count, echo.comment_count, echo.counter_shards] != [
+                *actual,
+                counter_shards,
+            ]:
+                echo.like_count, echo.comment_count = actual
+                echo.counter_shards = counter_shards
+                changed.append(echo)
+
+        # Shard deltas are now folded into the echo columns
+        CounterShard.objects.filter(echo_id__in=echo_ids).delete()
+        Echo.objects.bulk_update(
+            changed, ["like_count", "comment_count", "counter_shards"]
+        )
+        return repaired
+
+    def count_by_echo(self, model, echo_ids):
+        return dict(
+            model.objects.filter(echo_id__in=echo_ids)
+            .values("echo_id")
+            .annotate(count=Count("id"))
+            .values_list("echo_id", "count")
+        )
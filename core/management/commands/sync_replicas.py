@@ -0,0 +1,40 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary database over the SQLite replicas, once or "
+        "every --interval seconds, to stand in for replication locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep copying with this many seconds of replication lag.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Only SQLite replicas are synced by this command")
+        aliases = settings.DATABASE_REPLICAS["ALIASES"]
+        if not aliases:
+            raise CommandError("No replicas configured; set DB_REPLICAS")
+
+        while True:
+            connection.ensure_connection()
+            for alias in aliases:
+                replica = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+                try:
+                    connection.connection.backup(replica)
+                finally:
+                    replica.close()
+            self.stdout.write(f"Copied the primary to {', '.join(aliases)}.")
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,314 @@
+"""
+Per-request performance metrics, exported in the Prometheus text format.
+
+``MetricsMiddleware`` records, for every request and labelled by resolved
+URL name: wall time, database query count and time, cache hits and misses,
+and response size. They are aggregated into in-process counters and
+histograms.
+
+Under gunicorn every worker has its own registry. With
+METRICS["MULTIPROCESS_DIR"] set, each worker periodically writes its
+registry to a file in that directory and the metrics endpoint merges all of
+them, so any worker can answer a scrape. Clear the directory when the
+server starts.
+"""
+
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = {
+    "echo_request_duration_seconds": (
+        *(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5),
+        *(1.0, 2.5, 5.0, 10.0),
+    ),
+    "echo_request_db_duration_seconds": (
+        *(0.001, 0.005, 0.01, 0.025, 0.05, 0.1),
+        *(0.25, 0.5, 1.0, 2.5),
+    ),
+    "echo_request_db_queries": (0, 1, 2, 5, 10, 20, 50, 100),
+    "echo_response_size_bytes": (100, 1000, 10000, 100000, 1000000, 10000000),
+}
+
+HELP = {
+    "echo_requests_total": "Requests by view, method and status.",
+    "echo_cache_requests_total": "Cache lookups by view, cache and result.",
+    "echo_rate_limited_total": "Requests refused by rate limits, by view and key.",
+    "echo_request_duration_seconds": "Wall time of requests.",
+    "echo_request_db_duration_seconds": "Time spent in database queries.",
+    "echo_request_db_queries": "Database queries per request.",
+    "echo_response_size_bytes": "Size of non-streaming response bodies.",
+}
+
+
+class Registry:
+    """
+    Thread-safe counters and histograms, keyed by metric name and a sorted
+    tuple of label pairs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        # key -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = BUCKETS[name]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(buckets) + 2)
+            index = next(
+                (i for i, bound in enumerate(buckets) if value <= bound),
+                len(buckets),
+            )
+            values[index] += 1
+            values[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    [name, labels, list(values)]
+                    for (name, labels), values in self.histograms.items()
+                ],
+            }
+
+
+def merge(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                values = [a + b for a, b in zip(histograms[key], values)]
+            histograms[key] = values
+    return counters, histograms
+
+
+registry = Registry()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def flush(force=False):
+    # Write this process's registry for the other workers' metrics endpoint
+    global _last_flush
+    directory = settings.METRICS["MULTIPROCESS_DIR"]
+    if not directory:
+        return
+    now = time.monotonic()
+    with _flush_lock:
+        if not force and now - _last_flush < settings.METRICS["FLUSH_INTERVAL"]:
+            return
+        _last_flush = now
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(temp_path, os.path.join(directory, f"metrics-{os.getpid()}.json"))
+
+
+def collect():
+    directory = settings.METRICS["MULTIPROCESS_DIR"]
+    if not directory:
+        return merge([registry.snapshot()])
+
+    flush(force=True)
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("metrics-") and name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced right now; its data is in the next scrape
+                continue
+    return merge(snapshots)
+
+
+def escape_label(value):
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return value.replace("\n", "\\n")
+
+
+def format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return (
+        "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in pairs) + "}"
+    )
+
+
+def exposition():
+    counters, histograms = collect()
+    lines = []
+    for metric in sorted({name for name, _ in counters}):
+        lines += [f"# HELP {metric} {HELP[metric]}", f"# TYPE {metric} counter"]
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+
+    for metric in sorted({name for name, _ in histograms}):
+        lines += [f"# HELP {metric} {HELP[metric]}", f"# TYPE {metric} histogram"]
+        buckets = BUCKETS[metric]
+        for (name, labels), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), values):
+                cumulative += count
+                lines.append(
+                    f"{metric}_bucket{format_labels(labels, [('le', bound)])} "
+                    f"{cumulative}"
+                )
+            lines.append(f"{metric}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{metric}_count{format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    def __init__(self, trace):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache = []
+        # (sql, seconds) of every query, kept only for slow-request logs
+        self.trace = [] if trace else None
+
+
+_current = ContextVar("request_metrics", default=None)
+
+
+def record_cache(cache, hit):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache.append((cache, "hit" if hit else "miss"))
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db_time += elapsed
+        if metrics.trace is not None:
+            metrics.trace.append((sql, elapsed))
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Installed on every connection, including the ones async views use
+    # from sync_to_async threads; the request is found via the context
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics, started)
+        return response
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics, started)
+        return response
+
+    def start(self):
+        # Sampled up front, so only the requests that may be logged keep
+        # their SQL; whether they turn out slow is known only at the end
+        options = settings.METRICS
+        metrics = RequestMetrics(
+            trace=options["SLOW_REQUEST_SECONDS"] is not None
+            and random.random() < options["SLOW_SAMPLE_RATE"]
+        )
+        return metrics, _current.set(metrics), time.perf_counter()
+
+    def finish(self, request, response, metrics, started):
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "<unresolved>"
+        labels = {"view": view}
+
+        registry.inc(
+            "echo_requests_total",
+            {**labels, "method": request.method, "status": str(response.status_code)},
+        )
+        registry.observe("echo_request_duration_seconds", labels, duration)
+        registry.observe("echo_request_db_queries", labels, metrics.queries)
+        registry.observe("echo_request_db_duration_seconds", labels, metrics.db_time)
+        if not response.streaming:
+            registry.observe("echo_response_size_bytes", labels, len(response.content))
+        for cache, result in metrics.cache:
+            registry.inc(
+                "echo_cache_requests_total",
+                {**labels, "cache": cache, "result": result},
+            )
+        flush()
+
+        if (
+            metrics.trace is not None
+            and duration >= settings.METRICS["SLOW_REQUEST_SECONDS"]
+        ):
+            queries = "\n".join(
+                f"  {seconds * 1000:.1f} ms  {sql}" for sql, seconds in metrics.trace
+            )
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms\n%s",
+                request.method,
+                request.path,
+                view,
+                duration * 1000,
+                metrics.queries,
+                metrics.db_time * 1000,
+                queries,
+            )
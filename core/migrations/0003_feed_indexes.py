@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_profile"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="echo",
+            index=models.Index(
+                fields=["created_at", "id"], name="core_echo_created_id_idx"
+            ),
+        ),
+        # The liked-echoes feed looks up the auto-created through table by
+        # user first; its built-in unique index leads with echo_id
+        migrations.RunSQL(
+            sql=(
+                "CREATE INDEX core_echo_likes_user_echo_idx "
+                "ON core_echo_likes (user_id, echo_id)"
+            ),
+            reverse_sql="DROP INDEX core_echo_likes_user_echo_idx",
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Echo = apps.get_model("core", "Echo")
+    Comment = apps.get_model("core", "Comment")
+    Like = Echo.likes.through
+
+    def count_of(model):
+        counts = (
+            model.objects.filter(echo_id=OuterRef("pk"))
+            .values("echo_id")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        return Coalesce(Subquery(counts), Value(0))
+
+    Echo.objects.update(like_count=count_of(Like), comment_count=count_of(Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_feed_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="echo",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="echo",
+            name="counter_shards",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="echo",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="CounterShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("like_count", models.IntegerField(default=0)),
+                ("comment_count", models.IntegerField(default=0)),
+                (
+                    "echo",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="counter_shard_rows",
+                        to="core.echo",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("echo", "shard"),
+                        name="core_countershard_echo_shard_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
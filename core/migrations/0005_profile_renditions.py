@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_echo_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="renditions",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+POSTGRES_SQL = [
+    "ALTER TABLE core_echo ADD COLUMN search_vector tsvector",
+    "ALTER TABLE core_comment ADD COLUMN search_vector tsvector",
+    "CREATE INDEX core_echo_search_idx ON core_echo USING gin (search_vector)",
+    "CREATE INDEX core_comment_search_idx ON core_comment USING gin (search_vector)",
+]
+
+POSTGRES_REVERSE_SQL = [
+    "ALTER TABLE core_echo DROP COLUMN search_vector",
+    "ALTER TABLE core_comment DROP COLUMN search_vector",
+]
+
+SQLITE_SQL = [
+    "CREATE VIRTUAL TABLE core_search USING fts5("
+    "content, echo_id UNINDEXED, tokenize='porter unicode61')",
+]
+
+SQLITE_REVERSE_SQL = ["DROP TABLE core_search"]
+
+
+def run_for_vendor(statements):
+    # The search index is built from backend-specific features, so it is
+    # kept out of the models and created here per database vendor
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_follow_timeline"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"postgresql": POSTGRES_SQL, "sqlite": SQLITE_SQL}),
+            run_for_vendor(
+                {"postgresql": POSTGRES_REVERSE_SQL, "sqlite": SQLITE_REVERSE_SQL}
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_idempotency_keys"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["echo", "created_at", "id"],
+                name="core_comment_echo_created_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:29
+
+import math
+from datetime import datetime, timedelta, timezone
+
+import core.models
+from django.db import migrations, models
+from django.db.models import Sum
+
+BATCH_SIZE = 2000
+
+# The scoring constants as of this migration, so that later changes to
+# settings.TRENDING or core.trending don't change what it writes
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 3.0
+HALF_LIFE = timedelta(hours=12)
+
+
+def recency(created_at):
+    return (
+        (created_at - EPOCH).total_seconds() * math.log(2) / HALF_LIFE.total_seconds()
+    )
+
+
+def backfill_trending_scores(apps, schema_editor):
+    # Existing echoes all got the default, the score of an echo made now
+    Echo = apps.get_model("core", "Echo")
+    CounterShard = apps.get_model("core", "CounterShard")
+
+    def rescore(batch):
+        shards = {
+            row["echo_id"]: row
+            for row in CounterShard.objects.filter(echo__in=batch)
+            .values("echo_id")
+            .annotate(likes=Sum("like_count"), comments=Sum("comment_count"))
+        }
+        for echo in batch:
+            sharded = shards.get(echo.pk, {})
+            likes = echo.like_count + (sharded.get("likes") or 0)
+            comments = echo.comment_count + (sharded.get("comments") or 0)
+            engagement = LIKE_WEIGHT * likes + COMMENT_WEIGHT * comments
+            echo.trending_score = math.log(1 + engagement) + recency(echo.created_at)
+        Echo.objects.bulk_update(batch, ["trending_score"])
+
+    echoes = Echo.objects.only(
+        "pk", "created_at", "like_count", "comment_count"
+    ).order_by("pk")
+    batch = list(echoes[:BATCH_SIZE])
+    while batch:
+        rescore(batch)
+        batch = list(echoes.filter(pk__gt=batch[-1].pk)[:BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_comment_echo_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="echo",
+            name="trending_score",
+            field=models.FloatField(default=core.models.new_trending_score),
+        ),
+        migrations.RunPython(backfill_trending_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="echo",
+            index=models.Index(
+                fields=["trending_score", "id"], name="core_echo_trending_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+import time
+
+from django.db import migrations
+
+
+def create_sequence(apps, schema_editor):
+    # Numbers the events of core.events.PostgresNotifyBackend; starts above
+    # the clock-based ids clients may still resume from
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE SEQUENCE core_event_id_seq START WITH {time.time_ns()}"
+        )
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP SEQUENCE core_event_id_seq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_archive"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
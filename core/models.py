@@ -1,5 +1,14 @@
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+
+
+def new_trending_score():
+    # New echoes start without engagement, ranked by recency alone
+    from .trending import recency
+
+    return recency(timezone.now())
 
 
 class Echo(models.Model):
@@ -7,6 +16,26 @@ class Echo(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     likes = models.ManyToManyField(User, related_name="liked_echoes", blank=True)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Hot echoes spread counter updates over this many CounterShard rows
+    counter_shards = models.PositiveSmallIntegerField(default=0)
+    # Maintained by core.trending whenever the counters change
+    trending_score = models.FloatField(default=new_trending_score)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the feeds seeks on (created_at, id)
+            models.Index(fields=["created_at", "id"], name="core_echo_created_id_idx"),
+            # Home timelines pull high-follower authors' echoes by author
+            models.Index(
+                fields=["user", "created_at", "id"], name="core_echo_user_created_idx"
+            ),
+            # The trending feed seeks on (trending_score, id)
+            models.Index(
+                fields=["trending_score", "id"], name="core_echo_trending_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Echo by {self.user.username}"
@@ -18,13 +47,187 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Comment previews and the comments endpoint page per echo
+            models.Index(
+                fields=["echo", "created_at", "id"],
+                name="core_comment_echo_created_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"Comment by {self.user.username} on Echo {self.echo.id}"
 
 
+class CounterShard(models.Model):
+    echo = models.ForeignKey(
+        Echo, on_delete=models.CASCADE, related_name="counter_shard_rows"
+    )
+    shard = models.PositiveSmallIntegerField()
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["echo", "shard"], name="core_countershard_echo_shard_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Counter shard {self.shard} of Echo {self.echo_id}"
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     profile_picture = models.ImageField(upload_to="profile_pics/", blank=True)
+    # Thumbnail size -> storage name, filled in after each upload
+    renditions = models.JSONField(default=dict, blank=True)
+    follower_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user.username} Profile"
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="following"
+    )
+    followee = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="followers"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follower", "followee"], name="core_follow_uniq"
+            ),
+        ]
+        indexes = [
+            # Fan-out reads every follower of an author
+            models.Index(
+                fields=["followee", "follower"], name="core_follow_followee_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.follower_id} follows {self.followee_id}"
+
+
+class TimelineEntry(models.Model):
+    """
+    One echo in a user's materialized home timeline.
+
+    ``created_at`` copies the echo's, so a page of the timeline is a single
+    range scan of the (owner, created_at, echo) index.
+    """
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    echo = models.ForeignKey(
+        Echo, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "echo"], name="core_timelineentry_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["owner", "created_at", "echo"],
+                name="core_timeline_owner_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Echo {self.echo_id} in timeline of {self.owner_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored result of one batch operation sent with an idempotency key,
+    returned again when a client replays the same key.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    result = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="core_idempotencykey_uniq"
+            ),
+        ]
+        indexes = [
+            # Expired keys are pruned per user by age
+            models.Index(
+                fields=["user", "created_at"], name="core_idempotency_created_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} of {self.user_id}"
+
+
+class ArchivedEcho(models.Model):
+    """
+    An echo moved out of the hot tables by the archive_echoes command.
+
+    Keeps the echo's id, so links to it still resolve, and its counters
+    with any sharded deltas folded in; archived echoes are read-only.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    content = models.TextField()
+    created_at = models.DateTimeField()
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived echo {self.id}"
+
+
+class ArchivedComment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    echo = models.ForeignKey(
+        ArchivedEcho, on_delete=models.CASCADE, related_name="comments"
+    )
+    content = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["echo", "created_at", "id"],
+                name="core_archcomment_echo_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Archived comment {self.id} on Echo {self.echo_id}"
+
+
+class ArchivedLike(models.Model):
+    echo = models.ForeignKey(
+        ArchivedEcho, on_delete=models.CASCADE, related_name="likes"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["echo", "user"], name="core_archivedlike_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} liked archived Echo {self.echo_id}"
@@ -0,0 +1,118 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_key(created_at, echo_id):
+    # Opaque token for a (created_at, id) position
+    raw = f"{created_at.isoformat()}|{echo_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def encode_cursor(echo):
+    return encode_key(echo.created_at, echo.id)
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, echo_id = (
+            base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        )
+        return datetime.fromisoformat(created_at), int(echo_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def encode_rank_cursor(score, echo_id):
+    # repr() round-trips the float exactly, so the next page starts right
+    # after this echo
+    raw = f"{score!r}|{echo_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, echo_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return float(score), int(echo_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def apply_keyset(rows, params, id_field="id"):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    ``before`` selects rows older than the cursor and ``after`` rows newer
+    than it, so every page is a single index range scan no matter how deep
+    the client has scrolled. Returns the ordered queryset, the page size and
+    whether the page runs forward in time.
+    """
+    before = params.get("before")
+    after = params.get("after")
+    if before and after:
+        raise ValueError("Use either before or after, not both")
+    limit = parse_limit(params.get("limit"))
+
+    if after:
+        created_at, row_id = decode_cursor(after)
+        rows = rows.filter(
+            Q(created_at__gt=created_at)
+            | Q(created_at=created_at, **{f"{id_field}__gt": row_id})
+        ).order_by("created_at", id_field)
+    else:
+        if before:
+            created_at, row_id = decode_cursor(before)
+            rows = rows.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, **{f"{id_field}__lt": row_id})
+            )
+        rows = rows.order_by("-created_at", f"-{id_field}")
+    return rows, limit, bool(after)
+
+
+def finish_page(echoes, limit, forward):
+    """
+    Turn up to ``limit + 1`` fetched echoes into the page, newest first, and
+    the cursor that continues in the same direction, or None when there is
+    nothing more.
+    """
+    page = echoes[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(echoes) > limit else None
+    if forward:
+        page.reverse()
+    return page, next_cursor
+
+
+def page_queryset(echoes, params):
+    # One extra row is fetched to know whether another page exists
+    echoes, limit, forward = apply_keyset(echoes, params)
+    return echoes[: limit + 1], lambda rows: finish_page(rows, limit, forward)
+
+
+def paginate_echoes(echoes, params):
+    echoes, finish = page_queryset(echoes, params)
+    return finish(list(echoes))
+
+
+async def apaginate_echoes(echoes, params):
+    echoes, finish = page_queryset(echoes, params)
+    return finish([echo async for echo in echoes])
@@ -0,0 +1,137 @@
+"""
+Password hashing and verification on a bounded process pool.
+
+PBKDF2 and friends are CPU-bound and deliberately slow. Running them on the
+web workers lets a burst of logins starve every other request, so they run
+on a small pool of processes instead. When more than MAX_PENDING jobs are
+already queued in this process, new ones are refused with ``PasswordPoolBusy``
+(503 + Retry-After) rather than queued behind them.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count from PASSWORD_HASHING, so raising it
+    upgrades stored hashes on the users' next login.
+    """
+
+    @property
+    def iterations(self):
+        configured = settings.PASSWORD_HASHING["PBKDF2_ITERATIONS"]
+        return configured or hashers.PBKDF2PasswordHasher.iterations
+
+
+class PasswordPoolBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many sign-ins in progress, try again shortly."
+    default_code = "password_pool_busy"
+
+    def __init__(self):
+        super().__init__()
+        # DRF's exception handler turns this into a Retry-After header
+        self.wait = settings.PASSWORD_HASHING["RETRY_AFTER"]
+
+
+def make_password(password):
+    return hashers.make_password(password)
+
+
+def check_password(password, encoded):
+    """
+    Verify a password and return ``(valid, new_encoded)``, where
+    ``new_encoded`` is the rehash to store when the hasher settings have
+    changed since ``encoded`` was made, else None.
+    """
+    if encoded is None:
+        # Unknown user: hash anyway so the response takes as long
+        hashers.make_password(password)
+        return False, None
+    valid, must_update = hashers.verify_password(password, encoded)
+    if valid and must_update:
+        return True, hashers.make_password(password)
+    return valid, None
+
+
+def init_worker():
+    if not apps.ready:
+        django.setup()
+    # Lower priority, so request workers win the CPU during a login storm
+    os.nice(settings.PASSWORD_HASHING["NICE"])
+
+
+_executor = None
+_pending = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _pending
+    with _lock:
+        if _executor is None:
+            options = settings.PASSWORD_HASHING
+            # Spawned rather than forked: web workers are multithreaded, and
+            # a fork may copy locks other threads hold
+            _executor = ProcessPoolExecutor(
+                max_workers=options["WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+            )
+            _pending = threading.BoundedSemaphore(options["MAX_PENDING"])
+        return _executor, _pending
+
+
+def discard_executor(executor):
+    global _executor
+    with _lock:
+        # Another thread may already have replaced it
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(executor, pending, function, *args):
+    if not pending.acquire(blocking=False):
+        raise PasswordPoolBusy()
+    try:
+        future = executor.submit(function, *args)
+    except BaseException:
+        pending.release()
+        raise
+    future.add_done_callback(lambda _: pending.release())
+    return future.result()
+
+
+def run(function, *args):
+    # Inline when WORKERS is 0, e.g. in tests
+    if not settings.PASSWORD_HASHING["WORKERS"]:
+        return function(*args)
+
+    executor, pending = get_executor()
+    try:
+        return submit(executor, pending, function, *args)
+    except BrokenProcessPool:
+        # A pool process died, e.g. to the OOM killer, and the pool refuses
+        # all further work: start a new one and retry once
+        discard_executor(executor)
+    return submit(*get_executor(), function, *args)
+
+
+def hash_password(password):
+    return run(make_password, password)
+
+
+def verify_password(password, encoded):
+    return run(check_password, password, encoded)
@@ -0,0 +1,224 @@
+"""
+Per-client rate limiting of the write and auth endpoints.
+
+Each policy in RATE_LIMITS["POLICIES"] is a token bucket for one URL name:
+RATE tokens per period refill a bucket of BURST tokens, keyed by the
+verified token's user id, or by client IP for anonymous requests and
+policies with ``"KEY": "ip"``. A request finding the bucket empty gets a 429
+with Retry-After and is counted in echo_rate_limited_total.
+
+A policy with OPERATIONS also charges each operation of a batch to the
+bucket of the single-write endpoint it stands for, so batching costs the
+same tokens as sending the writes one by one. A batch is allowed while each
+of those buckets has a token left and then takes all its operations' tokens,
+leaving later writes to wait until they have refilled.
+
+Buckets are stored as their theoretical arrival time (GCRA), so the shared
+cache backend allows a busy client's request with a single ``incr``.
+"""
+
+import json
+import math
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentication import ClaimsJWTAuthentication
+from .metrics import registry
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@lru_cache
+def parse_policy(rate, burst):
+    # "30/m" with a burst of 10 -> (emission interval, tolerance) in ms
+    count, period = rate.split("/")
+    interval = PERIODS[period] * 1000 // int(count)
+    return interval, interval * burst
+
+
+class LocalBuckets:
+    """
+    Buckets of this process only; each gunicorn worker allows the full rate.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrivals = {}
+
+    def take(self, key, interval, tolerance, now, cost=1):
+        # Return 0 when the request is allowed, else the ms until it would be
+        with self.lock:
+            arrival = max(self.arrivals.get(key, now), now)
+            wait = arrival + interval - now - tolerance
+            if wait > 0:
+                return wait
+            self.arrivals[key] = arrival + interval * cost
+            # Once there are many, forget the full buckets of idle clients
+            if len(self.arrivals) > 100000:
+                self.arrivals = {k: v for k, v in self.arrivals.items() if v > now}
+            return 0
+
+    def refund(self, key, interval, cost=1):
+        with self.lock:
+            if key in self.arrivals:
+                self.arrivals[key] -= interval * cost
+
+
+class CacheBuckets:
+    """
+    Buckets in a cache shared by every worker.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, interval, tolerance, now, cost=1):
+        cache = caches[self.alias]
+        charge = interval * cost
+        # Outlives any wait; a client that never lets up gets a fresh
+        # bucket when its key expires, at most one extra burst per timeout
+        timeout = max(60, 2 * math.ceil((tolerance + charge) / 1000))
+        try:
+            arrival = cache.incr(key, charge)
+        except ValueError:
+            arrival = now + charge
+            if not cache.add(key, arrival, timeout=timeout):
+                arrival = cache.incr(key, charge)
+        else:
+            if arrival - charge < now - tolerance:
+                # Idle long enough for the bucket to be full again; incr
+                # can't take the max() with the clock, so restart from now
+                arrival = now + charge
+                cache.set(key, arrival, timeout=timeout)
+
+        # Allowed when the bucket had a token left before this charge
+        wait = arrival - charge + interval - now - tolerance
+        if wait > 0:
+            # Refused requests take no token
+            cache.decr(key, charge)
+            return wait
+        return 0
+
+    def refund(self, key, interval, cost=1):
+        try:
+            caches[self.alias].decr(key, interval * cost)
+        except ValueError:
+            pass
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    options = settings.RATE_LIMITS
+    name = (options["BACKEND"], options["CACHE_ALIAS"])
+    with _backends_lock:
+        if name not in _backends:
+            if options["BACKEND"] == "local":
+                _backends[name] = LocalBuckets()
+            else:
+                _backends[name] = CacheBuckets(options["CACHE_ALIAS"])
+        return _backends[name]
+
+
+def client_ip(request):
+    header = settings.RATE_LIMITS["CLIENT_IP_HEADER"]
+    if header and request.headers.get(header):
+        # The proxy appends the address it saw last
+        return request.headers[header].split(",")[-1].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def token_user_id(request):
+    # Verified, so nobody can spend another user's tokens; no database hit
+    authenticator = ClaimsJWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header else None
+    if raw_token is None:
+        return None
+    try:
+        token = authenticator.get_validated_token(raw_token)
+    except InvalidToken:
+        return None
+    return token.get(api_settings.USER_ID_CLAIM)
+
+
+def client_key(request, policy):
+    if policy.get("KEY") != "ip":
+        user_id = token_user_id(request)
+        if user_id is not None:
+            return f"user:{user_id}"
+    return f"ip:{client_ip(request)}"
+
+
+def operation_costs(request, policy):
+    # Operations per charged policy; malformed batches are left to the view
+    try:
+        operations = json.loads(request.body).get("operations")
+    except (ValueError, AttributeError):
+        return {}
+    if not isinstance(operations, list):
+        return {}
+    costs = {}
+    for operation in operations[: settings.BATCH_WRITES["MAX_OPERATIONS"]]:
+        kind = operation.get("op") if isinstance(operation, dict) else None
+        charged = policy["OPERATIONS"].get(kind)
+        if charged is not None:
+            costs[charged] = costs.get(charged, 0) + 1
+    return costs
+
+
+def charges(request, name, policy):
+    # (bucket name, policy, tokens) for every bucket this request spends
+    policies = settings.RATE_LIMITS["POLICIES"]
+    result = []
+    if "RATE" in policy:
+        result.append((name, policy, 1))
+    if "OPERATIONS" in policy:
+        for charged, cost in operation_costs(request, policy).items():
+            result.append((charged, policies[charged], cost))
+    return result
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        options = settings.RATE_LIMITS
+        name = request.resolver_match.url_name
+        policy = options["POLICIES"].get(name)
+        if not options["ENABLED"] or policy is None:
+            return None
+
+        backend = get_backend()
+        key = client_key(request, policy)
+        now = time.time_ns() // 10**6
+        taken = []
+        for bucket, charged, cost in charges(request, name, policy):
+            interval, tolerance = parse_policy(charged["RATE"], charged["BURST"])
+            bucket_key = f"ratelimit:{bucket}:{key}"
+            wait = backend.take(bucket_key, interval, tolerance, now, cost)
+            if wait:
+                break
+            taken.append((bucket_key, interval, cost))
+        else:
+            return None
+
+        # A refused request spends no tokens in the buckets it already passed
+        for bucket_key, interval, cost in taken:
+            backend.refund(bucket_key, interval, cost)
+        registry.inc(
+            "echo_rate_limited_total", {"view": name, "key": key.split(":")[0]}
+        )
+        response = JsonResponse(
+            {"errors": "Too many requests, try again later"}, status=429
+        )
+        response["Retry-After"] = str(math.ceil(wait / 1000))
+        return response
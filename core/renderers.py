@@ -0,0 +1,68 @@
+"""
+JSON rendering for the feed endpoints.
+
+``render_json`` is a drop-in for ``JsonResponse`` that encodes with the
+configured backend: orjson when it is installed, else the standard library.
+"""
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def format_datetime(value):
+    # Same format as DjangoJSONEncoder, so payloads don't depend on the
+    # backend or on whether a datetime was formatted ahead of time
+    text = value.isoformat()
+    if value.microsecond:
+        text = text[:23] + text[26:]
+    if text.endswith("+00:00"):
+        text = text.removesuffix("+00:00") + "Z"
+    return text
+
+
+class StdlibJSONBackend:
+    def __init__(self):
+        self.encoder = DjangoJSONEncoder(separators=(",", ":"))
+
+    def dumps(self, data):
+        return self.encoder.encode(data).encode()
+
+
+class OrjsonBackend:
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        self.default = DjangoJSONEncoder().default
+
+    def dumps(self, data):
+        # Datetimes are passed to DjangoJSONEncoder for the same format
+        return orjson.dumps(
+            data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+
+_backend = None
+
+
+def json_backend():
+    global _backend
+    if _backend is None:
+        path = settings.JSON_RENDERING["BACKEND"]
+        if path is None:
+            _backend = OrjsonBackend() if orjson else StdlibJSONBackend()
+        else:
+            _backend = import_string(path)()
+    return _backend
+
+
+def render_json(data, status=200):
+    return HttpResponse(
+        json_backend().dumps(data), content_type="application/json", status=status
+    )
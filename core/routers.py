@@ -0,0 +1,172 @@
+"""
+Routing between the primary database and its read replicas.
+
+Reads made while serving the views in DATABASE_REPLICAS["VIEWS"] go to a
+replica; everything else, and every write, goes to the primary. A request
+that writes pins its user, and through a cookie its client, to the primary
+for STICKY_SECONDS, so people see their own echoes and likes while the
+replicas catch up; feed pages shared between users are cached no longer
+than that when built from a replica, and skipped by pinned users.
+"""
+
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject
+
+PIN_COOKIE = "db_pin"
+
+
+class RoutingState:
+    def __init__(self, request):
+        self.request = request
+        # The replica this request reads from, if its view reads from one
+        self.replica = None
+        self.pinned = None
+        self.wrote = False
+
+
+_state = ContextVar("db_routing", default=None)
+
+
+def pin_key(user_id):
+    return f"db:pin:{user_id}"
+
+
+def request_user_id(request):
+    # Only a user the view has already authenticated: resolving the lazy
+    # session user would itself query the database, from inside the router
+    user = request.__dict__.get("user")
+    if user is None or isinstance(user, SimpleLazyObject):
+        return None
+    return user.id if user.is_authenticated else None
+
+
+def is_pinned(request):
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    user_id = request_user_id(request)
+    return user_id is not None and cache.get(pin_key(user_id)) is not None
+
+
+async def ais_pinned(request):
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    user_id = request_user_id(request)
+    return user_id is not None and await cache.aget(pin_key(user_id)) is not None
+
+
+def replica_state():
+    # The request's routing state, if its reads may go to a replica
+    state = _state.get()
+    if state is None or state.replica is None or state.wrote:
+        return None
+    return state
+
+
+def reading_replica():
+    """
+    The replica the reads made here go to, or None for the primary.
+    """
+    state = replica_state()
+    if state is None:
+        return None
+    if state.pinned is None:
+        state.pinned = is_pinned(state.request)
+    return None if state.pinned else state.replica
+
+
+async def areading_replica():
+    """
+    Async counterpart of ``reading_replica``, checking the pin through the
+    async cache API instead of a thread.
+    """
+    state = replica_state()
+    if state is None:
+        return None
+    if state.pinned is None:
+        state.pinned = await ais_pinned(state.request)
+    return None if state.pinned else state.replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return reading_replica()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS["ALIASES"]
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        user_id = self.pin(state, response)
+        if user_id is not None:
+            cache.set(
+                pin_key(user_id), True, settings.DATABASE_REPLICAS["STICKY_SECONDS"]
+            )
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        user_id = self.pin(state, response)
+        if user_id is not None:
+            await cache.aset(
+                pin_key(user_id), True, settings.DATABASE_REPLICAS["STICKY_SECONDS"]
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        options = settings.DATABASE_REPLICAS
+        if state is not None and options["ALIASES"]:
+            if request.resolver_match.url_name in options["VIEWS"]:
+                state.replica = random.choice(options["ALIASES"])
+        return None
+
+    def pin(self, state, response):
+        # Set the client's cookie; return the user to pin, if any
+        if not state.wrote or not settings.DATABASE_REPLICAS["ALIASES"]:
+            return None
+        response.set_cookie(
+            PIN_COOKIE,
+            "1",
+            max_age=settings.DATABASE_REPLICAS["STICKY_SECONDS"],
+            httponly=True,
+            samesite="Lax",
+        )
+        return request_user_id(state.request)
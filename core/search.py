@@ -0,0 +1,152 @@
+"""
+Full-text search over echoes and their comments.
+
+PostgreSQL keeps a ``search_vector`` tsvector column with a GIN index on
+``core_echo`` and ``core_comment``; SQLite keeps an FTS5 table,
+``core_search``, with one row per echo and per comment. Neither is part of
+the models, so regular queries never load them. Both are maintained by
+``index_echoes``/``index_comments`` when echoes and comments are written,
+and rebuilt by the ``rebuild_search_index`` command.
+"""
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Comment, Echo
+from .pagination import decode_rank_cursor, encode_rank_cursor, parse_limit
+
+
+class PostgresSearch:
+    def index(self, model, rows):
+        # rows are (id, echo_id, content); the vector is built from content
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {model._meta.db_table} "
+                "SET search_vector = to_tsvector(%s::regconfig, content) "
+                "WHERE id = ANY(%s)",
+                [settings.SEARCH["CONFIG"], [row_id for row_id, _, _ in rows]],
+            )
+
+    def unindex(self, echo_ids):
+        # The vectors are columns of the rows and are deleted along with them
+        pass
+
+    def matches(self, query):
+        # As SQLite must, refuse queries that are nothing but quotes
+        if not query.replace('"', " ").strip():
+            raise ValueError("Search query has no terms")
+        # Best rank of each echo over its own text and its comments'
+        sql = (
+            "WITH q AS (SELECT websearch_to_tsquery(%s::regconfig, %s) AS query), "
+            "hits AS ("
+            "SELECT e.id AS echo_id, ts_rank(e.search_vector, q.query)::float8 "
+            "AS score FROM core_echo e, q WHERE e.search_vector @@ q.query "
+            "UNION ALL "
+            "SELECT c.echo_id, ts_rank(c.search_vector, q.query)::float8 "
+            "FROM core_comment c, q WHERE c.search_vector @@ q.query) "
+            "SELECT echo_id, max(score) AS score FROM hits GROUP BY echo_id"
+        )
+        return sql, [settings.SEARCH["CONFIG"], query]
+
+
+class SQLiteSearch:
+    def index(self, model, rows):
+        # Echoes take even rowids and comments odd ones, so re-indexing a
+        # row replaces it instead of adding a duplicate
+        parity = 1 if model is Comment else 0
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO core_search (rowid, content, echo_id) "
+                "VALUES (%s, %s, %s)",
+                [
+                    (row_id * 2 + parity, content, echo_id)
+                    for row_id, echo_id, content in rows
+                ],
+            )
+
+    def unindex(self, echo_ids):
+        # By rowid, as echo_id is UNINDEXED and matching on it would scan
+        # the whole index; run before the rows themselves are deleted
+        placeholders = ", ".join(["%s"] * len(echo_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM core_search WHERE rowid IN ("
+                f"SELECT id * 2 FROM {Echo._meta.db_table} "
+                f"WHERE id IN ({placeholders}) UNION ALL "
+                f"SELECT id * 2 + 1 FROM {Comment._meta.db_table} "
+                f"WHERE echo_id IN ({placeholders}))",
+                [*echo_ids, *echo_ids],
+            )
+
+    def matches(self, query):
+        # FTS5 treats punctuation and keywords as syntax; quote every term
+        terms = " ".join(f'"{term}"' for term in query.replace('"', " ").split())
+        if not terms:
+            # An empty MATCH is a syntax error
+            raise ValueError("Search query has no terms")
+        # bm25() is lower for better matches and can't be used once the
+        # subquery is flattened into the GROUP BY, which LIMIT -1 prevents
+        sql = (
+            "SELECT echo_id, max(score) AS score FROM ("
+            "SELECT echo_id, -bm25(core_search) AS score FROM core_search "
+            "WHERE core_search MATCH %s LIMIT -1) GROUP BY echo_id"
+        )
+        return sql, [terms]
+
+
+BACKENDS = {"postgresql": PostgresSearch, "sqlite": SQLiteSearch}
+
+
+def search_backend():
+    return BACKENDS[connection.vendor]()
+
+
+def index_echoes(echoes):
+    search_backend().index(Echo, [(echo.id, echo.id, echo.content) for echo in echoes])
+
+
+def index_comments(comments):
+    search_backend().index(
+        Comment,
+        [(comment.id, comment.echo_id, comment.content) for comment in comments],
+    )
+
+
+def unindex_echoes(echo_ids):
+    # Drop echoes and their comments from the index, e.g. when archived
+    search_backend().unindex(echo_ids)
+
+
+def search_page(query, params):
+    """
+    A page of echoes matching ``query``, best match first, and the cursor
+    for the next page.
+
+    Pages are keyed on (score, echo id) rather than an offset, so echoes
+    written while a client pages through don't shift later pages.
+    """
+    limit = parse_limit(params.get("limit"))
+    sql, sql_params = search_backend().matches(query)
+    sql = f"SELECT echo_id, score FROM ({sql}) ranked"
+
+    before = params.get("before")
+    if before:
+        score, echo_id = decode_rank_cursor(before)
+        sql += " WHERE score < %s OR (score = %s AND echo_id < %s)"
+        sql_params += [score, score, echo_id]
+    sql += " ORDER BY score DESC, echo_id DESC LIMIT %s"
+    sql_params.append(limit + 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, sql_params)
+        hits = cursor.fetchall()
+
+    echoes = Echo.objects.select_related("user__profile").in_bulk(
+        [echo_id for echo_id, _ in hits[:limit]]
+    )
+    page = [echoes[echo_id] for echo_id, _ in hits[:limit] if echo_id in echoes]
+    next_cursor = None
+    if len(hits) > limit:
+        echo_id, score = hits[limit - 1]
+        next_cursor = encode_rank_cursor(score, echo_id)
+    return page, next_cursor
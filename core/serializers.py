@@ -1,8 +1,17 @@
 from django.conf import settings
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from .avatars import avatar_url
+from .last_login import last_logins
+
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # Buffered and written in bulk instead of saving the user per login
+        last_logins.record(self.user.id)
+        return data
+
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
@@ -10,7 +19,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         # Add custom claims
         token["username"] = user.username
         profile_picture_url = (
-            user.profile.profile_picture.url
+            avatar_url(user.profile)
             if hasattr(user, "profile") and user.profile.profile_picture
             else None
         )
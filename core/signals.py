@@ -1,15 +1,48 @@
+import logging
+
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.core.signals import request_started
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from .authentication import active_users, invalidate_user
+from .last_login import last_logins
 from .models import Profile
 
+logger = logging.getLogger(__name__)
+
 
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
-    if created:
+def create_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    # Saving a user never changes their profile, which is saved by the code
+    # that changes it; only create it when missing. Partial saves, such as
+    # password rehashes, skip even the check
+    if created or (update_fields is None and not hasattr(instance, "profile")):
         Profile.objects.create(user=instance)
-    else:
-        if not hasattr(instance, "profile"):
-            Profile.objects.create(user=instance)
-        instance.profile.save()
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.id, instance.is_active)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    invalidate_user(instance.id, is_active=False)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    active_users.invalidate(instance.user_id)
+
+
+@receiver(request_started)
+def flush_last_logins(sender, **kwargs):
+    # On the request path rather than at its end, so the write reuses the
+    # connection the request is about to open
+    try:
+        last_logins.flush_if_due()
+    except DatabaseError:
+        # Kept for the next flush; never fail the request that triggered it
+        logger.exception("Failed to write buffered last_login times")
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+CONTENT_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names every file after the SHA-256 of its bytes.
+
+    Files are streamed to a temporary file in chunks while being hashed and
+    then moved to ``<dir>/<ab>/<cd>/<hash><ext>``, so identical uploads are
+    stored once and a name always refers to the same bytes.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content has been hashed
+        return name
+
+    def _save(self, name, content):
+        directory, basename = posixpath.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+
+        temp_dir = os.path.join(self.location, ".incoming")
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, "wb") as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            content_hash = digest.hexdigest()
+            name = posixpath.join(
+                directory, content_hash[:2], content_hash[2:4], content_hash + extension
+            )
+            path = self.path(name)
+            if os.path.exists(path):
+                # Same bytes are already stored
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+def is_content_addressed(name):
+    stem = os.path.splitext(posixpath.basename(name))[0]
+    return bool(CONTENT_HASH.match(stem))
+
+
+class MaxUploadSizeHandler(FileUploadHandler):
+    """
+    Stop reading an uploaded file as soon as it exceeds MAX_UPLOAD_SIZE,
+    before the rest of it is spooled to memory or disk.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MEDIA_STORAGE["MAX_UPLOAD_SIZE"]:
+            self.request.upload_too_large = True
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
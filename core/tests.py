@@ -1,3 +1,1466 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    avatars,
+    checks,
+    events,
+    last_login,
+    metrics,
+    passwords,
+    ratelimit,
+    renderers,
+)
+from .authentication import active_users, get_active_user
+from .counters import adjust_counters
+from .feed_cache import VERSION_KEY, bump_like_state, feed_version
+from .likes import toggle_like
+from .management.commands.bench_endpoints import Command as BenchEndpoints
+from .models import (
+    ArchivedEcho,
+    Comment,
+    CounterShard,
+    Echo,
+    IdempotencyKey,
+    Profile,
+    TimelineEntry,
+)
+from .routers import PIN_COOKIE, RoutingState, _state, areading_replica, pin_key
+
+# A cache every worker process would see, for the paths that rely on one
+shared_cache = override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(tempfile.gettempdir(), "echo-tests-cache"),
+        }
+    }
+)
+
+
+def auth_header(user):
+    return {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(user).access_token}"}
+
+
+def make_echoes(users, count):
+    echoes = []
+    for i in range(count):
+        author = users[i % len(users)]
+        echo = Echo.objects.create(user=author, content=f"echo {i}")
+        likers = users[: i % len(users) + 1]
+        echo.likes.add(*likers)
+        for j in range(3):
+            Comment.objects.create(
+                user=users[j % len(users)], echo=echo, content=f"comment {i}.{j}"
+            )
+        adjust_counters(echo, likes=len(likers), comments=3)
+        echoes.append(echo)
+    return echoes
+
+
+class FeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="secret123")
+            for i in range(3)
+        ]
+
+    def count_queries(self, url, **extra):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_feed_payload(self):
+        make_echoes(self.users, 2)
+        _, data = self.count_queries("/api/list-echoes/", **auth_header(self.users[0]))
+
+        self.assertEqual([echo["content"] for echo in data], ["echo 1", "echo 0"])
+        self.assertEqual(
+            list(data[0]),
+            [
+                "id",
+                "user",
+                "user_profile_picture",
+                "content",
+                "created_at",
+                "likes",
+                "is_liked",
+                "comments",
+            ],
+        )
+        self.assertEqual(data[0]["likes"], 2)
+        self.assertTrue(data[0]["is_liked"])
+        self.assertEqual(data[0]["user"], "user1")
+        self.assertIsNone(data[0]["user_profile_picture"])
+        self.assertEqual(
+            [comment["content"] for comment in data[0]["comments"]],
+            ["comment 1.2", "comment 1.1", "comment 1.0"],
+        )
+
+    @shared_cache
+    def test_feed_query_count_is_constant(self):
+        make_echoes(self.users, 2)
+        small, _ = self.count_queries("/api/list-echoes-no-auth/")
+        small_auth, _ = self.count_queries(
+            "/api/list-echoes/", **auth_header(self.users[0])
+        )
+
+        make_echoes(self.users, 20)
+        large, data = self.count_queries("/api/list-echoes-no-auth/")
+        large_auth, _ = self.count_queries(
+            "/api/list-echoes/", **auth_header(self.users[0])
+        )
+
+        self.assertEqual(len(data), 20)
+        self.assertEqual(small, large)
+        self.assertEqual(small_auth, large_auth)
+
+    def test_compact_feed_has_counts_and_few_previews(self):
+        echo = make_echoes(self.users, 1)[0]
+        for i in range(25):
+            Comment.objects.create(user=self.users[0], echo=echo, content=f"more {i}")
+        adjust_counters(echo, comments=25)
+
+        queries, full = self.count_queries("/api/list-echoes-no-auth/")
+        compact_queries, compact = self.count_queries(
+            "/api/list-echoes-no-auth/?compact=1"
+        )
+        self.assertEqual(compact_queries, queries)
+        self.assertEqual(len(full[0]["comments"]), 20)
+        self.assertNotIn("comment_count", full[0])
+        self.assertEqual(compact[0]["comment_count"], 28)
+        self.assertEqual(
+            [comment["content"] for comment in compact[0]["comments"]],
+            ["more 24", "more 23", "more 22"],
+        )
+
+    def test_comments_endpoint_pages_through_all_comments(self):
+        echo = make_echoes(self.users, 1)[0]
+        for i in range(4):
+            Comment.objects.create(user=self.users[1], echo=echo, content=f"more {i}")
+
+        contents, url = [], f"/api/echoes/{echo.id}/comments/?limit=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            contents += [comment["content"] for comment in response.json()]
+            cursor = response.get("X-Next-Cursor")
+            url = cursor and f"/api/echoes/{echo.id}/comments/?limit=3&before={cursor}"
+
+        self.assertEqual(
+            contents,
+            [f"more {i}" for i in range(3, -1, -1)]
+            + [f"comment 0.{j}" for j in range(2, -1, -1)],
+        )
+        self.assertEqual(self.client.get("/api/echoes/999/comments/").status_code, 404)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="reader", password="secret123")
+        for i in range(25):
+            Echo.objects.create(user=self.user, content=f"echo {i}")
+
+    def test_before_cursor_walks_the_whole_feed(self):
+        contents = []
+        url = "/api/list-echoes-no-auth/?limit=10"
+        while url:
+            response = self.client.get(url)
+            contents += [echo["content"] for echo in response.json()]
+            cursor = response.get("X-Next-Cursor")
+            url = cursor and f"/api/list-echoes-no-auth/?limit=10&before={cursor}"
+
+        self.assertEqual(contents, [f"echo {i}" for i in reversed(range(25))])
+
+    def test_after_cursor_returns_newer_echoes(self):
+        response = self.client.get("/api/list-echoes-no-auth/?limit=5")
+        cursor = response["X-Next-Cursor"]
+        # The first page ends at echo 20; only echoes 21-24 are newer
+        response = self.client.get(f"/api/list-echoes-no-auth/?after={cursor}")
+
+        self.assertEqual(
+            [echo["content"] for echo in response.json()],
+            ["echo 24", "echo 23", "echo 22", "echo 21"],
+        )
+        self.assertNotIn("X-Next-Cursor", response)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/list-echoes-no-auth/?before=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="liker", password="secret123")
+        self.echo = Echo.objects.create(user=self.user, content="hello")
+
+    def test_like_and_comment_update_counters(self):
+        headers = auth_header(self.user)
+        response = self.client.post(f"/api/like-echo/{self.echo.id}/", **headers)
+        self.assertEqual(response.json()["likes"], 1)
+        self.client.post(
+            "/api/create-comment/",
+            {"echo_id": self.echo.id, "content": "hi"},
+            content_type="application/json",
+            **headers,
+        )
+        response = self.client.post(f"/api/like-echo/{self.echo.id}/", **headers)
+        self.assertEqual(response.json()["likes"], 0)
+
+        self.echo.refresh_from_db()
+        self.assertEqual((self.echo.like_count, self.echo.comment_count), (0, 1))
+
+    def test_sharded_counters_are_summed_and_reconciled(self):
+        self.echo.counter_shards = 4
+        self.echo.save()
+        self.echo.likes.add(self.user)
+        for _ in range(3):
+            adjust_counters(self.echo, likes=1)
+
+        data = self.client.get("/api/list-echoes-no-auth/").json()
+        self.assertEqual(data[0]["likes"], 3)
+
+        call_command("reconcile_counters", "--batch-size=1", stdout=StringIO())
+        self.echo.refresh_from_db()
+        self.assertEqual(self.echo.like_count, 1)
+        self.assertFalse(CounterShard.objects.exists())
+
+    def test_compact_like_toggle(self):
+        other = User.objects.create_user(username="other", password="secret123")
+        self.echo.likes.add(other)
+        adjust_counters(self.echo, likes=1)
+        url = f"/api/like-echo/{self.echo.id}/?compact=1"
+
+        response = self.client.post(url, **auth_header(self.user))
+        self.assertEqual(
+            response.json(), {"id": self.echo.id, "likes": 2, "is_liked": True}
+        )
+        response = self.client.post(url, **auth_header(self.user))
+        self.assertEqual(
+            response.json(), {"id": self.echo.id, "likes": 1, "is_liked": False}
+        )
+        self.assertEqual(list(self.echo.likes.all()), [other])
+
+
+class FeedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="cached", password="secret123")
+        self.echo = Echo.objects.create(user=self.user, content="cached echo")
+
+    def test_cached_page_is_shared_and_invalidated_by_writes(self):
+        self.client.get("/api/list-echoes-no-auth/")
+        with self.assertNumQueries(0):
+            data = self.client.get("/api/list-echoes-no-auth/").json()
+        self.assertEqual(data[0]["likes"], 0)
+
+        headers = auth_header(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/like-echo/{self.echo.id}/?compact=1", **headers)
+
+        data = self.client.get("/api/list-echoes-no-auth/").json()
+        self.assertEqual((data[0]["likes"], data[0]["is_liked"]), (1, False))
+        data = self.client.get("/api/list-echoes/", **headers).json()
+        self.assertEqual((data[0]["likes"], data[0]["is_liked"]), (1, True))
+
+    @shared_cache
+    def test_feeds_answer_conditional_requests_without_building(self):
+        cache.clear()
+        headers = auth_header(self.user)
+        response = self.client.get("/api/list-echoes/", **headers)
+        etag, modified = response["ETag"], response["Last-Modified"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/list-echoes/", HTTP_IF_NONE_MATCH=etag, **headers
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        response = self.client.get(
+            "/api/list-echoes-no-auth/", HTTP_IF_MODIFIED_SINCE=modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # Only the viewer's own like state changes the viewer's validator
+        other = User.objects.create_user(username="other", password="secret123")
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_like_state(other.id)
+        response = self.client.get(
+            "/api/list-echoes/", HTTP_IF_NONE_MATCH=etag, **headers
+        )
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_like_state(self.user.id)
+        response = self.client.get(
+            "/api/list-echoes/", HTTP_IF_NONE_MATCH=etag, **headers
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "worker1",
+            },
+            "worker2": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "worker2",
+            },
+        }
+    )
+    def test_per_process_feed_cache_sends_no_validators(self):
+        response = self.client.get("/api/list-echoes-no-auth/")
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+        # Another worker takes a write this one never hears of; a copy
+        # validated by this worker's own version must not get a 304
+        stale = f'"{feed_version()}-0"'
+        caches["worker2"].set(VERSION_KEY, feed_version() + 1)
+        response = self.client.get(
+            "/api/list-echoes-no-auth/", HTTP_IF_NONE_MATCH=stale
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_deploy_check_flags_a_per_process_feed_cache(self):
+        self.assertIn("core.W001", [w.id for w in checks.check_shared_caches(None)])
+        with override_settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}
+            }
+        ):
+            self.assertEqual(checks.check_shared_caches(None), [])
+
+
+class AuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        active_users.clear()
+        self.user = User.objects.create_user(username="fast", password="secret123")
+
+    @shared_cache
+    def test_token_claims_replace_user_query(self):
+        headers = auth_header(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/list-liked-echoes/", **headers)
+        self.assertFalse(any('FROM "auth_user"' in q["sql"] for q in queries))
+
+    def test_per_process_cache_checks_the_user(self):
+        # Deactivated by another worker: no marker in this process's cache
+        headers = auth_header(self.user)
+        self.assertEqual(
+            self.client.get("/api/list-echoes/", **headers).status_code, 200
+        )
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        # ...once this worker's cached user has expired
+        active_users.clear()
+        response = self.client.get("/api/list-echoes/", **headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        headers = auth_header(self.user)
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get("/api/list-echoes/", **headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_profile_change_invalidates_cached_user(self):
+        self.assertIs(get_active_user(self.user.id), get_active_user(self.user.id))
+        cached = get_active_user(self.user.id)
+        self.user.profile.save()
+        self.assertIsNot(get_active_user(self.user.id), cached)
+
+
+class AvatarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.user = User.objects.create_user(username="avatar", password="secret123")
+
+    def media_settings(self, **kwargs):
+        # Render thumbnails inline and keep uploads out of the project
+        return self.settings(
+            MEDIA_ROOT=self.media_root,
+            AVATAR_RENDITIONS={**settings.AVATAR_RENDITIONS, "WORKERS": 0},
+            **kwargs,
+        )
+
+    def upload(self, user=None, color="red", content=None):
+        if content is None:
+            buffer = BytesIO()
+            Image.new("RGB", (640, 480), color).save(buffer, format="PNG")
+            content = buffer.getvalue()
+        picture = SimpleUploadedFile("me.png", content, "image/png")
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/api/upload-profile-pic/",
+                {"profile_picture": picture},
+                **auth_header(user or self.user),
+            )
+
+    def test_upload_renders_thumbnails_used_by_the_feed(self):
+        with self.media_settings():
+            response = self.upload()
+            self.assertEqual(response.status_code, 201)
+            Echo.objects.create(user=self.user, content="with avatar")
+            data = self.client.get("/api/list-echoes-no-auth/").json()
+
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(set(profile.renditions), {"48", "96", "256"})
+        with Image.open(
+            os.path.join(self.media_root, profile.renditions["96"])
+        ) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (96, 96)))
+        self.assertEqual(
+            data[0]["user_profile_picture"],
+            f"http://testserver/media/{profile.renditions['96']}",
+        )
+
+    def test_avatar_url_picks_the_smallest_rendition_that_fits(self):
+        profile = self.user.profile
+        profile.profile_picture = "profile_pics/me.png"
+        profile.renditions = {"48": "r/me_48.webp", "256": "r/me_256.webp"}
+        self.assertEqual(avatars.avatar_url(profile, 48), "/media/r/me_48.webp")
+        self.assertEqual(avatars.avatar_url(profile, 96), "/media/r/me_256.webp")
+        self.assertEqual(avatars.avatar_url(profile, 512), "/media/profile_pics/me.png")
+
+    def test_identical_uploads_share_one_cached_file(self):
+        other = User.objects.create_user(username="twin", password="secret123")
+        with self.media_settings():
+            first = self.upload().json()["user_profile_picture"]
+            second = self.upload(other).json()["user_profile_picture"]
+            self.assertEqual(first, second)
+            self.assertRegex(first, r"/media/profile_pics/../../[0-9a-f]{64}\.png$")
+
+            response = self.client.get(first)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("immutable", response["Cache-Control"])
+            response = self.client.get(first, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+
+            # The other profile still uses the replaced picture
+            self.upload(color="blue")
+            self.assertEqual(self.client.get(first).status_code, 200)
+
+    def test_oversize_upload_is_rejected(self):
+        with self.media_settings(MEDIA_STORAGE={"MAX_UPLOAD_SIZE": 1024}):
+            response = self.upload(content=os.urandom(4096))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Profile.objects.get(user=self.user).profile_picture)
+
+
+@override_settings(ROOT_URLCONF="echo.asgi_urls")
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="async", password="secret123")
+        self.headers = {"AUTHORIZATION": auth_header(self.user)["HTTP_AUTHORIZATION"]}
+
+    @shared_cache
+    async def test_async_endpoints_match_sync_payloads(self):
+        await cache.aclear()
+        response = await self.async_client.post(
+            "/api/create-echo/",
+            {"content": "async echo"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        echo_id = response.json()["id"]
+
+        response = await self.async_client.post(
+            "/api/create-comment/",
+            {"echo_id": echo_id, "content": "async comment"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.json()["comments"][0]["content"], "async comment")
+
+        response = await self.async_client.post(
+            f"/api/like-echo/{echo_id}/?compact=1", headers=self.headers
+        )
+        self.assertEqual(response.json(), {"id": echo_id, "likes": 1, "is_liked": True})
+
+        response = await self.async_client.get(
+            "/api/list-liked-echoes/", headers=self.headers
+        )
+        data = response.json()
+        self.assertEqual([echo["id"] for echo in data], [echo_id])
+        self.assertEqual((data[0]["likes"], data[0]["is_liked"]), (1, True))
+
+        response = await self.async_client.get("/api/list-echoes-no-auth/")
+        self.assertFalse(response.json()[0]["is_liked"])
+        response = await self.async_client.get(
+            "/api/list-echoes-no-auth/", headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_missing_token_is_rejected(self):
+        response = await self.async_client.get("/api/list-echoes/")
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(EVENT_BUS={**settings.EVENT_BUS, "REPLAY_SIZE": 5, "QUEUE_SIZE": 2})
+class EventStreamTests(TestCase):
+    def setUp(self):
+        events._bus = None
+        self.addCleanup(setattr, events, "_bus", None)
+
+    async def next_events(self, stream, count):
+        messages = [await anext(stream) for _ in range(count)]
+        return [message for message in messages if message.startswith("id:")]
+
+    async def test_stream_delivers_and_resumes(self):
+        stream = events.event_stream()
+        self.assertTrue((await anext(stream)).startswith("retry:"))
+
+        events.get_bus().publish("like", {"id": 1, "likes": 1})
+        [message] = await self.next_events(stream, 1)
+        self.assertIn('event: like\ndata: {"id": 1, "likes": 1}', message)
+        await stream.aclose()
+
+        first_id = int(message.split("\n")[0][4:])
+        events.get_bus().publish("like", {"id": 1, "likes": 2})
+        resumed = events.event_stream(last_event_id=first_id)
+        await anext(resumed)
+        [message] = await self.next_events(resumed, 1)
+        self.assertIn('"likes": 2', message)
+        await resumed.aclose()
+
+    async def test_slow_subscriber_catches_up_from_replay_buffer(self):
+        stream = events.event_stream()
+        await anext(stream)
+        for likes in range(4):
+            events.get_bus().publish("like", {"id": 1, "likes": likes})
+        await asyncio.sleep(0)
+
+        messages = await self.next_events(stream, 4)
+        self.assertEqual(
+            [json.loads(message.split("data: ")[1]) for message in messages],
+            [{"id": 1, "likes": likes} for likes in range(4)],
+        )
+        await stream.aclose()
+
+    async def test_resume_past_replay_buffer_resets(self):
+        for likes in range(7):
+            events.get_bus().publish("like", {"id": 1, "likes": likes})
+        stream = events.event_stream(last_event_id=1)
+        await anext(stream)
+        self.assertTrue((await anext(stream)).startswith("event: reset"))
+        await stream.aclose()
+
+    def test_concurrent_publishers_deliver_in_id_order(self):
+        with self.settings(EVENT_BUS={**settings.EVENT_BUS, "REPLAY_SIZE": 1000}):
+            bus = events.get_bus()
+
+        def publish():
+            for likes in range(100):
+                bus.publish("like", {"id": 1, "likes": likes})
+
+        threads = [threading.Thread(target=publish) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ids = [event["id"] for event in bus.replay]
+        self.assertEqual(len(ids), 400)
+        self.assertEqual(ids, sorted(ids))
+
+    def test_listener_restores_id_order(self):
+        def event(event_id):
+            return {"id": event_id, "type": "like", "data": {}}
+
+        order = events.IdOrder(window=1)
+        self.assertEqual(order.push(event(5), now=0), [])
+        self.assertEqual(order.push(event(7), now=0.5), [])
+        self.assertEqual(order.push(event(6), now=0.6), [])
+        # 5 waited a full window for any lower id; 6 and 7 follow at once
+        self.assertEqual([e["id"] for e in order.release(now=1)], [5, 6, 7])
+        # A gap is waited out, and the missing id dropped if it comes later
+        self.assertEqual(order.push(event(9), now=2), [])
+        self.assertEqual([e["id"] for e in order.release(now=3)], [9])
+        with self.assertLogs("core.events", "WARNING"):
+            self.assertEqual(order.push(event(8), now=3), [])
+
+    def test_notify_payload_carries_the_sequence_id(self):
+        backend = events.PostgresNotifyBackend(bus=None)
+        self.assertEqual(
+            backend.parse('42 {"type": "like", "data": {"likes": 1}}'),
+            {"id": 42, "type": "like", "data": {"likes": 1}},
+        )
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author, self.reader, self.other = [
+            User.objects.create_user(username=f"user{i}", password="secret123")
+            for i in range(3)
+        ]
+
+    def follow(self, follower, followee):
+        return self.client.post(
+            f"/api/follow/{followee.id}/", **auth_header(follower)
+        ).json()
+
+    def post_echo(self, user, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/create-echo/",
+                json.dumps({"content": content}),
+                content_type="application/json",
+                **auth_header(user),
+            )
+        return response.json()["id"]
+
+    def timeline(self, user, query=""):
+        response = self.client.get(f"/api/home-timeline/{query}", **auth_header(user))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_follow_fans_out_and_unfollow_removes(self):
+        old = self.post_echo(self.author, "before following")
+        self.assertEqual(
+            self.follow(self.reader, self.author),
+            {"id": self.author.id, "is_following": True, "followers": 1},
+        )
+        new = self.post_echo(self.author, "after following")
+        self.post_echo(self.other, "not followed")
+        own = self.post_echo(self.reader, "my own")
+
+        ids = [echo["id"] for echo in self.timeline(self.reader).json()]
+        self.assertEqual(ids, [own, new, old])
+
+        self.assertFalse(self.follow(self.reader, self.author)["is_following"])
+        ids = [echo["id"] for echo in self.timeline(self.reader).json()]
+        self.assertEqual(ids, [own])
+
+    def test_cannot_follow_self_or_unknown_user(self):
+        response = self.client.post(
+            f"/api/follow/{self.reader.id}/", **auth_header(self.reader)
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/follow/9999/", **auth_header(self.reader))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(TIMELINE={**settings.TIMELINE, "CELEBRITY_FOLLOWERS": 2})
+    def test_celebrity_echoes_are_pulled_and_paginated(self):
+        self.follow(self.reader, self.author)
+        self.follow(self.other, self.author)
+        self.follow(self.reader, self.other)
+        pulled = [self.post_echo(self.author, f"celebrity {i}") for i in range(3)]
+        pushed = self.post_echo(self.other, "regular")
+        self.assertFalse(
+            TimelineEntry.objects.filter(owner=self.reader, echo_id=pulled[0]).exists()
+        )
+
+        response = self.timeline(self.reader, "?limit=2")
+        self.assertEqual([echo["id"] for echo in response.json()], [pushed, pulled[2]])
+        cursor = response["X-Next-Cursor"]
+        response = self.timeline(self.reader, f"?limit=2&before={cursor}")
+        self.assertEqual([echo["id"] for echo in response.json()], pulled[1::-1])
+
+    def test_echo_deleted_while_paging_keeps_the_cursor(self):
+        self.follow(self.reader, self.author)
+        first, deleted, last = [
+            self.post_echo(self.author, f"echo {i}") for i in range(3)
+        ]
+        in_bulk = QuerySet.in_bulk
+
+        def delete_then_in_bulk(queryset, id_list):
+            # Deleted after its timeline entry was read, before the echoes
+            Echo.objects.filter(id=deleted).delete()
+            return in_bulk(queryset, id_list)
+
+        with mock.patch.object(QuerySet, "in_bulk", delete_then_in_bulk):
+            response = self.timeline(self.reader, "?limit=2")
+        self.assertEqual([echo["id"] for echo in response.json()], [last])
+        cursor = response["X-Next-Cursor"]
+        response = self.timeline(self.reader, f"?limit=2&before={cursor}")
+        self.assertEqual([echo["id"] for echo in response.json()], [first])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user0", password="secret123")
+
+    def post(self, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                url,
+                json.dumps(data),
+                content_type="application/json",
+                **auth_header(self.user),
+            )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def search(self, query):
+        response = self.client.get(f"/api/search/?{query}", **auth_header(self.user))
+        self.assertEqual(response.status_code, 200)
+        return [echo["id"] for echo in response.json()], response.get("X-Next-Cursor")
+
+    def test_search_matches_echoes_and_comments(self):
+        running = self.post("/api/create-echo/", {"content": "Running in the rain"})
+        other = self.post("/api/create-echo/", {"content": "Quiet day"})
+        self.post("/api/create-comment/", {"echo_id": other, "content": "I ran"})
+        self.post("/api/create-comment/", {"echo_id": other, "content": "runs daily"})
+
+        self.assertCountEqual(self.search("q=run")[0], [running, other])
+        self.assertEqual(self.search('q=rain"(')[0], [running])
+        self.assertEqual(self.search("q=snow")[0], [])
+
+        response = self.client.get("/api/search/?q=", **auth_header(self.user))
+        self.assertEqual(response.status_code, 400)
+
+    def test_queries_of_only_quotes_are_rejected(self):
+        for query in ['"', '""', '" "']:
+            with self.subTest(query=query):
+                response = self.client.get(
+                    "/api/search/", {"q": query}, **auth_header(self.user)
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.json(), {"errors": "Search query has no terms"}
+                )
+
+    def test_search_pages_and_backfill(self):
+        echoes = make_echoes([self.user], 5)
+        self.assertEqual(self.search("q=echo")[0], [])
+
+        call_command("rebuild_search_index", batch_size=2, stdout=StringIO())
+        ids, cursor = self.search("q=echo&limit=3")
+        more, last_cursor = self.search(f"q=echo&limit=3&before={cursor}")
+        self.assertEqual(sorted(ids + more), sorted(echo.id for echo in echoes))
+        self.assertIsNone(last_cursor)
+
+
+class BatchWriteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.other = [
+            User.objects.create_user(username=f"user{i}", password="secret123")
+            for i in range(2)
+        ]
+
+    def batch(self, operations):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/api/batch/",
+                json.dumps({"operations": operations}),
+                content_type="application/json",
+                **auth_header(self.user),
+            )
+
+    def test_batch_applies_mixed_operations_in_few_queries(self):
+        echo = Echo.objects.create(user=self.other, content="existing")
+        echo.likes.add(self.user)
+        adjust_counters(echo, likes=1)
+        operations = [
+            {"op": "echo", "content": f"offline {i}", "key": f"e{i}"} for i in range(50)
+        ]
+        operations += [
+            {"op": "comment", "echo_ref": i, "content": "first!"} for i in range(50)
+        ]
+        operations += [
+            {"op": "like", "echo_ref": 0},
+            {"op": "unlike", "echo_id": echo.id},
+            {"op": "comment", "echo_id": echo.id, "content": "hi"},
+            {"op": "like", "echo_id": 9999},
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 30)
+
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results[:100]], [201] * 100)
+        self.assertEqual(
+            results[100], {"status": 200, "id": results[0]["id"], "is_liked": True}
+        )
+        self.assertEqual(results[-1]["status"], 404)
+
+        first = Echo.objects.get(id=results[0]["id"])
+        echo.refresh_from_db()
+        self.assertEqual((first.like_count, first.comment_count), (1, 1))
+        self.assertEqual((echo.like_count, echo.comment_count), (0, 1))
+        self.assertFalse(echo.likes.filter(id=self.user.id).exists())
+
+    def test_idempotency_keys_replay_results(self):
+        operations = [{"op": "echo", "content": "once", "key": "k1"}]
+        first = self.batch(operations).json()["results"][0]
+        second = self.batch(operations).json()["results"][0]
+        self.assertEqual(Echo.objects.filter(content="once").count(), 1)
+        self.assertEqual(second["id"], first["id"])
+        self.assertTrue(second["replayed"])
+
+    def test_expired_idempotency_keys_are_applied_again(self):
+        operations = [{"op": "echo", "content": "twice", "key": "k1"}]
+        first = self.batch(operations).json()["results"][0]
+        IdempotencyKey.objects.filter(key="k1").update(
+            created_at=timezone.now()
+            - timedelta(seconds=settings.BATCH_WRITES["KEY_TTL"] + 1)
+        )
+        second = self.batch(operations).json()["results"][0]
+        self.assertEqual(Echo.objects.filter(content="twice").count(), 2)
+        self.assertNotEqual(second["id"], first["id"])
+        self.assertNotIn("replayed", second)
+        self.assertEqual(IdempotencyKey.objects.filter(key="k1").count(), 1)
+
+    def test_invalid_batch_applies_nothing(self):
+        response = self.batch(
+            [
+                {"op": "echo", "content": "valid"},
+                {"op": "comment", "echo_ref": 5, "content": "bad ref"},
+                {"op": "shout"},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e["index"] for e in response.json()["errors"]], [1, 2])
+        self.assertFalse(Echo.objects.exists())
+
+
+class RendererTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="secret123")
+            for i in range(2)
+        ]
+        make_echoes(self.users, 6)
+
+    def test_backends_render_identical_payloads(self):
+        page = self.client.get("/api/list-echoes-no-auth/").json()
+        self.assertRegex(page[0]["created_at"], r"^\d{4}-\d\d-\d\dT[\d:.]+Z$")
+        self.assertEqual(
+            json.loads(renderers.OrjsonBackend().dumps(page)),
+            json.loads(renderers.StdlibJSONBackend().dumps(page)),
+        )
+
+
+@override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, "WORKERS": 0})
+class PasswordHashingTests(TestCase):
+    def login(self, password="secret123"):
+        return self.client.post(
+            "/api/login/",
+            json.dumps({"username": "user0", "password": password}),
+            content_type="application/json",
+        )
+
+    def test_login_upgrades_outdated_hashes(self):
+        old = hashers.PBKDF2PasswordHasher().encode("secret123", "salt", 1000)
+        user = User.objects.create(username="user0", password=old)
+
+        self.assertEqual(self.login("wrong").status_code, 401)
+        self.assertEqual(self.login().status_code, 200)
+        user.refresh_from_db()
+        self.assertNotEqual(user.password, old)
+        self.assertTrue(user.check_password("secret123"))
+
+    def test_full_pool_sheds_load(self):
+        User.objects.create_user(username="user0", password="secret123")
+        self.addCleanup(setattr, passwords, "_executor", None)
+        with override_settings(
+            PASSWORD_HASHING={
+                **settings.PASSWORD_HASHING,
+                "WORKERS": 1,
+                "MAX_PENDING": 1,
+            }
+        ):
+            executor, pending = passwords.get_executor()
+            self.addCleanup(executor.shutdown)
+            pending.acquire()
+            self.addCleanup(pending.release)
+
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "1")
+            response = self.client.post(
+                "/api/register/",
+                json.dumps(
+                    {
+                        "username": "new",
+                        "email": "new@example.com",
+                        "password": "pw1234",
+                    }
+                ),
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "1")
+
+    @override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, "WORKERS": 1})
+    def test_pool_recovers_from_a_dead_worker(self):
+        self.addCleanup(setattr, passwords, "_executor", None)
+        executor, _ = passwords.get_executor()
+        self.addCleanup(executor.shutdown)
+        executor.submit(os.getpid).result()
+        for pid in list(executor._processes):
+            os.kill(pid, signal.SIGKILL)
+
+        encoded = passwords.hash_password("secret123")
+        self.assertTrue(hashers.check_password("secret123", encoded))
+        self.assertIsNot(passwords._executor, executor)
+        self.addCleanup(passwords._executor.shutdown)
+
+
+class DatasetTests(TestCase):
+    def test_generated_timestamps_span_the_history_window(self):
+        call_command(
+            "generate_dataset", users=10, echoes=100, days=30, stdout=StringIO()
+        )
+        echoes = Echo.objects.order_by("created_at")
+        span = echoes.last().created_at - echoes.first().created_at
+        self.assertGreater(span.days, 20)
+        self.assertLessEqual(span.days, 30)
+        # New echoes are still stamped with the current time
+        self.assertTrue(Echo._meta.get_field("created_at").auto_now_add)
+
+    def test_generated_dataset_has_consistent_counters(self):
+        call_command(
+            "generate_dataset", users=30, echoes=200, batch_size=64, stdout=StringIO()
+        )
+        self.assertEqual(Profile.objects.count(), 30)
+        self.assertEqual(Echo.objects.count(), 200)
+        self.assertTrue(Comment.objects.exists())
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("Checked 200 echoes, repaired 0.", out.getvalue())
+
+    def test_benchmark_flags_query_and_latency_regressions(self):
+        baseline = {"feed": {"queries": 3}}
+        timings = {"feed": {"p95_ms": 10.0, "queries": 3}}
+        options = {"latency_tolerance": 2.0, "latency_floor": 5.0}
+        within = {"feed": {"p95_ms": 19.0, "queries": 3}}
+        self.assertEqual(BenchEndpoints().compare(within, baseline, options), [])
+
+        regressed = {"feed": {"p95_ms": 25.0, "queries": 4}}
+        failures = BenchEndpoints().compare(regressed, baseline, options)
+        self.assertEqual(failures, ["feed: 4 queries per request, budget 3"])
+
+        # Latency only counts against timings calibrated on this machine
+        failures = BenchEndpoints().compare(regressed, baseline, options, timings)
+        self.assertEqual(len(failures), 2)
+        self.assertIn("p95 25.00 ms, calibrated 10.00 ms", failures[1])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.__init__()
+
+    def test_requests_are_recorded_per_view(self):
+        user = User.objects.create_user("metrics", password="pw")
+        Echo.objects.create(user=user, content="hello")
+        for _ in range(2):
+            self.client.get("/api/list-echoes-no-auth/")
+
+        body = self.client.get("/metrics").content.decode()
+        labels = 'method="GET",status="200",view="list_echoes_no_auth"'
+        self.assertIn(f"echo_requests_total{{{labels}}} 2", body)
+        self.assertIn(
+            'echo_cache_requests_total{cache="feed",result="hit",'
+            'view="list_echoes_no_auth"} 1',
+            body,
+        )
+        self.assertIn(
+            'echo_cache_requests_total{cache="feed",result="miss",'
+            'view="list_echoes_no_auth"} 1',
+            body,
+        )
+        self.assertIn(
+            'echo_request_db_queries_count{view="list_echoes_no_auth"} 2', body
+        )
+        self.assertNotIn(
+            'echo_request_db_queries_sum{view="list_echoes_no_auth"} 0\n', body
+        )
+
+    def test_metrics_token(self):
+        with override_settings(METRICS={**settings.METRICS, "TOKEN": "s3cret"}):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(response.status_code, 200)
+
+    def test_only_sampled_requests_trace_their_queries(self):
+        user = User.objects.create_user("slow", password="pw")
+        echo = Echo.objects.create(user=user, content="hello")
+        url = f"/api/echoes/{echo.id}/comments/"
+        options = {**settings.METRICS, "SLOW_REQUEST_SECONDS": 0}
+
+        with override_settings(METRICS={**options, "SLOW_SAMPLE_RATE": 0}):
+            middleware = metrics.MetricsMiddleware(lambda request: None)
+            request_metrics, token, _ = middleware.start()
+            metrics._current.reset(token)
+            self.assertIsNone(request_metrics.trace)
+            with self.assertNoLogs("core.metrics"):
+                self.client.get(url)
+
+        with override_settings(METRICS={**options, "SLOW_SAMPLE_RATE": 1}):
+            with self.assertLogs("core.metrics", "WARNING") as logs:
+                self.client.get(url)
+        self.assertIn(f"Slow request GET {url}", logs.output[0])
+        self.assertIn("core_comment", logs.output[0])
+
+    def test_workers_are_merged_from_the_shared_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Another worker's last flush
+        other = metrics.Registry()
+        other.inc("echo_requests_total", {"view": "search_echoes"}, 3)
+        other.observe("echo_request_db_queries", {"view": "search_echoes"}, 4)
+        with open(os.path.join(directory, "metrics-1.json"), "w") as f:
+            json.dump(other.snapshot(), f)
+
+        metrics.registry.inc("echo_requests_total", {"view": "search_echoes"})
+        with override_settings(
+            METRICS={**settings.METRICS, "MULTIPROCESS_DIR": directory}
+        ):
+            body = metrics.exposition()
+        self.assertIn('echo_requests_total{view="search_echoes"} 4', body)
+        self.assertIn(
+            'echo_request_db_queries_bucket{view="search_echoes",le="5"} 1', body
+        )
+
+
+@override_settings(
+    DATABASE_REPLICAS={**settings.DATABASE_REPLICAS, "ALIASES": ["replica"]}
+)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Stand in for a replica: a second wrapper over the test database's
+        # connection, so its queries are counted apart from the primary's
+        connection.ensure_connection()
+        self.replica = connections.create_connection(DEFAULT_DB_ALIAS)
+        self.replica.alias = "replica"
+        self.replica.connection = connection.connection
+        connections["replica"] = self.replica
+        self.addCleanup(delattr, connections._connections, "replica")
+        self.addCleanup(setattr, self.replica, "connection", None)
+
+        self.user = User.objects.create_user(username="reader", password="secret123")
+        self.echo = Echo.objects.create(user=self.user, content="replicated")
+        self.headers = auth_header(self.user)
+
+    def test_feed_reads_go_to_a_replica(self):
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            response = self.client.get("/api/list-liked-echoes/", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries)
+
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            self.client.get(f"/api/echoes/{self.echo.id}/comments/")
+        self.assertFalse(replica_queries)
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        response = self.client.post(f"/api/like-echo/{self.echo.id}/", **self.headers)
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], 10)
+
+        # Token clients may not keep cookies; the user is pinned regardless
+        self.client.cookies.clear()
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            data = self.client.get("/api/list-liked-echoes/", **self.headers).json()
+        self.assertFalse(replica_queries)
+        self.assertEqual([echo["id"] for echo in data], [self.echo.id])
+
+    def test_shared_pages_are_built_on_a_replica(self):
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            response = self.client.get("/api/list-echoes-no-auth/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries)
+        # The replica may lag the feed version the validators name
+        self.assertNotIn("ETag", response)
+
+    def test_pinned_users_skip_pages_built_on_a_replica(self):
+        self.client.get("/api/list-echoes-no-auth/")
+        # A write the replica-built page, cached under this version, missed
+        lagging = Echo.objects.create(user=self.user, content="not replayed yet")
+
+        self.client.post(f"/api/like-echo/{self.echo.id}/", **self.headers)
+        self.client.cookies.clear()
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            data = self.client.get("/api/list-echoes/", **self.headers).json()
+        self.assertFalse(replica_queries)
+        self.assertEqual(data[0]["id"], lagging.id)
+
+        # The page built on the primary replaces the replica's for everyone
+        data = self.client.get("/api/list-echoes-no-auth/").json()
+        self.assertEqual(data[0]["id"], lagging.id)
+
+    async def test_async_reads_check_the_pin_in_the_cache(self):
+        request = RequestFactory().get("/api/list-echoes/")
+        request.user = self.user
+        for pinned, replica in ((False, "replica"), (True, None)):
+            with self.subTest(pinned=pinned):
+                if pinned:
+                    await cache.aset(pin_key(self.user.id), True)
+                state = RoutingState(request)
+                state.replica = "replica"
+                token = _state.set(state)
+                try:
+                    self.assertEqual(await areading_replica(), replica)
+                finally:
+                    _state.reset(token)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.__init__()
+        self.user = User.objects.create_user(username="eager", password="secret123")
+        self.echo = Echo.objects.create(user=self.user, content="like me")
+
+    def limits(self, backend):
+        return override_settings(
+            RATE_LIMITS={
+                **settings.RATE_LIMITS,
+                "BACKEND": backend,
+                "POLICIES": {
+                    "like_echo": {"RATE": "60/m", "BURST": 2},
+                    "login_user": {"RATE": "1/h", "BURST": 1, "KEY": "ip"},
+                },
+            }
+        )
+
+    def test_buckets_refuse_bursts_per_user(self):
+        other = User.objects.create_user(username="calm", password="secret123")
+        for backend in ("cache", "local"):
+            with self.subTest(backend=backend), self.limits(backend):
+                url = f"/api/like-echo/{self.echo.id}/"
+                headers = auth_header(self.user)
+                statuses = [
+                    self.client.post(url, **headers).status_code for _ in range(2)
+                ]
+                self.assertEqual(statuses, [200, 200])
+                response = self.client.post(url, **headers)
+                self.assertEqual(response.status_code, 429)
+                self.assertEqual(response["Retry-After"], "1")
+
+                response = self.client.post(url, **auth_header(other))
+                self.assertEqual(response.status_code, 200)
+
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn('echo_rate_limited_total{key="user",view="like_echo"} 2', body)
+
+    def test_logins_are_limited_per_address(self):
+        credentials = json.dumps({"username": "eager", "password": "wrong"})
+        with self.limits("cache"):
+            response = self.client.post(
+                "/api/login/", credentials, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 401)
+            response = self.client.post(
+                "/api/login/", credentials, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 429)
+            self.assertAlmostEqual(int(response["Retry-After"]), 3600, delta=5)
+
+            response = self.client.post(
+                "/api/login/",
+                credentials,
+                content_type="application/json",
+                REMOTE_ADDR="10.0.0.2",
+            )
+            self.assertEqual(response.status_code, 401)
+
+    def test_batches_are_charged_per_operation(self):
+        def batch(count):
+            operations = [{"op": "echo", "content": "queued"}] * count
+            return self.client.post(
+                "/api/batch/",
+                json.dumps({"operations": operations}),
+                content_type="application/json",
+                **auth_header(self.user),
+            )
+
+        policies = {
+            "create_echo": {"RATE": "60/m", "BURST": 3},
+            "batch_write": {
+                "RATE": "60/m",
+                "BURST": 10,
+                "OPERATIONS": {"echo": "create_echo"},
+            },
+        }
+        for backend in ("cache", "local"):
+            cache.clear()
+            ratelimit._backends.clear()
+            with self.subTest(backend=backend), override_settings(
+                RATE_LIMITS={
+                    **settings.RATE_LIMITS,
+                    "BACKEND": backend,
+                    "POLICIES": policies,
+                }
+            ):
+                # Allowed with a token left, then owes the other nine
+                self.assertEqual(batch(10).status_code, 200)
+                response = self.client.post(
+                    "/api/create-echo/",
+                    {"content": "single"},
+                    content_type="application/json",
+                    **auth_header(self.user),
+                )
+                self.assertEqual(response.status_code, 429)
+                self.assertAlmostEqual(int(response["Retry-After"]), 8, delta=1)
+                self.assertEqual(batch(1).status_code, 429)
+
+    def test_deploy_check_flags_per_process_buckets(self):
+        redis = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}}
+        for backend, warned in (("cache", False), ("local", True)):
+            with override_settings(
+                CACHES=redis,
+                RATE_LIMITS={**settings.RATE_LIMITS, "BACKEND": backend},
+            ):
+                ids = [w.id for w in checks.check_shared_caches(None)]
+                self.assertEqual("core.W002" in ids, warned)
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="hot", password="secret123")
+        self.headers = auth_header(self.user)
+        self.old = Echo.objects.create(user=self.user, content="older")
+        self.new = Echo.objects.create(user=self.user, content="newer")
+
+    def trending_ids(self, **params):
+        response = self.client.get("/api/trending/", params, **self.headers)
+        return [echo["id"] for echo in response.json()], response
+
+    def test_likes_and_comments_reorder_the_trending_feed(self):
+        self.assertEqual(self.trending_ids()[0], [self.new.id, self.old.id])
+
+        self.client.post(f"/api/like-echo/{self.old.id}/?compact=1", **self.headers)
+        self.assertEqual(self.trending_ids()[0], [self.old.id, self.new.id])
+
+        # A comment outweighs a like
+        self.client.post(
+            "/api/create-comment/",
+            {"echo_id": self.new.id, "content": "wow"},
+            content_type="application/json",
+            **self.headers,
+        )
+        ids, response = self.trending_ids(limit=1)
+        self.assertEqual(ids, [self.new.id])
+        ids, _ = self.trending_ids(limit=1, before=response["X-Next-Cursor"])
+        self.assertEqual(ids, [self.old.id])
+
+    def test_rebuild_matches_incremental_and_generated_scores(self):
+        call_command(
+            "generate_dataset", users=20, echoes=100, batch_size=64, stdout=StringIO()
+        )
+        self.client.post(f"/api/like-echo/{self.old.id}/?compact=1", **self.headers)
+        scores = dict(Echo.objects.values_list("id", "trending_score"))
+
+        Echo.objects.update(trending_score=0)
+        out = StringIO()
+        call_command("rebuild_trending", batch_size=30, stdout=out)
+        self.assertIn("Rescored 102 echoes.", out.getvalue())
+        for echo_id, score in Echo.objects.values_list("id", "trending_score"):
+            self.assertAlmostEqual(score, scores[echo_id], places=6)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="old", password="secret123")
+        self.headers = auth_header(self.user)
+        self.old = self.post_echo("ancient history")
+        self.new = self.post_echo("fresh news")
+        self.client.post(f"/api/like-echo/{self.old}/?compact=1", **self.headers)
+        self.client.post(
+            "/api/create-comment/",
+            {"echo_id": self.old, "content": "still history"},
+            content_type="application/json",
+            **self.headers,
+        )
+        Echo.objects.filter(id=self.old).update(
+            created_at=timezone.now() - timedelta(days=400)
+        )
+
+    def post_echo(self, content):
+        response = self.client.post(
+            "/api/create-echo/",
+            {"content": content},
+            content_type="application/json",
+            **self.headers,
+        )
+        return response.json()["id"]
+
+    def test_archived_echoes_leave_the_feeds_but_resolve_by_id(self):
+        detail = self.client.get(f"/api/echoes/{self.old}/", **self.headers).json()
+        search = self.client.get("/api/search/?q=history", **self.headers).json()
+        self.assertEqual([echo["id"] for echo in search], [self.old])
+        out = StringIO()
+        call_command("archive_echoes", batch_size=1, stdout=out)
+        self.assertIn("Archived 1 echoes", out.getvalue())
+
+        self.assertFalse(Echo.objects.filter(id=self.old).exists())
+        self.assertFalse(Comment.objects.filter(echo_id=self.old).exists())
+        archived = ArchivedEcho.objects.get(id=self.old)
+        self.assertEqual((archived.like_count, archived.comment_count), (1, 1))
+
+        feed = self.client.get("/api/list-echoes/", **self.headers).json()
+        self.assertEqual([echo["id"] for echo in feed], [self.new])
+        search = self.client.get("/api/search/?q=history", **self.headers).json()
+        self.assertEqual(search, [])
+
+        # Served from the archive exactly as it was from the hot tables
+        response = self.client.get(f"/api/echoes/{self.old}/", **self.headers)
+        self.assertEqual(response.json(), detail)
+        response = self.client.get(f"/api/echoes/{self.old}/comments/")
+        self.assertEqual([c["content"] for c in response.json()], ["still history"])
+
+        # Archived echoes are read-only
+        response = self.client.post(f"/api/like-echo/{self.old}/", **self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/api/echoes/0/", **self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_likes_racing_the_archiver_find_the_echo_gone(self):
+        # Loaded by the like view just before the archiver moved it
+        echo = Echo.objects.get(id=self.old)
+        other = User.objects.create_user(username="late", password="secret123")
+        call_command("archive_echoes", stdout=StringIO())
+
+        with self.assertRaises(Echo.DoesNotExist):
+            toggle_like(echo, other)
+        self.assertFalse(Echo.likes.through.objects.filter(user=other).exists())
+        self.assertEqual(ArchivedEcho.objects.get(id=self.old).like_count, 1)
+
+    def test_horizon_keeps_recent_echoes_hot(self):
+        call_command("archive_echoes", older_than_days=500, stdout=StringIO())
+        self.assertEqual(ArchivedEcho.objects.count(), 0)
+        call_command("archive_echoes", stdout=StringIO())
+        self.assertEqual(list(ArchivedEcho.objects.values_list("id")), [(self.old,)])
+        self.assertTrue(Echo.objects.filter(id=self.new).exists())
+
+
+@override_settings(
+    PASSWORD_HASHING={**settings.PASSWORD_HASHING, "WORKERS": 0},
+    LAST_LOGIN={"FLUSH_INTERVAL": 3600, "MAX_PENDING": 2},
+)
+class LastLoginTests(TestCase):
+    def setUp(self):
+        last_login.last_logins.flush()
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="secret123")
+            for i in range(2)
+        ]
+
+    def login(self, user):
+        return self.client.post(
+            "/api/login/",
+            json.dumps({"username": user.username, "password": "secret123"}),
+            content_type="application/json",
+        )
+
+    def test_logins_are_written_in_bulk(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.login(self.users[0]).status_code, 200)
+            self.assertEqual(self.login(self.users[0]).status_code, 200)
+        self.assertFalse([q for q in captured if "UPDATE" in q["sql"]])
+        self.assertIsNone(User.objects.get(id=self.users[0].id).last_login)
+
+        # The second user fills the buffer, which is written in one UPDATE
+        with CaptureQueriesContext(connection) as captured:
+            self.login(self.users[1])
+        self.assertEqual(len([q for q in captured if "UPDATE" in q["sql"]]), 1)
+        self.assertEqual(
+            User.objects.filter(last_login__isnull=False).count(), len(self.users)
+        )
+
+    def test_a_lone_login_is_written_by_a_later_request(self):
+        self.assertEqual(self.login(self.users[0]).status_code, 200)
+        self.client.get("/api/list-echoes-no-auth/")
+        self.assertIsNone(User.objects.get(id=self.users[0].id).last_login)
+
+        # FLUSH_INTERVAL later, any request writes it
+        last_login.last_logins.last_flush -= 3600
+        self.client.get("/api/list-echoes-no-auth/")
+        self.assertIsNotNone(User.objects.get(id=self.users[0].id).last_login)
+
+    @override_settings(LAST_LOGIN={"FLUSH_INTERVAL": 3600, "MAX_PENDING": 10})
+    def test_failed_flush_keeps_the_logins(self):
+        buffer = last_login.last_logins
+        now = timezone.now()
+        earlier = now - timedelta(hours=1)
+        for user in self.users:
+            buffer.record(user.id, earlier)
+        buffer.last_flush -= 3600
+
+        def fail(*args, **kwargs):
+            # A newer login lands while the UPDATE runs, which then fails
+            buffer.pending[self.users[0].id] = now
+            raise DatabaseError("connection lost")
+
+        with mock.patch.object(User.objects, "filter", fail):
+            with self.assertLogs("core.signals", "ERROR"):
+                response = self.client.get("/api/list-echoes-no-auth/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            buffer.pending, {self.users[0].id: now, self.users[1].id: earlier}
+        )
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(User.objects.get(id=self.users[0].id).last_login, now)
+
+    def test_exit_flush_skips_another_database(self):
+        last_login.last_logins.record(self.users[0].id)
+        last_login.last_logins.database = "destroyed"
+        last_login.last_logins.flush_at_exit()
+        self.assertTrue(last_login.last_logins.pending)
+
+        last_login.last_logins.database = connection.settings_dict["NAME"]
+        last_login.last_logins.flush_at_exit()
+        self.assertIsNotNone(User.objects.get(id=self.users[0].id).last_login)
+
+    def test_flush_keeps_the_latest_login(self):
+        user = self.users[0]
+        now = timezone.now()
+        last_login.last_logins.record(user.id, now)
+        last_login.last_logins.flush()
+        last_login.last_logins.record(user.id, now - timedelta(hours=1))
+        self.assertEqual(last_login.last_logins.flush(), 1)
+        self.assertEqual(User.objects.get(id=user.id).last_login, now)
+
+    def test_saving_a_user_leaves_the_profile_alone(self):
+        user = User.objects.get(id=self.users[0].id)
+        with CaptureQueriesContext(connection) as captured:
+            user.save()
+            user.save(update_fields=["email"])
+        # One existence check for the full save, nothing for the partial one
+        profile_queries = [q["sql"] for q in captured if "core_profile" in q["sql"]]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertTrue(profile_queries[0].startswith("SELECT"))
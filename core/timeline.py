@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import Echo, Follow, Profile, TimelineEntry
+from .pagination import apply_keyset, encode_key
+
+
+def is_celebrity(follower_count):
+    return follower_count >= settings.TIMELINE["CELEBRITY_FOLLOWERS"]
+
+
+def fan_out(echoes):
+    """
+    Write new echoes into the home timelines of their authors and followers.
+
+    Authors with more followers than CELEBRITY_FOLLOWERS are skipped; their
+    followers pull those echoes at read time instead.
+    """
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=echo.user_id, echo=echo, created_at=echo.created_at)
+            for echo in echoes
+        ]
+    )
+    follower_counts = dict(
+        Profile.objects.filter(
+            user_id__in={echo.user_id for echo in echoes}
+        ).values_list("user_id", "follower_count")
+    )
+    echo_ids = [
+        echo.id
+        for echo in echoes
+        if follower_counts.get(echo.user_id)
+        and not is_celebrity(follower_counts[echo.user_id])
+    ]
+    if not echo_ids:
+        return
+
+    # One set-based INSERT ... SELECT instead of a row per follower
+    placeholders = ", ".join(["%s"] * len(echo_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {TimelineEntry._meta.db_table} "
+            "(owner_id, echo_id, created_at) "
+            "SELECT f.follower_id, e.id, e.created_at "
+            f"FROM {Follow._meta.db_table} f "
+            f"JOIN {Echo._meta.db_table} e ON e.user_id = f.followee_id "
+            f"WHERE e.id IN ({placeholders})",
+            echo_ids,
+        )
+
+
+def toggle_follow(follower, followee_id):
+    """
+    Follow or unfollow a user and return whether they are now followed.
+
+    Following copies the followee's recent echoes into the follower's
+    timeline; unfollowing removes them.
+    """
+    with transaction.atomic():
+        follows = Follow.objects.filter(
+            follower_id=follower.id, followee_id=followee_id
+        )
+        if follows.delete()[0]:
+            Profile.objects.filter(user_id=followee_id).update(
+                follower_count=F("follower_count") - 1
+            )
+            TimelineEntry.objects.filter(
+                owner_id=follower.id, echo__user_id=followee_id
+            ).delete()
+            return False
+
+        try:
+            with transaction.atomic():
+                Follow.objects.create(follower_id=follower.id, followee_id=followee_id)
+        except IntegrityError:
+            # A concurrent request followed first
+            return True
+        Profile.objects.filter(user_id=followee_id).update(
+            follower_count=F("follower_count") + 1
+        )
+
+        recent = (
+            Echo.objects.filter(user_id=followee_id)
+            .only("id", "created_at")
+            .order_by("-created_at")[: settings.TIMELINE["BACKFILL"]]
+        )
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    owner_id=follower.id, echo=echo, created_at=echo.created_at
+                )
+                for echo in recent
+            ],
+            ignore_conflicts=True,
+        )
+        return True
+
+
+def home_timeline_page(user, params):
+    """
+    A page of a user's home timeline and the cursor for the next one.
+
+    Reads one range of the user's materialized timeline, merged with the
+    same range of echoes by followed celebrities, which are not fanned out.
+    """
+    entries, limit, forward = apply_keyset(
+        TimelineEntry.objects.filter(owner_id=user.id), params, id_field="echo_id"
+    )
+    keys = list(entries.values_list("created_at", "echo_id")[: limit + 1])
+
+    celebrity_ids = list(
+        Follow.objects.filter(
+            follower_id=user.id,
+            followee__profile__follower_count__gte=settings.TIMELINE[
+                "CELEBRITY_FOLLOWERS"
+            ],
+        ).values_list("followee_id", flat=True)
+    )
+    if celebrity_ids:
+        pulled, _, _ = apply_keyset(
+            Echo.objects.filter(user_id__in=celebrity_ids), params
+        )
+        keys += pulled.values_list("created_at", "id")[: limit + 1]
+        keys = sorted(set(keys), reverse=not forward)[: limit + 1]
+
+    # Paged by the keys read, not the echoes still there: one deleted in
+    # between only thins the page rather than ending the timeline early
+    page_keys = keys[:limit]
+    echoes = Echo.objects.select_related("user__profile").in_bulk(
+        [echo_id for _, echo_id in page_keys]
+    )
+    page = [echoes[echo_id] for _, echo_id in page_keys if echo_id in echoes]
+    next_cursor = encode_key(*page_keys[-1]) if len(keys) > limit else None
+    if forward:
+        page.reverse()
+    return page, next_cursor
@@ -0,0 +1,114 @@
+"""
+Trending ("hot") scores of echoes, kept current as likes and comments land.
+
+    score = ln(1 + LIKE_WEIGHT * likes + COMMENT_WEIGHT * comments)
+            + ln(2) * (created_at - EPOCH) / HALF_LIFE
+
+Every HALF_LIFE, newer echoes start a doubling of engagement ahead, which
+ranks echoes exactly as halving every score each HALF_LIFE would. Decay is
+relative, so a stored score never changes just because time passes: it is
+rewritten only when the echo's own counters change.
+"""
+
+import math
+import random
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db.models import (
+    Case,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Ln
+
+from .models import CounterShard, Echo
+from .pagination import decode_rank_cursor, encode_rank_cursor, parse_limit
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def recency(created_at):
+    half_life = settings.TRENDING["HALF_LIFE"].total_seconds()
+    return (created_at - EPOCH).total_seconds() * math.log(2) / half_life
+
+
+def shard_total(field):
+    shards = (
+        CounterShard.objects.filter(echo_id=OuterRef("id"))
+        .values("echo_id")
+        .annotate(total=Sum(field))
+        .values("total")
+    )
+    return F(field) + Coalesce(Subquery(shards), 0)
+
+
+def engagement():
+    # Counted from the counters, sharded deltas included, so concurrent
+    # updates never make the score drift from them
+    options = settings.TRENDING
+    return Ln(
+        Value(1.0)
+        + options["LIKE_WEIGHT"] * shard_total("like_count")
+        + options["COMMENT_WEIGHT"] * shard_total("comment_count"),
+        output_field=FloatField(),
+    )
+
+
+def update_scores(echoes, sample_sharded=True):
+    """
+    Recompute the trending scores of ``echoes`` in one UPDATE, after their
+    counters have changed.
+
+    Sharded echoes are only rescored on one in ``counter_shards`` calls
+    unless ``sample_sharded`` is off, so their likers don't all queue on the
+    echo row's lock again; as the score is recomputed from the totals, the
+    skipped updates are never lost.
+    """
+    if sample_sharded:
+        echoes = [
+            echo
+            for echo in echoes
+            if not echo.counter_shards or not random.randrange(echo.counter_shards)
+        ]
+    if not echoes:
+        return
+    Echo.objects.filter(id__in=[echo.id for echo in echoes]).update(
+        trending_score=engagement()
+        + Case(
+            *[When(id=echo.id, then=recency(echo.created_at)) for echo in echoes],
+            output_field=FloatField(),
+        )
+    )
+
+
+def trending_page(params):
+    """
+    A page of echoes, hottest first, and the cursor for the next page.
+
+    Pages seek on the (trending_score, id) index. Scores move while a client
+    pages through, so an echo that heats up may be seen twice or skipped.
+    """
+    limit = parse_limit(params.get("limit"))
+    echoes = Echo.objects.select_related("user__profile").order_by(
+        "-trending_score", "-id"
+    )
+    before = params.get("before")
+    if before:
+        score, echo_id = decode_rank_cursor(before)
+        echoes = echoes.filter(
+            Q(trending_score__lt=score) | Q(trending_score=score, id__lt=echo_id)
+        )
+
+    page = list(echoes[: limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_rank_cursor(page[-1].trending_score, page[-1].id)
+    return page, next_cursor
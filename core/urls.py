@@ -9,8 +9,15 @@ urlpatterns = [
     path("create-echo/", views.create_echo, name="create_echo"),
     path("create-comment/", views.create_comment, name="create_comment"),
     path("like-echo/<int:echo_id>/", views.like_echo, name="like_echo"),
+    path("batch/", views.batch_write, name="batch_write"),
     path("list-echoes/", views.list_echoes, name="list_echoes"),
     path("list-liked-echoes/", views.list_liked_echoes, name="list_liked_echoes"),
     path("list-echoes-no-auth/", views.list_echoes_no_auth, name="list_echoes_no_auth"),
+    path("echoes/<int:echo_id>/", views.echo_detail, name="echo_detail"),
+    path("echoes/<int:echo_id>/comments/", views.list_comments, name="list_comments"),
+    path("home-timeline/", views.home_timeline, name="home_timeline"),
+    path("search/", views.search_echoes, name="search_echoes"),
+    path("trending/", views.trending_echoes, name="trending_echoes"),
+    path("follow/<int:user_id>/", views.follow_user, name="follow_user"),
     path("upload-profile-pic/", views.upload_profile_pic, name="upload_profile_pic"),
 ]
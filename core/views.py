@@ -1,15 +1,23 @@
 import json
+import os
 import re
+import secrets
+from datetime import datetime, timezone
 
+from django.conf import settings
 from django.contrib.auth import authenticate
-from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_GET, require_POST
 from rest_framework.decorators import (
     api_view,
     authentication_classes,
@@ -18,18 +26,47 @@ from rest_framework.decorators import (
 )
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from .models import Comment, Echo
+from .archive import archived_echo
+from .authentication import ClaimsJWTAuthentication, get_active_user
+from .avatars import release_picture, schedule_renditions
+from .batch import BatchError, apply_batch, parse_operations
+from .counters import adjust_counters, counter_totals
+from .events import publish_on_commit
+from .feed import (
+    apply_viewer_likes,
+    build_echo_page,
+    liked_echo_ids,
+    profile_picture_url,
+    serialize_comments,
+)
+from .feed_cache import bump_feed_version, feed_validators, get_or_build_page
+from .likes import toggle_like
+from .metrics import exposition
+from .models import ArchivedComment, ArchivedEcho, Comment, Echo, Profile
+from .pagination import apply_keyset, finish_page, paginate_echoes
+from .passwords import PasswordPoolBusy, hash_password
+from .renderers import render_json
+from .routers import reading_replica
+from .search import index_comments, index_echoes, search_page
 from .serializers import CustomTokenObtainPairSerializer
+from .storage import is_content_addressed
+from .timeline import fan_out, home_timeline_page, toggle_follow
+from .trending import trending_page, update_scores
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
+def password_pool_busy(error):
+    response = JsonResponse({"errors": error.detail}, status=error.status_code)
+    response["Retry-After"] = str(error.wait)
+    return response
+
+
 @csrf_exempt
 @require_POST
 def register_user(request):
@@ -65,10 +102,14 @@ def register_user(request):
     if User.objects.filter(email=email).exists():
         return JsonResponse({"errors": "Email already registered"}, status=400)
 
+    # Hash the password off the request worker
+    try:
+        password = hash_password(password)
+    except PasswordPoolBusy as e:
+        return password_pool_busy(e)
+
     # Create the user
-    user = User.objects.create(
-        username=username, email=email, password=make_password(password)
-    )
+    user = User.objects.create(username=username, email=email, password=password)
 
     return JsonResponse({"username": user.username})
 
@@ -89,7 +130,10 @@ class LoginUser(View):
             )
 
         # Authenticate user
-        user = authenticate(username=username, password=password)
+        try:
+            user = authenticate(username=username, password=password)
+        except PasswordPoolBusy as e:
+            return password_pool_busy(e)
 
         # Generate and send the access token
         if user is not None:
@@ -129,45 +173,27 @@ def refresh_token(request):
 
 # Helper function to build the response
 def build_echo_response(echo, request):
-    user_profile_picture_url = (
-        request.build_absolute_uri(echo.user.profile.profile_picture.url)
-        if hasattr(echo.user, "profile") and echo.user.profile.profile_picture
-        else None
-    )
+    return build_echo_page([echo], request)[0]
 
-    echo_data = {
-        "id": echo.id,
-        "user": echo.user.username,
-        "user_profile_picture": user_profile_picture_url,
-        "content": echo.content,
-        "created_at": echo.created_at,
-        "likes": echo.likes.count(),
-        "is_liked": request.user in echo.likes.all()
-        if request.user.is_authenticated
-        else False,
-        "comments": [
-            {
-                "id": comment.id,
-                "user": comment.user.username,
-                "user_profile_picture": (
-                    request.build_absolute_uri(comment.user.profile.profile_picture.url)
-                    if hasattr(comment.user, "profile")
-                    and comment.user.profile.profile_picture
-                    else None
-                ),
-                "content": comment.content,
-                "created_at": comment.created_at,
-            }
-            for comment in echo.comments.all().order_by("-created_at")[:20]
-        ],
-    }
 
-    return echo_data
+# Helper function to push a new comment to live feed subscribers
+def publish_comment(echo, comment, echo_data):
+    for comment_data in echo_data["comments"]:
+        if comment_data["id"] == comment.id:
+            publish_on_commit(
+                "comment",
+                {
+                    "echo_id": echo.id,
+                    "comments": counter_totals([echo])[echo.id][1],
+                    "comment": comment_data,
+                },
+            )
+            return
 
 
 @csrf_exempt
 @api_view(["POST"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def create_echo(request):
     # Ensure to receive valid JSON data
@@ -183,35 +209,31 @@ def create_echo(request):
     if not content:
         return JsonResponse({"errors": "Content cannot be empty"}, status=400)
 
-    # Create Echo
-    echo = Echo.objects.create(
-        user=request.user,
-        content=content,
-    )
+    # Create Echo and push it into the followers' home timelines
+    with transaction.atomic():
+        echo = Echo.objects.create(
+            user=get_active_user(request.user.id),
+            content=content,
+        )
+        fan_out([echo])
+        index_echoes([echo])
+        bump_feed_version()
 
-    user_profile_picture_url = (
-        request.build_absolute_uri(echo.user.profile.profile_picture.url)
-        if hasattr(echo.user, "profile") and echo.user.profile.profile_picture
-        else None
-    )
+    echo_data = {
+        "id": echo.id,
+        "user": echo.user.username,
+        "user_profile_picture": profile_picture_url(echo.user, request),
+        "content": echo.content,
+        "created_at": echo.created_at,
+    }
+    publish_on_commit("echo", echo_data)
 
-    return JsonResponse(
-        {
-            "id": echo.id,
-            "user": echo.user.username,
-            "user_profile_picture": user_profile_picture_url,
-            "content": echo.content,
-            "created_at": echo.created_at,
-            "likes": 0,
-            "comments": [],
-        },
-        status=201,
-    )
+    return render_json({**echo_data, "likes": 0, "comments": []}, status=201)
 
 
 @csrf_exempt
 @api_view(["POST"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def create_comment(request):
     # Ensure to receive valid JSON data
@@ -229,79 +251,285 @@ def create_comment(request):
         return JsonResponse({"errors": "Echo ID and content are required"}, status=400)
 
     # Create Comment
-    echo = get_object_or_404(Echo, id=echo_id)
-    Comment.objects.create(
-        user=request.user,
-        echo=echo,
-        content=content,
-    )
+    echo = get_object_or_404(Echo.objects.select_related("user__profile"), id=echo_id)
+    with transaction.atomic():
+        comment = Comment.objects.create(
+            user_id=request.user.id,
+            echo=echo,
+            content=content,
+        )
+        adjust_counters(echo, comments=1)
+        update_scores([echo])
+        index_comments([comment])
+        bump_feed_version()
+    echo.refresh_from_db(fields=["like_count", "comment_count"])
 
     response_data = build_echo_response(echo, request)
-    return JsonResponse(response_data, status=201)
+    publish_comment(echo, comment, response_data)
+    return render_json(response_data, status=201)
 
 
 @csrf_exempt
 @api_view(["POST"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def like_echo(request, echo_id):
     # Get echo and user details
-    echo = get_object_or_404(Echo, id=echo_id)
+    echo = get_object_or_404(Echo.objects.select_related("user__profile"), id=echo_id)
     user = request.user
 
-    # Like/UnLike the echo
-    is_liked = user in echo.likes.all()
-    if is_liked:
-        echo.likes.remove(user)
-    else:
-        echo.likes.add(user)
+    # Like/UnLike the echo, unless it was archived since
+    try:
+        is_liked = toggle_like(echo, user)
+    except Echo.DoesNotExist:
+        raise Http404
+    bump_feed_version()
+    echo.refresh_from_db(fields=["like_count", "comment_count"])
+    likes = counter_totals([echo])[echo.id][0]
+    publish_on_commit("like", {"id": echo.id, "likes": likes})
+
+    # Compact mode skips rebuilding the comments of the echo
+    if request.GET.get("compact") in ("1", "true"):
+        return JsonResponse({"id": echo.id, "likes": likes, "is_liked": is_liked})
 
     response_data = build_echo_response(echo, request)
-    return JsonResponse(response_data, status=200)
+    return render_json(response_data)
+
+
+# Helper function to set the validators of a shared feed response
+def set_feed_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+# Helper function to build a paginated feed response
+def build_feed_response(echoes, request, shared=False):
+    def build():
+        page, next_cursor = paginate_echoes(echoes, request.GET)
+        return build_echo_page(page, request, with_viewer=not shared), next_cursor
+
+    validators = None
+    # Replica reads may lag the feed version, so their pages carry no validators
+    if shared and reading_replica() is None:
+        validators = feed_validators(request.user)
+    if validators is not None:
+        # Polling clients whose copy is current get a 304 from the
+        # validators alone, before any page is built
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return set_feed_validators(response, etag, last_modified)
+
+    try:
+        if shared:
+            # Serve the cached public page and add the viewer's likes on top
+            echo_list, next_cursor = get_or_build_page(request, build)
+            liked_ids = liked_echo_ids([echo["id"] for echo in echo_list], request.user)
+            echo_list = apply_viewer_likes(echo_list, liked_ids)
+        else:
+            echo_list, next_cursor = build()
+    except ValueError as e:
+        return JsonResponse({"errors": str(e)}, status=400)
+
+    response = render_json(echo_list)
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    if validators is not None:
+        set_feed_validators(response, etag, last_modified)
+    return response
+
+
+@csrf_exempt
+@api_view(["POST"])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def batch_write(request):
+    # Ensure to receive valid JSON data
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"errors": "Invalid JSON data"}, status=400)
+
+    # Validate every operation before applying any of them
+    try:
+        operations = parse_operations(data)
+    except BatchError as e:
+        return JsonResponse({"errors": e.errors}, status=400)
+
+    # Apply the whole batch in one transaction
+    try:
+        results = apply_batch(request, get_active_user(request.user.id), operations)
+    except IntegrityError:
+        return JsonResponse(
+            {"errors": "These idempotency keys are being applied by another request"},
+            status=409,
+        )
+    return JsonResponse({"results": results})
 
 
 @api_view(["GET"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def list_echoes(request):
     # Get all the latest echoes
-    echoes = Echo.objects.all().order_by("-created_at")[:20]
-    echo_list = [build_echo_response(echo, request) for echo in echoes]
-    return JsonResponse(echo_list, safe=False)
+    echoes = Echo.objects.select_related("user__profile")
+    return build_feed_response(echoes, request, shared=True)
 
 
 @api_view(["GET"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def list_liked_echoes(request):
     # Get all the echoes liked by the current user
     user = request.user
-    liked_echoes = Echo.objects.filter(likes=user).order_by("-created_at")[:20]
-    echo_list = [build_echo_response(echo, request) for echo in liked_echoes]
-    return JsonResponse(echo_list, safe=False)
+    liked_echoes = Echo.objects.filter(likes=user.id).select_related("user__profile")
+    return build_feed_response(liked_echoes, request)
 
 
 def list_echoes_no_auth(request):
-    echoes = Echo.objects.all().order_by("-created_at")[:20]
-    echo_list = [build_echo_response(echo, request) for echo in echoes]
-    return JsonResponse(echo_list, safe=False)
+    echoes = Echo.objects.select_related("user__profile")
+    return build_feed_response(echoes, request, shared=True)
+
+
+@api_view(["GET"])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def echo_detail(request, echo_id):
+    # Get one echo, from the archive once it has been archived
+    echoes = Echo.objects.filter(id=echo_id).select_related("user__profile")
+    page = build_echo_page(echoes, request)
+    if page:
+        return render_json(page[0])
+    data = archived_echo(echo_id, request)
+    if data is None:
+        return JsonResponse({"errors": "Echo not found"}, status=404)
+    return render_json(data)
+
+
+@require_GET
+def list_comments(request, echo_id):
+    # Get the comments of an echo, newest first
+    if Echo.objects.filter(id=echo_id).exists():
+        comments = Comment.objects.filter(echo_id=echo_id)
+    else:
+        # Archived echoes keep their comments in the archive
+        get_object_or_404(ArchivedEcho.objects.only("id"), id=echo_id)
+        comments = ArchivedComment.objects.filter(echo_id=echo_id)
+    comments = comments.select_related("user__profile")
+    try:
+        comments, limit, forward = apply_keyset(comments, request.GET)
+    except ValueError as e:
+        return JsonResponse({"errors": str(e)}, status=400)
+    page, next_cursor = finish_page(list(comments[: limit + 1]), limit, forward)
+
+    response = render_json(serialize_comments(page, request))
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@api_view(["GET"])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def home_timeline(request):
+    # Get the echoes of the current user and the users they follow
+    try:
+        page, next_cursor = home_timeline_page(request.user, request.GET)
+    except ValueError as e:
+        return JsonResponse({"errors": str(e)}, status=400)
+
+    response = render_json(build_echo_page(page, request))
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@api_view(["GET"])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def search_echoes(request):
+    # Check the search query
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return JsonResponse({"errors": "Search query cannot be empty"}, status=400)
+
+    # Get the echoes matching the query, best match first
+    try:
+        page, next_cursor = search_page(query, request.GET)
+    except ValueError as e:
+        return JsonResponse({"errors": str(e)}, status=400)
+
+    response = render_json(build_echo_page(page, request))
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@api_view(["GET"])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def trending_echoes(request):
+    # Get the hottest echoes first
+    try:
+        page, next_cursor = trending_page(request.GET)
+    except ValueError as e:
+        return JsonResponse({"errors": str(e)}, status=400)
+
+    response = render_json(build_echo_page(page, request))
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@csrf_exempt
+@api_view(["POST"])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def follow_user(request, user_id):
+    # Check the user to follow
+    if user_id == request.user.id:
+        return JsonResponse({"errors": "You cannot follow yourself"}, status=400)
+    followee = get_object_or_404(Profile.objects.only("id"), user_id=user_id)
+
+    # Follow/Unfollow the user
+    is_following = toggle_follow(request.user, user_id)
+    followee.refresh_from_db(fields=["follower_count"])
+
+    return JsonResponse(
+        {
+            "id": user_id,
+            "is_following": is_following,
+            "followers": followee.follower_count,
+        }
+    )
 
 
 @api_view(["POST"])
 @parser_classes([MultiPartParser, FormParser])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def upload_profile_pic(request):
-    user = request.user
+    # Load a fresh User to write to rather than the shared cached instance
+    user = get_object_or_404(User.objects.select_related("profile"), id=request.user.id)
     profile_pic = request.FILES.get("profile_picture")
 
+    # Oversize uploads are cut off while parsing, before being stored
+    if getattr(request, "upload_too_large", False):
+        return JsonResponse({"message": "File too large"}, status=413)
+
     if profile_pic:
-        # Delete the old profile picture if it exists
+        # Delete the old profile picture and its thumbnails if unused
         if user.profile.profile_picture:
-            user.profile.profile_picture.delete(save=False)
-        # Save the new profile picture
+            release_picture(user.profile)
+        # Save the new profile picture and render its thumbnails off-thread
+        user.profile.renditions = {}
         user.profile.profile_picture.save(profile_pic.name, profile_pic)
-        user.save()
+        schedule_renditions(user.profile)
+        bump_feed_version()
 
         profile_picture_url = request.build_absolute_uri(
             user.profile.profile_picture.url
@@ -315,3 +543,47 @@ def upload_profile_pic(request):
             status=201,
         )
     return JsonResponse({"message": "No file uploaded"}, status=400)
+
+
+def media_etag(request, path):
+    # Content-addressed names are the hash of the bytes they hold
+    stat = os.stat(media_path(path))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if is_content_addressed(path) else f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def media_last_modified(request, path):
+    return datetime.fromtimestamp(os.stat(media_path(path)).st_mtime, tz=timezone.utc)
+
+
+def media_path(path):
+    try:
+        full_path = default_storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return full_path
+
+
+@require_GET
+@condition(etag_func=media_etag, last_modified_func=media_last_modified)
+def serve_media(request, path):
+    response = FileResponse(open(media_path(path), "rb"))
+    if is_content_addressed(path):
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response["Cache-Control"] = "public, max-age=3600"
+    return response
+
+
+@require_GET
+def metrics(request):
+    token = settings.METRICS["TOKEN"]
+    if token and not secrets.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return JsonResponse({"errors": "Invalid metrics token"}, status=401)
+    return HttpResponse(
+        exposition(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
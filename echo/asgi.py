@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "echo.settings")
+# Serve the API from the native async views
+os.environ.setdefault("ROOT_URLCONF", "echo.asgi_urls")
 
 application = get_asgi_application()
@@ -0,0 +1,17 @@
+"""
+URL configuration used by echo.asgi, routing the API to the native async
+views in core.async_views.
+"""
+
+from django.conf import settings
+from django.contrib import admin
+from django.urls import include, path
+
+from core.views import metrics, serve_media
+
+urlpatterns = [
+    path("admin/", admin.site.urls),
+    path("metrics", metrics, name="metrics"),
+    path("api/", include("core.async_urls")),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name="media"),
+]
@@ -34,6 +34,7 @@ DEBUG = False
 ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS").split(" ")
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ["X-Next-Cursor"]
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
@@ -48,6 +49,15 @@ SIMPLE_JWT = {
     "USER_ID_CLAIM": "user_id",
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_OBTAIN_SERIALIZER": "core.serializers.CustomTokenObtainPairSerializer",
+    # Logins go through core.last_login's buffer instead
+    "UPDATE_LAST_LOGIN": False,
+}
+
+# last_login times are buffered per process and written in one UPDATE every
+# FLUSH_INTERVAL seconds, or sooner once MAX_PENDING users have logged in
+LAST_LOGIN = {
+    "FLUSH_INTERVAL": 30,
+    "MAX_PENDING": 500,
 }
 
 
@@ -68,6 +78,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
+    "core.routers.ReplicaRoutingMiddleware",
+    "core.ratelimit.RateLimitMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -80,12 +93,13 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "core.authentication.ClaimsJWTAuthentication",
     ],
 }
 
 
-ROOT_URLCONF = "echo.urls"
+# echo.asgi switches to echo.asgi_urls, which routes to the async views
+ROOT_URLCONF = os.getenv("ROOT_URLCONF", "echo.urls")
 
 TEMPLATES = [
     {
@@ -117,7 +131,152 @@ DATABASES = {
         "PASSWORD": os.getenv("DB_PASSWORD"),
         "HOST": os.getenv("DB_HOST"),
         "PORT": os.getenv("DB_PORT"),
+        # Keep connections open between requests, checking them before reuse
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+    }
+}
+
+# A real pool (psycopg_pool) instead of persistent connections
+if os.getenv("DB_POOL_MAX_SIZE"):
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE")),
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        }
+    }
+
+# Read replicas: comma-separated hosts, or database files for SQLite. They
+# share the primary's credentials and mirror it in tests.
+for n, replica in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(","))):
+    location = "NAME" if "sqlite" in (DATABASES["default"]["ENGINE"] or "") else "HOST"
+    DATABASES[f"replica{n + 1}"] = {
+        **DATABASES["default"],
+        location: replica.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+# Views whose reads go to the replicas, and how long a write pins its user
+# to the primary
+DATABASE_REPLICAS = {
+    "ALIASES": [alias for alias in DATABASES if alias != "default"],
+    "VIEWS": ["list_echoes", "list_liked_echoes", "list_echoes_no_auth"],
+    "STICKY_SECONDS": 10,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# Feed pages and their version, feed validators, deactivated users and rate
+# limit buckets are meant to be seen by every worker: production needs a
+# shared cache, e.g. REDIS_URL. The LocMemCache fallback is per process, so
+# a write only invalidates the feed pages of the worker that handled it and
+# the others serve stale pages for up to FEED_CACHE["TIMEOUT"] seconds, and
+# the feeds send no ETag or Last-Modified.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
     }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": os.getenv(
+                "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+            ),
+            "LOCATION": os.getenv("CACHE_LOCATION", ""),
+        }
+    }
+
+# In-process cache of active users for endpoints that need the User model;
+# profile changes in one worker reach the others within TIMEOUT seconds. With
+# a per-process default cache, token authentication checks it too, so a
+# deactivated user also keeps access to other workers for up to TIMEOUT.
+AUTH_USER_CACHE = {
+    "MAX_SIZE": 10000,
+    "TIMEOUT": 60,
+}
+
+# Cache of the public feed pages, invalidated on every write; shared by the
+# workers only when ALIAS is a shared cache (see CACHES)
+FEED_CACHE = {
+    "ALIAS": "default",
+    "TIMEOUT": 60,
+    # Seconds a rebuild may hold the lock, and others may wait for it
+    "LOCK_TIMEOUT": 10,
+    "LOCK_WAIT": 2.0,
+}
+
+# Comment previews per echo in compact feeds (?compact=1); the rest are
+# paged from /api/echoes/<id>/comments/
+FEED_COMMENTS = {
+    "PREVIEWS": 3,
+}
+
+# Home timelines are materialized on write, except for authors with at
+# least CELEBRITY_FOLLOWERS followers, whose echoes are pulled at read time
+TIMELINE = {
+    "CELEBRITY_FOLLOWERS": 10000,
+    # Recent echoes copied into a timeline when following someone
+    "BACKFILL": 50,
+}
+
+# POST /api/batch/ applies queued client actions in one transaction;
+# idempotency keys are remembered for KEY_TTL seconds
+BATCH_WRITES = {
+    "MAX_OPERATIONS": 500,
+    "KEY_TTL": 7 * 24 * 60 * 60,
+}
+
+# Feed responses are encoded with orjson when it is installed (BACKEND None)
+JSON_RENDERING = {
+    "BACKEND": None,
+}
+
+# Trending scores are ln(1 + weighted likes and comments) plus a recency
+# term: an echo's engagement must double every HALF_LIFE to keep its rank.
+# Run rebuild_trending after changing these.
+TRENDING = {
+    "LIKE_WEIGHT": 1.0,
+    "COMMENT_WEIGHT": 3.0,
+    "HALF_LIFE": timedelta(hours=12),
+}
+
+# Echoes older than HORIZON are moved to the archive tables by the
+# archive_echoes command, BATCH_SIZE echoes per transaction
+ARCHIVE = {
+    "HORIZON": timedelta(days=365),
+    "BATCH_SIZE": 500,
+}
+
+# Full-text search; CONFIG is the PostgreSQL text search configuration
+SEARCH = {
+    "CONFIG": "english",
+}
+
+# Live feed events streamed by core.async_views.stream_events. LocalBackend
+# only reaches streams served by the process that handled the write, so the
+# writes of WSGI workers never reach the ASGI streams; on PostgreSQL events
+# go through LISTEN/NOTIFY to every process instead.
+EVENT_BUS = {
+    "BACKEND": (
+        "core.events.PostgresNotifyBackend"
+        if "postgresql" in (DATABASES["default"]["ENGINE"] or "")
+        else "core.events.LocalBackend"
+    ),
+    "OPTIONS": {},
+    "REPLAY_SIZE": 1000,
+    "QUEUE_SIZE": 256,
+    # Seconds between keep-alive comments, milliseconds before reconnecting
+    "HEARTBEAT": 15,
+    "RETRY": 3000,
 }
 
 
@@ -139,6 +298,77 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# PBKDF2 iterations come from PASSWORD_HASHING; hashes made with other
+# parameters, or by a later hasher in this list, are upgraded on login
+PASSWORD_HASHERS = [
+    "core.passwords.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+AUTHENTICATION_BACKENDS = ["core.authentication.PooledModelBackend"]
+
+# Password hashing runs on a pool of WORKERS processes (inline when 0);
+# beyond MAX_PENDING queued jobs per web process, requests get a 503
+PASSWORD_HASHING = {
+    "WORKERS": int(os.getenv("PASSWORD_HASH_WORKERS", 2)),
+    "MAX_PENDING": 8,
+    "RETRY_AFTER": 1,
+    # Added to the pool processes' niceness
+    "NICE": 10,
+    # None keeps Django's default iteration count
+    "PBKDF2_ITERATIONS": None,
+}
+
+# Token buckets per URL name: RATE tokens per second/minute/hour/day refill
+# a bucket of BURST, per user or, with "KEY": "ip" and for anonymous
+# requests, per client IP. OPERATIONS charges each operation of a batch to
+# the bucket of its single-write endpoint. The "cache" backend shares
+# buckets between workers through CACHE_ALIAS; "local", or a CACHE_ALIAS on
+# the LocMemCache fallback, keeps them per process, so N workers allow N
+# times each rate (flagged by the deploy checks).
+RATE_LIMITS = {
+    "ENABLED": os.getenv("RATE_LIMITS", "on") != "off",
+    "BACKEND": "cache",
+    "CACHE_ALIAS": "default",
+    # e.g. "X-Forwarded-For" behind a proxy that sets it
+    "CLIENT_IP_HEADER": os.getenv("CLIENT_IP_HEADER"),
+    "POLICIES": {
+        "create_echo": {"RATE": "30/m", "BURST": 10},
+        "create_comment": {"RATE": "60/m", "BURST": 20},
+        "like_echo": {"RATE": "120/m", "BURST": 30},
+        "batch_write": {
+            "RATE": "30/m",
+            "BURST": 10,
+            "OPERATIONS": {
+                "echo": "create_echo",
+                "comment": "create_comment",
+                "like": "like_echo",
+                "unlike": "like_echo",
+            },
+        },
+        "follow_user": {"RATE": "60/m", "BURST": 20},
+        "register_user": {"RATE": "10/h", "BURST": 5, "KEY": "ip"},
+        "login_user": {"RATE": "20/m", "BURST": 10, "KEY": "ip"},
+    },
+}
+
+# Per-request metrics served at /metrics. Under gunicorn, point
+# MULTIPROCESS_DIR at a directory shared by the workers (emptied on startup)
+# so a scrape sees all of them. A SLOW_SAMPLE_RATE share of requests, picked
+# when they start, keep their queries and are logged with them if slower
+# than SLOW_REQUEST_SECONDS; None disables it.
+METRICS = {
+    "MULTIPROCESS_DIR": os.getenv("METRICS_MULTIPROC_DIR"),
+    "FLUSH_INTERVAL": 5,
+    "SLOW_REQUEST_SECONDS": 0.5,
+    "SLOW_SAMPLE_RATE": 0.1,
+    # Required as a bearer token by /metrics when set
+    "TOKEN": os.getenv("METRICS_TOKEN"),
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -161,6 +391,31 @@ STATIC_URL = "static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+STORAGES = {
+    "default": {"BACKEND": "core.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+MEDIA_STORAGE = {
+    "MAX_UPLOAD_SIZE": 5 * 1024 * 1024,
+}
+
+FILE_UPLOAD_HANDLERS = [
+    "core.storage.MaxUploadSizeHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Square avatar thumbnails rendered after each profile picture upload;
+# WORKERS = 0 renders them inline instead of on a background thread pool
+AVATAR_RENDITIONS = {
+    "SIZES": [48, 96, 256],
+    "DEFAULT_SIZE": 96,
+    "FORMAT": "WEBP",
+    "QUALITY": 80,
+    "WORKERS": 2,
+}
+
 # DOMAIN_URL = "http://127.0.0.1:8000"
 DOMAIN_URL = os.getenv("DOMAIN_URL")
 